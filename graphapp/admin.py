@@ -4,4 +4,7 @@ from .models import *
 admin.site.register(Post)
 admin.site.register(Author)
 admin.site.register(Comment)
-admin.site.register(ReadingList)  
\ No newline at end of file
+admin.site.register(ReadingList)
+admin.site.register(ReadingListEntry)
+admin.site.register(PostLike)
+admin.site.register(CommentLike)  
\ No newline at end of file
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class GraphappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'graphapp'
+
+    def ready(self):
+        from . import signals
@@ -0,0 +1,140 @@
+import copy
+import time
+from collections import OrderedDict, defaultdict
+from threading import Lock
+from django.contrib.auth import authenticate
+from graphql_jwt import backends, middleware
+from graphql_jwt.exceptions import JSONWebTokenError
+from graphql_jwt.settings import jwt_settings
+from graphql_jwt.utils import get_credentials, get_payload, get_user_by_payload
+from .conf import app_setting
+
+
+_token_cache = None
+
+
+
+
+class TokenCache:
+    """ Per-process LRU of verified tokens and the users they belong to.
+
+        An entry lives until the token expires or for timeout seconds,
+        whichever comes first. Users are handed out as copies so requests
+        never share an instance. Invalidation only reaches this process,
+        the timeout bounds how stale the others can be. """
+
+    def __init__(self, maxsize, timeout):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        # token -> (expires, user)
+        self.entries = OrderedDict()
+        # user pk -> its cached tokens
+        self.tokens = defaultdict(set)
+        self.lock = Lock()
+
+    def get(self, token):
+        with self.lock:
+            entry = self.entries.get(token)
+            if entry is None:
+                return None
+            expires, user = entry
+            if expires <= time.time():
+                self.discard(token)
+                return None
+            self.entries.move_to_end(token)
+        return copy.copy(user)
+
+    def set(self, token, user, exp=None):
+        if not self.maxsize or not self.timeout:
+            return
+        expires = time.time() + self.timeout
+        if exp is not None:
+            expires = min(expires, exp)
+        with self.lock:
+            self.discard(token)
+            self.entries[token] = (expires, copy.copy(user))
+            self.tokens[user.pk].add(token)
+            while len(self.entries) > self.maxsize:
+                self.discard(next(iter(self.entries)))
+
+    def discard(self, token):
+        # callers hold the lock
+        entry = self.entries.pop(token, None)
+        if entry is not None:
+            tokens = self.tokens[entry[1].pk]
+            tokens.discard(token)
+            if not tokens:
+                del self.tokens[entry[1].pk]
+
+    def invalidate_user(self, pk):
+        with self.lock:
+            for token in list(self.tokens.get(pk, ())):
+                self.discard(token)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.tokens.clear()
+
+
+
+
+def get_token_cache():
+    global _token_cache
+    if _token_cache is None:
+        _token_cache = TokenCache(app_setting('JWT_CACHE_SIZE'), app_setting('JWT_CACHE_TIMEOUT'))
+    return _token_cache
+
+
+
+class JSONWebTokenBackend(backends.JSONWebTokenBackend):
+    """ graphql_jwt's backend, verifying each token and loading its user
+        once per process instead of once per request """
+
+    def authenticate(self, request=None, **kwargs):
+        if request is None or getattr(request, "_jwt_token_auth", False):
+            return None
+
+        token = get_credentials(request, **kwargs)
+        if token is None:
+            return None
+
+        cache = get_token_cache()
+        user = cache.get(token)
+        if user is None:
+            payload = get_payload(token, request)
+            user = get_user_by_payload(payload)
+            if user is not None:
+                cache.set(token, user, payload.get('exp'))
+        return user
+
+
+
+class JSONWebTokenMiddleware(middleware.JSONWebTokenMiddleware):
+    """ Authenticates the request on the first field that needs it and
+        remembers the outcome, instead of trying again on every field when
+        the token has no user or fails to verify """
+
+    def resolve(self, next, root, info, **kwargs):
+        if jwt_settings.JWT_ALLOW_ARGUMENT:
+            return super().resolve(next, root, info, **kwargs)
+
+        context = info.context
+        error = getattr(context, '_jwt_error', None)
+        if error is not None:
+            raise error
+        if (
+            not getattr(context, '_jwt_authenticated', False)
+            and middleware._authenticate(context)
+            and self.authenticate_context(info, **kwargs)
+        ):
+            context._jwt_authenticated = True
+            try:
+                user = authenticate(request=context, **kwargs)
+            except JSONWebTokenError as e:
+                context._jwt_error = e
+                raise
+            if user is not None:
+                context.user = user
+
+        return next(root, info, **kwargs)
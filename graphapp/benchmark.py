@@ -0,0 +1,235 @@
+import random
+import statistics
+from datetime import timedelta
+from django.contrib.auth.models import User
+from django.db import connection
+from django.utils import timezone
+from .feed import fan_out
+from .models import *
+from .signals import count_rows
+from .trending import refresh_scores
+
+
+WORDS = ('graphql django query cache index author post comment reading list feed latency '
+         'throughput python database schema resolver loader cursor page token image').split()
+
+
+
+
+def zipf_weights(n, skew):
+    """ Weight of the i-th most popular item; skew 0 is uniform, 1 is Zipf """
+    return [1 / (i + 1) ** skew for i in range(n)]
+
+
+
+def seed_data(authors=50, users=500, posts=5000, comments=20000, subscriptions=5, lists=2, list_size=10,
+              skew=1.0, days=365, seed=0, batch_size=1000, prefix='bench', log=None):
+    """ Fills the database with a blog whose posts, comments and subscribers
+        concentrate on a few popular authors and posts. The same arguments
+        always produce the same data. """
+    rng = random.Random(seed)
+    log = log or (lambda message: None)
+    now = timezone.now()
+
+    users = User.objects.bulk_create([User(username=f'{prefix}{i}') for i in range(users)], batch_size=batch_size)
+    authors = Author.objects.bulk_create([
+        Author(name=f'{rng.choice(WORDS).title()} {rng.choice(WORDS).title()} {i}', image='media/images/images.jpg')
+        for i in range(authors)
+    ], batch_size=batch_size)
+    author_weights = zipf_weights(len(authors), skew)
+    log(f"{len(users)} users, {len(authors)} authors")
+
+    Subscription = Author.subscribers.through
+    Subscription.objects.bulk_create([
+        Subscription(author=author, user=user)
+        for user in users
+        for author in dict.fromkeys(rng.choices(authors, author_weights, k=subscriptions))
+    ], batch_size=batch_size)
+
+    new_posts = []
+    for i in range(posts):
+        content = ' '.join(rng.choices(WORDS, k=rng.randint(50, 1000)))
+        new_posts.append(Post(
+            author=rng.choices(authors, author_weights)[0], title=' '.join(rng.choices(WORDS, k=4))[:40],
+            content=content, likes=0, time_to_read=Post.reading_time(content),
+        ))
+    posts = Post.objects.bulk_create(new_posts, batch_size=batch_size)
+    # auto_now_add stamped them all with the same moment
+    for post in posts:
+        post.date = now - timedelta(seconds=rng.uniform(0, days * 86400))
+    Post.objects.bulk_update(posts, ['date'], batch_size=batch_size)
+    log(f"{len(posts)} posts")
+
+    post_weights = zipf_weights(len(posts), skew)
+    rng.shuffle(post_weights)
+    new_comments = Comment.objects.bulk_create([
+        Comment(author=rng.choice(users), post=post, text=' '.join(rng.choices(WORDS, k=rng.randint(3, 40))), likes=0)
+        for post in rng.choices(posts, post_weights, k=comments - comments // 4)
+    ], batch_size=batch_size)
+    # a quarter of the comments answer another one
+    new_comments += Comment.objects.bulk_create([
+        Comment(author=rng.choice(users), post_id=parent.post_id, parent=parent, text=' '.join(rng.choices(WORDS, k=rng.randint(3, 40))), likes=0)
+        for parent in rng.choices(new_comments, k=comments // 4)
+    ], batch_size=batch_size)
+    log(f"{len(new_comments)} comments")
+
+    reading_lists = ReadingList.objects.bulk_create([
+        ReadingList(user=user, name=f'List {n}') for user in users for n in range(lists)
+    ], batch_size=batch_size)
+    ReadingListEntry.objects.bulk_create([
+        ReadingListEntry(reading_list=reading_list, post=post, position=position)
+        for reading_list in reading_lists
+        for position, post in enumerate(dict.fromkeys(rng.choices(posts, post_weights, k=list_size)))
+    ], batch_size=batch_size)
+    log(f"{len(reading_lists)} reading lists")
+
+    Post.objects.update(comment_count=count_rows(Comment, 'post_id'))
+    Author.objects.update(subscriber_count=count_rows(Author.subscribers.through, 'author_id'))
+    for start in range(0, len(posts), batch_size):
+        fan_out(posts[start:start + batch_size])
+    log("timelines written")
+    refresh_scores(full=True, batch_size=batch_size)
+    log("trending scores")
+
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+
+
+# representative operations, `variables` picks its arguments from fixtures().
+# Each is named after its key, which is what query budgets are looked up by.
+
+OPERATIONS = {
+    'allPosts': {
+        'query': '''query allPosts($after: String) { allPosts(first: 20, after: $after) {
+                      edges { node { id title date timeToRead commentCount author { name } } } pageInfo { endCursor } } }''',
+        'variables': lambda f: {},
+    },
+    'allPostsNested': {
+        'query': '''query allPostsNested { allPosts(first: 10) { edges { node { title author { name subscriberCount }
+                      comments(first: 5) { edges { node { text author { username } } } } } } } }''',
+        'variables': lambda f: {},
+    },
+    'post': {
+        'query': '''query post($id: Int) { post(id: $id) { title content likes author { name imageUrl { url } }
+                      comments(first: 20) { edges { node { text likes author { username }
+                        replies(first: 3) { edges { node { text author { username } } } } } } } } }''',
+        'variables': lambda f: {'id': f['rng'].choice(f['commented_posts'] or f['posts'])},
+    },
+    'topComments': {
+        'query': '''query topComments { allPosts(first: 20) { edges { node { title commentCount
+                      comments(first: 3, orderBy: LIKES) { edges { node { text likes author { username } } } } } } } }''',
+        'variables': lambda f: {},
+    },
+    'authors': {
+        'query': '''query authors { authors(first: 10) { edges { node { name subscriberCount imageUrl { url width height }
+                      postSet(first: 5) { edges { node { title } } } } } } }''',
+        'variables': lambda f: {},
+    },
+    'authorsByName': {
+        'query': '''query authorsByName($name: String) { authorsByName(name: $name, first: 10) { edges { node { name } } } }''',
+        'variables': lambda f: {'name': f['rng'].choice(f['author_names'])[:3]},
+    },
+    'comments': {
+        'query': 'query comments { comments(first: 20) { edges { node { text date author { username } } } } }',
+        'variables': lambda f: {},
+    },
+    'searchPosts': {
+        'query': '''query searchPosts($query: String!) { searchPosts(query: $query, first: 10) { edges { node { title snippet } } } }''',
+        'variables': lambda f: {'query': f['rng'].choice(WORDS)},
+        'postgresql': True,
+    },
+    'myFeed': {
+        'query': 'query myFeed { myFeed(first: 20) { edges { node { title author { name } } } } }',
+        'variables': lambda f: {},
+        'auth': True,
+    },
+    'trendingPosts': {
+        'query': 'query trendingPosts { trendingPosts(window: WEEK, first: 20) { title likes commentCount author { name } } }',
+        'variables': lambda f: {},
+    },
+    'popularAuthors': {
+        'query': 'query popularAuthors { popularAuthors(first: 10) { name subscriberCount } }',
+        'variables': lambda f: {},
+    },
+    'myReadingLists': {
+        'query': '''query myReadingLists { myReadingLists(first: 5) { edges { node { name
+                      entries(first: 10) { edges { node { position post { title } } } } } } } }''',
+        'variables': lambda f: {},
+        'auth': True,
+    },
+    'createPost': {
+        'query': '''mutation createPost($author: ID!) { createPost(authorId: $author, title: "bench", content: "bench post", likes: 0) {
+                      post { id } } }''',
+        'variables': lambda f: {'author': f['rng'].choice(f['authors'])},
+        'mutation': True,
+    },
+    'createPosts': {
+        'query': '''mutation createPosts($input: [PostInput!]!) { createPosts(input: $input) { posts { id } errors { index } } }''',
+        'variables': lambda f: {'input': [
+            {'authorId': f['rng'].choice(f['authors']), 'title': 'bench', 'content': 'bench post'} for _ in range(10)
+        ]},
+        'mutation': True,
+    },
+    'createComments': {
+        'query': '''mutation createComments($input: [CommentInput!]!) { createComments(input: $input) { errors { index } } }''',
+        'variables': lambda f: {'input': [{'postId': f['rng'].choice(f['posts']), 'text': 'bench'} for _ in range(10)]},
+        'auth': True,
+        'mutation': True,
+    },
+    'likePost': {
+        'query': 'mutation likePost($id: ID!) { likePost(postId: $id) { post { likes } } }',
+        'variables': lambda f: {'id': f['rng'].choice(f['posts'])},
+        'auth': True,
+        'mutation': True,
+    },
+    'subscribeToAuthor': {
+        'query': 'mutation subscribeToAuthor($id: ID!) { subscribeToAuthor(authorId: $id) { user { id } } }',
+        'variables': lambda f: {'id': f['rng'].choice(f['unfollowed_authors'] or f['authors'])},
+        'auth': True,
+        'mutation': True,
+    },
+    'addToReadingList': {
+        'query': '''mutation addToReadingList($list: ID!, $post: ID!) { addToReadingList(listId: $list, postId: $post) {
+                      readingList { id } } }''',
+        'variables': lambda f: {'list': f['reading_list'], 'post': f['rng'].choice(f['posts'])},
+        'auth': True,
+        'mutation': True,
+    },
+}
+
+
+
+def fixtures(user, seed=0):
+    """ Ids the operations pick their arguments from, the same ones for
+        the same data and seed """
+    rng = random.Random(seed)
+    reading_list, _ = ReadingList.objects.get_or_create(user=user, name='Benchmark')
+    posts = list(Post.objects.order_by('id').values_list('id', flat=True))
+    authors = Author.objects.order_by('id')
+    return {
+        'rng': rng,
+        'posts': rng.sample(posts, min(len(posts), 1000)),
+        'commented_posts': list(Post.objects.filter(comment_count__gt=0).order_by('id').values_list('id', flat=True)[:1000]),
+        'authors': list(authors.values_list('id', flat=True)),
+        'unfollowed_authors': list(authors.exclude(subscribers=user).values_list('id', flat=True)),
+        'author_names': list(authors.values_list('name', flat=True)),
+        'reading_list': reading_list.id,
+    }
+
+
+
+def summary(timings, elapsed):
+    timings = sorted(timings)
+
+    def percentile(p):
+        return round(timings[max(0, int(len(timings) * p) - 1)] * 1000, 1)
+
+    return {
+        'requests': len(timings),
+        'requests_per_second': round(len(timings) / elapsed, 1),
+        'p50_ms': round(statistics.median(timings) * 1000, 1),
+        'p95_ms': percentile(0.95),
+        'p99_ms': percentile(0.99),
+    }
@@ -0,0 +1,75 @@
+import os
+from django.conf import settings
+
+
+DEFAULTS = {
+    # largest list a single field may resolve to
+    'LIST_MAX_ITEMS': 500,
+    # 'truncate' silently cuts longer lists, 'reject' fails the field
+    'LIST_OVERFLOW': 'truncate',
+    # parsed and validated documents kept per process
+    'DOCUMENT_CACHE_SIZE': 1000,
+    # automatic persisted queries are stored in this django cache
+    'PERSISTED_QUERIES_CACHE': 'default',
+    'PERSISTED_QUERIES_TIMEOUT': None,
+    # JSON file of {sha256: query}; when set only those queries can run
+    'PERSISTED_QUERIES_ALLOWLIST': None,
+    # static query cost budget, checked before any resolver runs
+    'QUERY_MAX_COST': 10000,
+    'QUERY_MAX_DEPTH': 10,
+    # assumed size of list fields that take no first/last argument
+    'COST_LIST_SIZE': 10,
+    # per field weights, e.g. {'PostType.content': 2}
+    'FIELD_COSTS': {},
+    # responses of anonymous queries are cached here for this many seconds, 0 disables
+    'RESPONSE_CACHE': 'default',
+    'RESPONSE_CACHE_TIMEOUT': 60,
+    # authors with more subscribers than this are not fanned out on write,
+    # their posts are merged into each feed when it is read
+    'FEED_FANOUT_MAX_SUBSCRIBERS': 10000,
+    # latest posts of an author copied into a feed on subscribe
+    'FEED_BACKFILL_POSTS': 100,
+    # bounding box in pixels of each resized author image
+    'IMAGE_VARIANTS': {'thumb': 128, 'medium': 640},
+    # processes of process_images rendering image variants, 0 renders them in the saving thread instead
+    'IMAGE_WORKERS': 2,
+    # verified JWTs and their users kept per process, for at most this many seconds
+    'JWT_CACHE_SIZE': 1000,
+    'JWT_CACHE_TIMEOUT': 60,
+    # clients may ask for an Apollo-style trace with {"extensions": {"tracing": true}}
+    'TRACING': False,
+    # time every execution and serve the histograms on /metrics
+    'METRICS': False,
+    'METRICS_MAX_SERIES': 1000,
+    # log operations running more SQL queries than their baseline count,
+    # or than QUERY_BUDGET when the baseline doesn't know the operation
+    'QUERY_COUNT_DEBUG': False,
+    'QUERY_BUDGET': 30,
+    'QUERY_BASELINE': os.path.join(os.path.dirname(__file__), 'query_counts.json'),
+    # delivers subscription events; InMemoryPubSub only reaches the subscribers of
+    # its own process, run PostgresPubSub when serving from more than one
+    'PUBSUB_BACKEND': 'graphapp.pubsub.InMemoryPubSub',
+    # events a subscriber may fall behind by before it starts losing them
+    'SUBSCRIPTION_QUEUE_SIZE': 100,
+    # seconds a WebSocket has to send connection_init
+    'WEBSOCKET_INIT_TIMEOUT': 10,
+    # database aliases GraphQL queries read from, with ReplicaRouter in DATABASE_ROUTERS
+    'READ_REPLICAS': [],
+    # a client reads from the primary for this long after a mutation
+    'READ_YOUR_WRITES_SECONDS': 5,
+    # a replica that failed to connect is left alone for this long
+    'REPLICA_RETRY_SECONDS': 30,
+    # how much each kind of activity adds to a post's trending score
+    'TRENDING_WEIGHTS': {'post': 1, 'like': 1, 'comment': 3, 'reading_list': 2},
+    # the trendingPosts window popularAuthors ranks authors by
+    'POPULAR_AUTHORS_WINDOW': 'month',
+    # seconds before the last refresh_trending run that the next one looks back from
+    'TRENDING_REFRESH_OVERLAP': 300,
+}
+
+
+
+
+def app_setting(name):
+    """ Reads a graphapp option from settings.GRAPHAPP, falling back to DEFAULTS """
+    return getattr(settings, 'GRAPHAPP', {}).get(name, DEFAULTS[name])
@@ -0,0 +1,118 @@
+from graphene.relay import Connection
+from graphene_django.settings import graphene_settings
+from graphql import (
+    FieldNode, FragmentSpreadNode, GraphQLError, InlineFragmentNode, ValidationRule,
+    get_named_type, is_leaf_type, is_list_type, is_non_null_type,
+)
+from graphql.execution.values import get_argument_values
+from .conf import app_setting
+
+
+
+
+def list_size(field_def, node, variables, parent_type):
+    """ How many items a field multiplies its selections by """
+    if 'first' in field_def.args or 'last' in field_def.args:
+        try:
+            args = get_argument_values(field_def, node, variables)
+        except GraphQLError:
+            args = {}
+        for name in ('first', 'last'):
+            if args.get(name) is not None:
+                # a negative size is rejected when the field resolves
+                return max(args[name], 0)
+        return graphene_settings.RELAY_CONNECTION_MAX_LIMIT or 1
+
+    field_type = field_def.type.of_type if is_non_null_type(field_def.type) else field_def.type
+    if is_list_type(field_type):
+        graphene_type = getattr(parent_type, 'graphene_type', None)
+        if graphene_type is not None and issubclass(graphene_type, Connection):
+            # edges were already counted by the connection field
+            return 1
+        return app_setting('COST_LIST_SIZE')
+    return 1
+
+
+
+class CostCalculator:
+    """ Static cost and depth of an operation: every object field costs its
+        weight (1 by default, leaves 0) times the sizes of the lists above it """
+
+    def __init__(self, context, variables):
+        self.context = context
+        self.schema = context.schema
+        self.variables = variables or {}
+        self.weights = app_setting('FIELD_COSTS')
+
+    def weight(self, parent_type, field_def, field_name):
+        default = 0 if is_leaf_type(get_named_type(field_def.type)) else 1
+        return self.weights.get(f'{parent_type.name}.{field_name}', default)
+
+    def measure(self, parent_type, selection_set, multiplier=1, depth=1, visited=()):
+        cost, max_depth = 0, depth - 1
+        for selection in selection_set.selections:
+            if isinstance(selection, FieldNode):
+                name = selection.name.value
+                if name.startswith('__'):
+                    continue
+                field_def = parent_type.fields.get(name)
+                if field_def is None:
+                    continue
+                cost += multiplier * self.weight(parent_type, field_def, name)
+                max_depth = max(max_depth, depth)
+                if selection.selection_set:
+                    size = list_size(field_def, selection, self.variables, parent_type)
+                    child_cost, child_depth = self.measure(
+                        get_named_type(field_def.type), selection.selection_set, multiplier * size, depth + 1, visited
+                    )
+                    cost += child_cost
+                    max_depth = max(max_depth, child_depth)
+            else:
+                if isinstance(selection, FragmentSpreadNode):
+                    name = selection.name.value
+                    fragment = self.context.get_fragment(name)
+                    if fragment is None or name in visited:
+                        continue
+                    visited = visited + (name,)
+                else:
+                    fragment = selection
+                type_condition = fragment.type_condition
+                fragment_type = self.schema.get_type(type_condition.name.value) if type_condition else parent_type
+                child_cost, child_depth = self.measure(fragment_type, fragment.selection_set, multiplier, depth, visited)
+                cost += child_cost
+                max_depth = max(max_depth, child_depth)
+        return cost, max_depth
+
+
+
+def query_cost_rule(variables, report):
+    """ Builds a validation rule that rejects operations over the
+        QUERY_MAX_COST / QUERY_MAX_DEPTH budgets. The measured cost of each
+        operation is written into the report dict. """
+
+    class QueryCostRule(ValidationRule):
+
+        def enter_operation_definition(self, node, *_args):
+            root_type = self.context.schema.get_root_type(node.operation)
+            if root_type is None:
+                return
+            cost, depth = CostCalculator(self.context, variables).measure(root_type, node.selection_set)
+            max_cost = app_setting('QUERY_MAX_COST')
+            max_depth = app_setting('QUERY_MAX_DEPTH')
+            report[node.name.value if node.name else None] = {
+                'requestedQueryCost': cost,
+                'maximumAvailable': max_cost,
+                'depth': depth,
+            }
+            if max_depth is not None and depth > max_depth:
+                self.report_error(GraphQLError(
+                    f"Operation depth {depth} exceeds the maximum depth of {max_depth}", node,
+                    extensions={'code': 'QUERY_TOO_DEEP'},
+                ))
+            if max_cost is not None and cost > max_cost:
+                self.report_error(GraphQLError(
+                    f"Operation cost {cost} exceeds the maximum cost of {max_cost}", node,
+                    extensions={'code': 'QUERY_TOO_COMPLEX'},
+                ))
+
+    return QueryCostRule
@@ -0,0 +1,92 @@
+import hashlib
+import json
+from collections import OrderedDict
+from threading import Lock
+from django.core.cache import caches
+from graphql import GraphQLError
+
+
+
+
+def query_hash(query):
+    return hashlib.sha256(query.encode('utf-8')).hexdigest()
+
+
+
+class DocumentCache:
+    """ Bounded LRU of parsed and validated documents keyed by query hash """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        if not self.maxsize:
+            return
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+
+class PersistedQueryNotFound(GraphQLError):
+    def __init__(self):
+        super().__init__('PersistedQueryNotFound', extensions={'code': 'PERSISTED_QUERY_NOT_FOUND'})
+
+
+
+class PersistedQueries:
+    """ Automatic persisted queries: clients send only the sha256 of a query
+        once the server has seen its text. With an allowlist file, only the
+        queries listed in it (a JSON object of hash -> query) can run. """
+
+    def __init__(self, cache_alias='default', timeout=None, allowlist=None):
+        self.cache_alias = cache_alias
+        self.timeout = timeout
+        self.allowlist = None
+        if allowlist:
+            with open(allowlist) as f:
+                self.allowlist = json.load(f)
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def resolve(self, query, extensions):
+        """ Returns the query text to run for a request """
+        persisted = (extensions or {}).get('persistedQuery') or {}
+        sha = persisted.get('sha256Hash')
+
+        if self.allowlist is not None:
+            sha = sha or (query and query_hash(query))
+            if sha not in self.allowlist:
+                raise GraphQLError('Query is not in the persisted query allowlist',
+                                   extensions={'code': 'PERSISTED_QUERY_NOT_ALLOWED'})
+            return self.allowlist[sha]
+
+        if not sha:
+            return query
+        if query:
+            if query_hash(query) != sha:
+                raise GraphQLError('provided sha does not match query',
+                                   extensions={'code': 'INVALID_PERSISTED_QUERY_HASH'})
+            self.cache.set(f'apq:{sha}', query, self.timeout)
+            return query
+        query = self.cache.get(f'apq:{sha}')
+        if query is None:
+            raise PersistedQueryNotFound()
+        return query
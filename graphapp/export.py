@@ -0,0 +1,127 @@
+import csv
+import json
+from asgiref.sync import sync_to_async
+from datetime import datetime, time
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from .models import *
+
+
+# each export is a projection of one table, streamed in (date, id) order.
+# `author` is the column the author filter applies to.
+EXPORTS = {
+    'posts': {
+        'model': Post,
+        'date': 'date',
+        'author': 'author_id',
+        'columns': ('id', 'date', 'author_id', 'author__name', 'title', 'content', 'likes', 'comment_count', 'time_to_read'),
+    },
+    'comments': {
+        'model': Comment,
+        'date': 'date',
+        'author': 'author_id',
+        'columns': ('id', 'date', 'author_id', 'author__username', 'post_id', 'parent_id', 'text', 'likes'),
+    },
+    'reading-lists': {
+        'model': ReadingListEntry,
+        'date': 'added',
+        'author': 'post__author_id',
+        'columns': ('id', 'added', 'reading_list_id', 'reading_list__name', 'reading_list__user_id', 'post_id', 'position'),
+    },
+}
+
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+
+def parse_since(value):
+    """ An ISO datetime, or a date meaning its midnight """
+    parsed = parse_datetime(value) or parse_date(value)
+    if parsed is None:
+        raise ValueError(f"Invalid date {value}")
+    if not isinstance(parsed, datetime):
+        parsed = datetime.combine(parsed, time())
+    return timezone.make_aware(parsed) if timezone.is_naive(parsed) else parsed
+
+
+
+def parse_checkpoint(value):
+    """ "<date>,<id>" of the last row received """
+    date, _, id = value.rpartition(',')
+    parsed = parse_datetime(date)
+    if parsed is None or not id.isdigit():
+        raise ValueError(f"Invalid checkpoint {value}, expected <date>,<id>")
+    return parsed, int(id)
+
+
+
+def export_rows(kind, since=None, author=None, after=None, chunk_size=2000):
+    """ Rows of an export as tuples of its columns, read through a server-side
+        cursor chunk_size at a time. after=(date, id) resumes past that row. """
+    spec = EXPORTS[kind]
+    date = spec['date']
+    queryset = spec['model'].objects.all()
+    if since is not None:
+        queryset = queryset.filter(**{f'{date}__gte': since})
+    if author is not None:
+        queryset = queryset.filter(**{spec['author']: author})
+    if after is not None:
+        # a range scan from the checkpoint's date, skipping the rows already seen at it
+        queryset = queryset.filter(**{f'{date}__gte': after[0]}).exclude(**{date: after[0], 'id__lte': after[1]})
+    return queryset.order_by(date, 'id').values_list(*spec['columns']).iterator(chunk_size=chunk_size)
+
+
+
+class Echo:
+    """ File-like object handing back what csv.writer writes """
+
+    def write(self, value):
+        return value
+
+
+
+def encode(value):
+    # full precision, a checkpoint has to match the stored date exactly
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+
+def stream(kind, format='ndjson', buffer_size=65536, **filters):
+    """ Yields the export as text in chunks of about buffer_size characters """
+    columns = [column.replace('__', '_') for column in EXPORTS[kind]['columns']]
+    if format == 'csv':
+        writer = csv.writer(Echo())
+        yield writer.writerow(columns)
+        render = lambda row: writer.writerow([encode(value) for value in row])
+    else:
+        render = lambda row: json.dumps(dict(zip(columns, map(encode, row)))) + '\n'
+
+    batch, size = [], 0
+    for row in export_rows(kind, **filters):
+        line = render(row)
+        batch.append(line)
+        size += len(line)
+        if size >= buffer_size:
+            yield ''.join(batch)
+            batch, size = [], 0
+    if batch:
+        yield ''.join(batch)
+
+
+
+async def stream_async(chunks):
+    """ chunks, a stream() generator, as an async iterator for ASGI, which
+        would otherwise read a sync one into a list before sending it. Each
+        chunk is read on the database thread, where its cursor lives. """
+    read = sync_to_async(next)
+    try:
+        while True:
+            chunk = await read(chunks, None)
+            if chunk is None:
+                return
+            yield chunk
+    finally:
+        await sync_to_async(chunks.close)()
@@ -0,0 +1,122 @@
+from collections import defaultdict
+from asgiref.sync import sync_to_async
+from django.db import connection
+from django.db.models import F, Q
+from .conf import app_setting
+from .loaders import get_loaders
+from .models import Author, Post, TimelineEntry
+from .pagination import KeysetConnectionField
+
+
+
+
+def fan_out(posts):
+    """ Writes new posts into the timeline of every subscriber of their
+        authors, in one INSERT per batch. Popular authors are skipped, their
+        posts are merged in when a feed is read. """
+    posts = list(posts)
+    subscriptions = Author.subscribers.through.objects.filter(
+        author_id__in={post.author_id for post in posts},
+        author__subscriber_count__lte=app_setting('FEED_FANOUT_MAX_SUBSCRIBERS'),
+    ).values_list('author_id', 'user_id')
+    subscribers = defaultdict(list)
+    for author_id, user_id in subscriptions:
+        subscribers[author_id].append(user_id)
+
+    TimelineEntry.objects.bulk_create([
+        TimelineEntry(user_id=user_id, post_id=post.id, author_id=post.author_id, date=post.date)
+        for post in posts
+        for user_id in subscribers[post.author_id]
+    ], batch_size=1000, ignore_conflicts=True)
+
+
+
+def fan_out_stored(post_ids):
+    """ fan_out() of posts that are already written, as one INSERT ... SELECT
+        so the timeline rows never pass through Python. For bulk imports. """
+    select = Author.subscribers.through.objects.filter(
+        author__post__in=post_ids,
+        author__subscriber_count__lte=app_setting('FEED_FANOUT_MAX_SUBSCRIBERS'),
+    ).values_list('user_id', 'author__post__id', 'author_id', 'author__post__date')
+    sql, params = select.query.sql_with_params()
+    meta = TimelineEntry._meta
+    columns = ', '.join(connection.ops.quote_name(meta.get_field(name).column) for name in ('user', 'post', 'author', 'date'))
+    with connection.cursor() as cursor:
+        cursor.execute(f'INSERT INTO {connection.ops.quote_name(meta.db_table)} ({columns}) {sql}', params)
+
+
+
+def backfill(user, author):
+    """ Copies the latest posts of an author into a new subscriber's timeline """
+    posts = Post.objects.filter(
+        author=author, author__subscriber_count__lte=app_setting('FEED_FANOUT_MAX_SUBSCRIBERS'),
+    ).order_by('-date', '-id').values_list('id', 'date')[:app_setting('FEED_BACKFILL_POSTS')]
+    TimelineEntry.objects.bulk_create([
+        TimelineEntry(user=user, post_id=post_id, author=author, date=date) for post_id, date in posts
+    ], ignore_conflicts=True)
+
+
+
+def prune(user, author):
+    """ Drops an author's posts from the timeline of a former subscriber """
+    TimelineEntry.objects.filter(user=user, author=author).delete()
+
+
+
+def feed_sources(queryset, user):
+    """ Splits a feed into the user's timeline and the posts of the popular
+        authors they follow, each annotated with the (feed_date, feed_post)
+        keyset it is ordered by. The timeline keys are its own columns, so
+        the cursor is a bound of the index scan rather than a filter. """
+    sources = [queryset.filter(timeline_entries__user=user).annotate(
+        feed_date=F('timeline_entries__date'), feed_post=F('timeline_entries__post'),
+    )]
+    popular = list(Author.objects.filter(
+        subscribers=user, subscriber_count__gt=app_setting('FEED_FANOUT_MAX_SUBSCRIBERS'),
+    ).values_list('id', flat=True))
+    if popular:
+        sources.append(queryset.filter(author_id__in=popular).annotate(feed_date=F('date'), feed_post=F('id')))
+    return sources, popular
+
+
+
+class FeedConnectionField(KeysetConnectionField):
+    """ The current user's feed. Without popular authors a page is one range
+        scan of the timeline index; following popular authors adds one query
+        over their posts, and the two pages are merged by their keys. """
+
+    def __init__(self, type_, *args, **kwargs):
+        kwargs.setdefault('keys', ('feed_date', 'feed_post'))
+        super().__init__(type_, *args, **kwargs)
+
+    def keyset_resolver(self, resolver, connection, default_manager, queryset_resolver, root, info, **args):
+        self.check_limits(info, args)
+        iterable = resolver(root, info, **args)
+        if iterable is None:
+            iterable = default_manager
+        queryset = queryset_resolver(connection, iterable, info, args)
+        user = info.context.user
+        if get_loaders(info).is_async:
+            return sync_to_async(self.resolve_feed)(connection, args, queryset, user)
+        return self.resolve_feed(connection, args, queryset, user)
+
+    def resolve_feed(self, connection, args, queryset, user):
+        sources, popular = feed_sources(queryset, user)
+        rows = {}
+        for source in sources:
+            page, limit, backwards = self.keyset_page(args, source)
+            for row in (page if limit is None else page[:limit + 1]):
+                # a post can be in both while its author crosses the threshold
+                rows.setdefault(row.pk, row)
+
+        rows = sorted(rows.values(), key=lambda row: (row.feed_date, row.feed_post), reverse=backwards != self.descending)
+        if limit is not None:
+            rows = rows[:limit + 1]
+
+        # totalCount counts the merged feed without the join on the timeline
+        counted = sources[0]
+        if popular:
+            counted = queryset.filter(
+                Q(pk__in=TimelineEntry.objects.filter(user=user).values('post')) | Q(author_id__in=popular)
+            )
+        return self.keyset_connection(connection, counted, rows, limit, backwards)
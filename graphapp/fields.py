@@ -0,0 +1,55 @@
+from asgiref.sync import sync_to_async
+from graphene_django.filter import DjangoFilterConnectionField
+from .loaders import get_loaders
+
+
+
+
+class ThreadedResolveMixin:
+    """ Under the async view, runs the synchronous connection resolver on
+        the database thread instead of the event loop """
+
+    def wrap_resolve(self, parent_resolver):
+        resolve = super().wrap_resolve(parent_resolver)
+
+        def resolver(root, info, **args):
+            if get_loaders(info).is_async:
+                return sync_to_async(resolve)(root, info, **args)
+            return resolve(root, info, **args)
+
+        return resolver
+
+
+
+class FilterConnectionField(ThreadedResolveMixin, DjangoFilterConnectionField):
+    pass
+
+
+
+class BatchedFilterConnectionField(ThreadedResolveMixin, DjangoFilterConnectionField):
+    """ Filter connection over a model relation that is loaded through the
+        request loaders instead of one query per parent object """
+
+    def __init__(self, type_, relation, *args, **kwargs):
+        self.relation = relation
+        super().__init__(type_, *args, **kwargs)
+
+    def get_queryset_resolver(self):
+        resolver = super().get_queryset_resolver()
+        relation = self.relation
+        model = self.model
+
+        def batched_resolver(connection, iterable, info, args):
+            instance = getattr(iterable, 'instance', None)
+            if instance is None:
+                return resolver(connection, iterable, info, args)
+            key = tuple(sorted((k, str(v)) for k, v in args.items() if k in self.filtering_args))
+            # loaded synchronously, under the async view this already runs on the database thread
+            if not key:
+                # unfiltered: reuse whatever the root queryset already prefetched
+                return get_loaders(info).loader(type(instance), relation).load(instance)
+            # filter the base queryset once, then load it for every sibling parent
+            queryset = resolver(connection, model._default_manager.all(), info, args)
+            return get_loaders(info).loader(type(instance), relation, queryset, key).load(instance)
+
+        return batched_resolver
@@ -0,0 +1,113 @@
+import hashlib
+import logging
+import os
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+from PIL import Image, ImageOps
+from .conf import app_setting
+
+
+# pillow format and extension of each variant file
+FORMATS = {'webp': 'WEBP', 'jpeg': 'JPEG'}
+
+# image_variants of an image that couldn't be rendered, which isn't tried again without --force
+FAILED = {'failed': True}
+
+logger = logging.getLogger(__name__)
+
+
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """ Stores uploads under the hash of their content. A name that already
+        exists holds the same bytes, so the upload is dropped instead of
+        being written again under a random suffix. """
+
+    def get_available_name(self, name, max_length=None):
+        return name
+
+    def _save(self, name, content):
+        if self.exists(name):
+            return name
+        return super()._save(name, content)
+
+
+
+def content_hash(file):
+    digest = hashlib.sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+
+def hashed_upload_to(instance, filename):
+    """ media/images/<sha256>.<ext> of the file being uploaded """
+    ext = os.path.splitext(filename)[1].lower()
+    return f'media/images/{content_hash(instance.image)}{ext}'
+
+
+
+def variant_name(name, size, format):
+    """ Storage name of a resized copy of the image stored at name """
+    directory, filename = os.path.split(name)
+    return f'{directory}/variants/{os.path.splitext(filename)[0]}/{size}.{format}'
+
+
+
+def render_variants(path, sizes):
+    """ Writes every size of the image at path as WebP and JPEG next to it.
+        Runs in the pool of process_images, so it only touches the filesystem.
+        Returns {size: [width, height]}, original included. """
+    with Image.open(path) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'RGBA'):
+            # LA, PA and palettes with a transparent color keep their alpha like RGBA
+            alpha = 'A' in image.getbands() or 'transparency' in image.info
+            image = image.convert('RGBA' if alpha else 'RGB')
+        dimensions = {'original': list(image.size)}
+        directory, filename = os.path.split(path)
+        target = os.path.join(directory, 'variants', os.path.splitext(filename)[0])
+        os.makedirs(target, exist_ok=True)
+        for size, box in sizes.items():
+            variant = image.copy()
+            variant.thumbnail((box, box), Image.LANCZOS)
+            variant.save(os.path.join(target, f'{size}.webp'), FORMATS['webp'], quality=80, method=4)
+            # jpeg has no alpha channel
+            variant.convert('RGB').save(os.path.join(target, f'{size}.jpeg'), FORMATS['jpeg'], quality=85, optimize=True, progressive=True)
+            dimensions[size] = list(variant.size)
+    return dimensions
+
+
+
+def save_variants(name, dimensions):
+    """ Records the variants on every author that uses the image """
+    from .models import Author
+    from .responses import invalidate
+    Author.objects.filter(image=name).update(image_variants=dimensions)
+    invalidate('Author')
+
+
+
+def process_image(name):
+    """ Reuses the variants of an image already rendered for another author.
+        New images are left for the process_images worker, request workers
+        don't fork a pool of their own, unless IMAGE_WORKERS is 0. """
+    from .models import Author
+    existing = Author.objects.filter(image=name).exclude(image_variants={}).values_list('image_variants', flat=True).first()
+    if existing:
+        save_variants(name, existing)
+        return
+
+    if app_setting('IMAGE_WORKERS'):
+        # image_variants stays empty, which process_images renders
+        return
+    path = Author._meta.get_field('image').storage.path(name)
+    try:
+        dimensions = render_variants(path, app_setting('IMAGE_VARIANTS'))
+    except Exception:
+        logger.exception("Couldn't render the variants of %s", name)
+        dimensions = FAILED
+    save_variants(name, dimensions)
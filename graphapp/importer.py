@@ -0,0 +1,237 @@
+import csv
+import io
+import json
+import time
+from datetime import datetime
+from itertools import islice
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.utils import timezone
+from .feed import fan_out_stored
+from .models import *
+from .responses import invalidate
+from .signals import refresh_comment_counts, refresh_subscriber_counts
+
+
+
+
+def read_rows(file, format='ndjson'):
+    """ Dicts of the rows of an NDJSON or CSV file, one at a time """
+    if format == 'csv':
+        return csv.DictReader(file)
+    return (json.loads(line) for line in file if line.strip())
+
+
+
+def batches(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+
+# columns the models require that an import may leave out, as PostInput does
+DEFAULTS = {
+    'likes': 0,
+}
+
+
+
+def python_value(model, name, row, number):
+    """ The value of column name in row as its field stores it """
+    field = model._meta.get_field(name)
+    value = row.get(name)
+    # an empty CSV cell is a missing value, unless the field is text
+    if value is None or (value == '' and not field.empty_strings_allowed):
+        if field.primary_key:
+            # allocated by convert()
+            return None
+        if name in DEFAULTS:
+            return DEFAULTS[name]
+        if field.has_default():
+            return field.get_default()
+        if field.null:
+            return None
+        if getattr(field, 'auto_now_add', False):
+            return timezone.now()
+        raise ValueError(f"Row {number}: {name} is missing")
+    try:
+        value = field.to_python(value)
+    except Exception as e:
+        raise ValueError(f"Row {number}: invalid {name} {row[name]!r}") from e
+    if isinstance(value, datetime) and timezone.is_naive(value):
+        value = timezone.make_aware(value)
+    return value
+
+
+
+def max_explicit_id(rows):
+    """ The largest id rows give, 0 without any """
+    top = 0
+    for row in rows:
+        try:
+            top = max(top, int(row.get('id') or 0))
+        except (TypeError, ValueError):
+            # reported with its row number when the row is loaded
+            pass
+    return top
+
+
+
+def allocate_ids(model, count, max_id=0):
+    """ count primary keys for new rows of model, so rows written with COPY
+        can be referenced by the rows loaded after them. They are above
+        max_id, the largest id of the import, which may not be written yet. """
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            if max_id:
+                cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [table])
+                sequence = cursor.fetchone()[0]
+                cursor.execute(f'SELECT setval(%s, GREATEST(%s, last_value)) FROM {sequence}', [sequence, max_id])
+            cursor.execute("SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s)", [table, count])
+            return [id for id, in cursor.fetchall()]
+        # the import holds the write lock, nothing else inserts meanwhile
+        cursor.execute(f'SELECT COALESCE(MAX(id), 0) FROM {connection.ops.quote_name(table)}')
+        start = max(cursor.fetchone()[0], max_id) + 1
+        return list(range(start, start + count))
+
+
+
+def write_rows(model, columns, rows):
+    """ Appends rows, dicts of python values, with COPY on Postgres and a
+        chunked INSERT elsewhere """
+    fields = [model._meta.get_field(column) for column in columns]
+    values = [tuple(field.get_db_prep_save(row[field.attname], connection) for field in fields) for row in rows]
+    table = connection.ops.quote_name(model._meta.db_table)
+    names = ', '.join(connection.ops.quote_name(field.column) for field in fields)
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            buffer = io.StringIO()
+            # every string is quoted, so "" stays an empty string; None is written as "" too,
+            # and read back as NULL in the nullable columns, none of which is text
+            csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC).writerows(values)
+            buffer.seek(0)
+            nullable = [connection.ops.quote_name(field.column) for field in fields if field.null]
+            options = f", FORCE_NULL ({', '.join(nullable)})" if nullable else ''
+            cursor.copy_expert(f'COPY {table} ({names}) FROM STDIN WITH (FORMAT csv{options})', buffer)
+        else:
+            placeholders = ', '.join(['%s'] * len(fields))
+            cursor.executemany(f'INSERT INTO {table} ({names}) VALUES ({placeholders})', values)
+
+
+
+def convert(model, columns, batch, start, max_id):
+    rows = [
+        {column: python_value(model, column, row, start + offset) for column in columns}
+        for offset, row in enumerate(batch)
+    ]
+    missing = [row for row in rows if row['id'] is None]
+    for row, id in zip(missing, allocate_ids(model, len(missing), max_id) if missing else ()):
+        row['id'] = id
+    return rows
+
+
+
+# each loader writes one batch of input rows, numbered from start, and
+# returns the cache tags the batch touched; max_id is the largest id of the input
+
+def load_posts(batch, start, max_id):
+    for row in batch:
+        # counted from the comments linked to the post
+        row['comment_count'] = 0
+        if row.get('time_to_read') in (None, ''):
+            # the estimate CreatePost makes, time_to_read is required
+            row['time_to_read'] = Post.reading_time(row.get('content') or '')
+    columns = ['id', 'author_id', 'title', 'content', 'likes', 'comment_count', 'date', 'time_to_read']
+    rows = convert(Post, columns, batch, start, max_id)
+    write_rows(Post, columns, rows)
+    fan_out_stored([row['id'] for row in rows])
+    return {f'Author:{row["author_id"]}' for row in rows} | {'Post'}
+
+
+def load_comments(batch, start, max_id):
+    columns = ['id', 'author_id', 'post_id', 'parent_id', 'text', 'likes', 'date']
+    rows = convert(Comment, columns, batch, start, max_id)
+    write_rows(Comment, columns, rows)
+    refresh_comment_counts({row['post_id'] for row in rows if row['post_id'] is not None})
+    return {'Comment', 'Post'}
+
+
+def load_subscriptions(batch, start, max_id):
+    Subscription = Author.subscribers.through
+    rows = [
+        Subscription(
+            author_id=python_value(Subscription, 'author_id', row, start + offset),
+            user_id=python_value(Subscription, 'user_id', row, start + offset),
+        )
+        for offset, row in enumerate(batch)
+    ]
+    # subscriptions that exist already are kept
+    Subscription.objects.bulk_create(rows, ignore_conflicts=True)
+    author_ids = {row.author_id for row in rows}
+    refresh_subscriber_counts(author_ids)
+    return {f'Author:{id}' for id in author_ids} | {'Author', 'User'}
+
+
+
+# kind -> (loader, models whose indexes can be deferred)
+IMPORTS = {
+    'posts': (load_posts, [Post, TimelineEntry]),
+    'comments': (load_comments, [Comment]),
+    'subscriptions': (load_subscriptions, []),
+}
+
+
+
+def drop_indexes(models):
+    """ Drops the Meta.indexes of models and returns them for restore_indexes() """
+    dropped = [(model, index) for model in models for index in model._meta.indexes]
+    with connection.schema_editor() as editor:
+        for model, index in dropped:
+            editor.remove_index(model, index)
+    return dropped
+
+
+
+def restore_indexes(dropped):
+    # one sorted build per index instead of an update per row
+    with connection.schema_editor() as editor:
+        for model, index in dropped:
+            editor.add_index(model, index)
+
+
+
+def import_rows(kind, rows, batch_size=5000, defer_indexes=False, progress=None, max_id=0):
+    """ Loads rows, dicts as read_rows() gives them, in one transaction and
+        returns how many. progress(loaded, seconds) is called after each
+        batch. Rows without an id get one above max_id, the largest id any
+        row gives, see max_explicit_id(). Deferring indexes is only done on
+        Postgres, whose DDL is transactional. """
+    load, models = IMPORTS[kind]
+    started = time.monotonic()
+    loaded, tags = 0, set()
+    with transaction.atomic():
+        dropped = drop_indexes(models) if defer_indexes and connection.vendor == 'postgresql' else []
+        for batch in batches(rows, batch_size):
+            tags |= load(batch, loaded + 1, max_id)
+            loaded += len(batch)
+            if progress:
+                progress(loaded, time.monotonic() - started)
+        if dropped:
+            # CREATE INDEX refuses to run with the deferred foreign key checks pending
+            connection.check_constraints()
+            restore_indexes(dropped)
+
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                # rows imported with their ids leave the sequences behind
+                for sql in connection.ops.sequence_reset_sql(no_style(), models):
+                    cursor.execute(sql)
+                for model in models:
+                    cursor.execute(f'ANALYZE {connection.ops.quote_name(model._meta.db_table)}')
+        invalidate(*tags)
+    return loaded
@@ -0,0 +1,236 @@
+import json
+import logging
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from threading import Lock
+from django.db import connection
+from graphql.pyutils import is_awaitable
+from .conf import app_setting
+
+
+# upper bounds in seconds of the histogram buckets
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+logger = logging.getLogger(__name__)
+
+_metrics = None
+_budgets = None
+
+
+
+
+class Trace:
+    """ Timings of one GraphQL execution. SQL is charged to the resolver
+        that started last before the query ran, which includes evaluating
+        the queryset it returned. """
+
+    def __init__(self, operation_name):
+        self.operation_name = operation_name or 'anonymous'
+        self.start_time = datetime.now(timezone.utc)
+        self.start = time.perf_counter()
+        self.end = None
+        self.resolvers = []
+        self.current = None
+        self.sql_queries = 0
+        self.sql_duration = 0.0
+
+    def resolver(self, info):
+        record = {
+            'path': info.path.as_list(),
+            'parentType': info.parent_type.name,
+            'fieldName': info.field_name,
+            'returnType': str(info.return_type),
+            'start': time.perf_counter(),
+            'duration': None,
+            'sqlQueries': 0,
+            'sqlDuration': 0.0,
+        }
+        self.resolvers.append(record)
+        self.current = record
+        return record
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        """ connection.execute_wrapper hook """
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.sql_queries += 1
+            self.sql_duration += duration
+            if self.current is not None:
+                self.current['sqlQueries'] += 1
+                self.current['sqlDuration'] += duration
+
+    def finish(self):
+        self.end = time.perf_counter()
+
+    def as_apollo(self):
+        """ Apollo tracing format, plus the SQL of each resolver """
+        ns = lambda seconds: int(seconds * 1e9)
+        return {
+            'version': 1,
+            'startTime': self.start_time.isoformat(),
+            'endTime': datetime.now(timezone.utc).isoformat(),
+            'duration': ns(self.end - self.start),
+            'sql': {'queries': self.sql_queries, 'duration': ns(self.sql_duration)},
+            'execution': {'resolvers': [{
+                'path': record['path'],
+                'parentType': record['parentType'],
+                'fieldName': record['fieldName'],
+                'returnType': record['returnType'],
+                'startOffset': ns(record['start'] - self.start),
+                'duration': ns(record['duration'] or 0),
+                'sqlQueries': record['sqlQueries'],
+                'sqlDuration': ns(record['sqlDuration']),
+            } for record in self.resolvers]},
+        }
+
+
+
+class InstrumentationMiddleware:
+    """ Times every resolver of a traced request. The view only hands the
+        middleware to executions it traces, so untraced requests never
+        call it. """
+
+    def resolve(self, next, root, info, **kwargs):
+        trace = getattr(info.context, 'graphql_trace', None)
+        if trace is None:
+            return next(root, info, **kwargs)
+
+        record = trace.resolver(info)
+        result = next(root, info, **kwargs)
+        if is_awaitable(result):
+            return self.finish_async(record, result)
+        record['duration'] = time.perf_counter() - record['start']
+        return result
+
+    async def finish_async(self, record, result):
+        try:
+            return await result
+        finally:
+            record['duration'] = time.perf_counter() - record['start']
+
+
+
+class Histogram:
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+
+
+class Metrics:
+    """ Per-process histograms of traced executions by operation and field,
+        rendered in the Prometheus text format. Operations past max_series
+        are counted as 'other' to bound the number of series. """
+
+    def __init__(self, max_series=1000):
+        self.max_series = max_series
+        self.requests = defaultdict(Histogram)
+        self.resolvers = defaultdict(Histogram)
+        # (operation, field) -> [queries, seconds]
+        self.sql = defaultdict(lambda: [0, 0.0])
+        self.lock = Lock()
+
+    def record(self, trace):
+        with self.lock:
+            operation = trace.operation_name
+            if operation not in self.requests and len(self.requests) >= self.max_series:
+                operation = 'other'
+            self.requests[operation].observe(trace.end - trace.start)
+            for record in trace.resolvers:
+                field = f"{record['parentType']}.{record['fieldName']}"
+                self.resolvers[operation, field].observe(record['duration'] or 0)
+                sql = self.sql[operation, field]
+                sql[0] += record['sqlQueries']
+                sql[1] += record['sqlDuration']
+
+    def render(self):
+        lines = []
+        with self.lock:
+            lines += histogram_lines('graphql_request_duration_seconds', "Execution time of GraphQL operations",
+                                     {(operation,): h for operation, h in self.requests.items()}, ('operation',))
+            lines += histogram_lines('graphql_resolver_duration_seconds', "Time spent in each resolver",
+                                     self.resolvers, ('operation', 'field'))
+            lines += ['# HELP graphql_resolver_sql_queries_total SQL queries charged to each resolver',
+                      '# TYPE graphql_resolver_sql_queries_total counter']
+            lines += [f'graphql_resolver_sql_queries_total{labels(("operation", "field"), key)} {queries}'
+                      for key, (queries, _) in self.sql.items()]
+            lines += ['# HELP graphql_resolver_sql_seconds_total SQL time charged to each resolver',
+                      '# TYPE graphql_resolver_sql_seconds_total counter']
+            lines += [f'graphql_resolver_sql_seconds_total{labels(("operation", "field"), key)} {seconds}'
+                      for key, (_, seconds) in self.sql.items()]
+        return '\n'.join(lines) + '\n'
+
+
+
+def labels(names, values, **extra):
+    pairs = [*zip(names, values), *extra.items()]
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+
+def histogram_lines(name, help, histograms, names):
+    lines = [f'# HELP {name} {help}', f'# TYPE {name} histogram']
+    for key, histogram in histograms.items():
+        cumulative = 0
+        for bound, count in zip(BUCKETS, histogram.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{labels(names, key, le=bound)} {cumulative}')
+        lines.append(f'{name}_bucket{labels(names, key, le="+Inf")} {histogram.count}')
+        lines.append(f'{name}_sum{labels(names, key)} {histogram.sum}')
+        lines.append(f'{name}_count{labels(names, key)} {histogram.count}')
+    return lines
+
+
+
+def get_metrics():
+    global _metrics
+    if _metrics is None:
+        _metrics = Metrics(app_setting('METRICS_MAX_SERIES'))
+    return _metrics
+
+
+
+def get_budgets():
+    """ Baseline query count of each operation on this database vendor """
+    global _budgets
+    if _budgets is None:
+        try:
+            with open(app_setting('QUERY_BASELINE')) as f:
+                baseline = json.load(f).get(connection.vendor, {})
+        except (OSError, ValueError):
+            baseline = {}
+        _budgets = {name: entry['queries'] for name, entry in baseline.items()}
+    return _budgets
+
+
+
+def check_budget(trace):
+    """ Logs a trace that ran more SQL queries than its operation's budget,
+        with the fields the queries were charged to """
+    budget = get_budgets().get(trace.operation_name, app_setting('QUERY_BUDGET'))
+    if trace.sql_queries <= budget:
+        return False
+    fields = Counter()
+    for record in trace.resolvers:
+        if record['sqlQueries']:
+            fields[f"{record['parentType']}.{record['fieldName']}"] += record['sqlQueries']
+    logger.warning(
+        "%s ran %d SQL queries, its budget is %d: %s", trace.operation_name, trace.sql_queries, budget,
+        ', '.join(f'{field} {count}' for field, count in fields.most_common(5)) or 'outside any resolver',
+    )
+    return True
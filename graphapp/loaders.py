@@ -0,0 +1,181 @@
+from asgiref.sync import sync_to_async
+from django.db import models
+from django.db.models import Prefetch, QuerySet, prefetch_related_objects
+from django.db.models.fields.related_descriptors import ForwardManyToOneDescriptor
+from graphql import ExecutionContext, GraphQLError
+from graphql.pyutils import is_iterable
+from .conf import app_setting
+
+
+
+
+class RelationLoader:
+    """ Loads one relation of one model for every instance of that model seen
+        in the current request, with a single IN (...) query per batch """
+
+    def __init__(self, loaders, model, relation, queryset=None):
+        self.loaders = loaders
+        self.model = model
+        self.relation = relation
+        self.queryset = queryset
+        self.cache = {}
+
+    def load(self, instance):
+        # an instance that joined the relation itself keeps its own projection
+        value = self.loaded(instance)
+        if value is not None:
+            return value
+        if instance.pk not in self.cache:
+            self.dispatch(instance)
+        return self.cache[instance.pk]
+
+    def loaded(self, obj):
+        """ Returns the relation if the root queryset already joined or
+            prefetched it, None otherwise """
+        if self.forward:
+            if getattr(self.model, self.relation).field.is_cached(obj):
+                return getattr(obj, self.relation)
+        elif self.queryset is None:
+            queryset = getattr(obj, self.relation).get_queryset()
+            if queryset._result_cache is not None:
+                return list(queryset)
+        return None
+
+    @property
+    def forward(self):
+        return isinstance(getattr(self.model, self.relation), ForwardManyToOneDescriptor)
+
+    def dispatch(self, instance):
+        seen = self.loaders.seen[self.model]
+        seen.setdefault(instance.pk, instance)
+        batch = []
+        # under the async view the event loop may prime while this runs on the database thread
+        others = list(seen.values())
+        for obj in [instance] + [obj for obj in others if obj.pk != instance.pk]:
+            if obj.pk in self.cache:
+                continue
+            value = self.loaded(obj)
+            if value is None:
+                batch.append(obj)
+            else:
+                self.store(obj, value)
+
+        if batch and self.forward:
+            prefetch_related_objects(batch, self.relation)
+            for obj in batch:
+                self.store(obj, getattr(obj, self.relation))
+        elif batch:
+            # load into a private attribute so a filtered batch never clobbers
+            # the default prefetch cache of the relation
+            to_attr = f'_loaded_{self.relation}_{id(self)}'
+            prefetch_related_objects(batch, Prefetch(self.relation, queryset=self.queryset, to_attr=to_attr))
+            for obj in batch:
+                self.store(obj, getattr(obj, to_attr))
+
+    def store(self, obj, value):
+        self.cache[obj.pk] = value
+        self.loaders.prime(value if isinstance(value, list) else [value])
+
+
+
+class RequestLoaders:
+    """ Per-request registry of relation loaders, stored on info.context.
+        Async loaders return an awaitable for relations that still need a
+        query, and run that query on the database thread. """
+
+    def __init__(self, is_async=False):
+        self.is_async = is_async
+        self.seen = {}
+        self.loaders = {}
+
+    def prime(self, instances):
+        for obj in instances:
+            if isinstance(obj, models.Model) and obj.pk is not None:
+                self.seen.setdefault(type(obj), {}).setdefault(obj.pk, obj)
+
+    def loader(self, model, relation, queryset=None, key=None):
+        cache_key = (model, relation, key)
+        if cache_key not in self.loaders:
+            self.seen.setdefault(model, {})
+            self.loaders[cache_key] = RelationLoader(self, model, relation, queryset)
+        return self.loaders[cache_key]
+
+    def load(self, instance, relation, queryset=None, key=None):
+        loader = self.loader(type(instance), relation, queryset, key)
+        if self.is_async and instance.pk not in loader.cache and loader.loaded(instance) is None:
+            return sync_to_async(loader.load)(instance)
+        return loader.load(instance)
+
+
+
+def get_loaders(info):
+    """ Returns the loaders of the current request, creating them once """
+    loaders = getattr(info.context, 'loaders', None)
+    if loaders is None:
+        loaders = RequestLoaders()
+        info.context.loaders = loaders
+    return loaders
+
+
+
+def fetch(info, queryset, **lookup):
+    """ queryset.get(**lookup) or None when there is no such object,
+        awaitable under the async view """
+    if get_loaders(info).is_async:
+        async def aget():
+            try:
+                return await queryset.aget(**lookup)
+            except queryset.model.DoesNotExist:
+                return None
+        return aget()
+    try:
+        return queryset.get(**lookup)
+    except queryset.model.DoesNotExist:
+        return None
+
+
+
+def cap_list(result, info):
+    """ Materializes a list field, enforcing the LIST_MAX_ITEMS cap """
+    limit = app_setting('LIST_MAX_ITEMS')
+    if limit is None:
+        return list(result)
+    if isinstance(result, QuerySet):
+        result = result[:limit + 1]
+    result = list(result)
+    if len(result) > limit:
+        if app_setting('LIST_OVERFLOW') == 'reject':
+            raise GraphQLError(f"{info.parent_type.name}.{info.field_name} returned more than {limit} items, use a paginated field instead")
+        result = result[:limit]
+    return result
+
+
+
+class BatchingExecutionContext(ExecutionContext):
+    """ Registers every object of a resolved list with the request loaders
+        before its fields run, so sibling relations load in one batch """
+
+    def complete_list_value(self, return_type, field_nodes, info, path, result):
+        if is_iterable(result):
+            result = cap_list(result, info)
+            get_loaders(info).prime(getattr(item, 'node', item) for item in result)
+        return super().complete_list_value(return_type, field_nodes, info, path, result)
+
+
+
+class AsyncBatchingExecutionContext(BatchingExecutionContext):
+    """ BatchingExecutionContext for the async view: querysets returned by
+        list fields are evaluated off the event loop """
+
+    def complete_list_value(self, return_type, field_nodes, info, path, result):
+        if not (isinstance(result, QuerySet) and get_loaders(info).is_async):
+            return super().complete_list_value(return_type, field_nodes, info, path, result)
+
+        async def await_list():
+            items = await sync_to_async(cap_list)(result, info)
+            completed = BatchingExecutionContext.complete_list_value(self, return_type, field_nodes, info, path, items)
+            if self.is_awaitable(completed):
+                return await completed
+            return completed
+
+        return await_list()
@@ -0,0 +1,86 @@
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import ThreadSensitiveContext
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.backends.signals import connection_created
+from django.test import AsyncClient, Client, override_settings
+from graphapp.benchmark import summary
+
+
+QUERY = '''{ allPosts(first: 10) { edges { node { title author { name } comments(first: 5) { edges { node { text } } } } } }
+             authors(first: 10) { edges { node { name subscriberCount } } } }'''
+
+
+
+
+class Command(BaseCommand):
+    help = "Compares the WSGI and ASGI GraphQL views under concurrent slow queries"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--concurrency', type=int, default=20)
+        parser.add_argument('--latency', type=float, default=0.02, help="seconds added to every SQL query")
+        parser.add_argument('--query', default=QUERY)
+
+    def handle(self, *args, **options):
+        latency = options['latency']
+
+        def slow_query(execute, sql, params, many, context):
+            time.sleep(latency)
+            return execute(sql, params, many, context)
+
+        def add_latency(sender, connection, **kwargs):
+            connection.execute_wrappers.append(slow_query)
+
+        body = json.dumps({'query': options['query']})
+        # every request has to reach the database
+        graphapp = {**getattr(settings, 'GRAPHAPP', {}), 'RESPONSE_CACHE_TIMEOUT': 0}
+        connection_created.connect(add_latency)
+        try:
+            with override_settings(GRAPHAPP=graphapp, ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+                results = {
+                    'wsgi': self.run_wsgi(body, options['requests'], options['concurrency']),
+                    'asgi': self.run_asgi(body, options['requests'], options['concurrency']),
+                }
+        finally:
+            connection_created.disconnect(add_latency)
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def run_wsgi(self, body, requests, concurrency):
+        local = threading.local()
+
+        def request(_):
+            if not hasattr(local, 'client'):
+                local.client = Client()
+            start = time.perf_counter()
+            response = local.client.post('/api/graphql', body, content_type='application/json')
+            assert response.status_code == 200, response.content
+            return time.perf_counter() - start
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as pool:
+            timings = list(pool.map(request, range(requests)))
+        return summary(timings, time.perf_counter() - start)
+
+    def run_asgi(self, body, requests, concurrency):
+        async def main():
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def request():
+                async with semaphore:
+                    # a thread for the request's database work, as the ASGI handler does
+                    async with ThreadSensitiveContext():
+                        start = time.perf_counter()
+                        response = await AsyncClient().post('/api/graphql/async', body, content_type='application/json')
+                        assert response.status_code == 200, response.content
+                        return time.perf_counter() - start
+
+            start = time.perf_counter()
+            timings = await asyncio.gather(*[request() for _ in range(requests)])
+            return summary(timings, time.perf_counter() - start)
+
+        return asyncio.run(main())
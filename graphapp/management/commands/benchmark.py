@@ -0,0 +1,147 @@
+import json
+import subprocess
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from graphql_jwt.shortcuts import get_token
+from graphapp.benchmark import OPERATIONS, fixtures, summary
+
+
+
+
+class Command(BaseCommand):
+    help = "Measures requests/sec, latency percentiles and SQL queries of each benchmark operation"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--operations', help="comma separated names, all of them by default")
+        parser.add_argument('--skip-mutations', action='store_true')
+        parser.add_argument('--requests', type=int, default=100, help="requests per operation")
+        parser.add_argument('--concurrency', type=int, default=4)
+        parser.add_argument('--warmup', type=int, default=5)
+        parser.add_argument('--url', help="a live server's GraphQL endpoint, the test client is used without it")
+        parser.add_argument('--user', default='bench0', help="user of the authenticated operations")
+        parser.add_argument('--response-cache', action='store_true',
+                            help="keep the response cache on, test client only")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help="write the results to this JSON file")
+        parser.add_argument('--compare', help="a previous JSON result to compare against")
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f"User {options['user']} doesn't exist, run seed_data first")
+        token = get_token(user)
+        data = fixtures(user, options['seed'])
+
+        names = options['operations'].split(',') if options['operations'] else list(OPERATIONS)
+        unknown = set(names) - OPERATIONS.keys()
+        if unknown:
+            raise CommandError(f"Unknown operations: {', '.join(sorted(unknown))}")
+        operations = {
+            name: OPERATIONS[name] for name in names
+            if not (options['skip_mutations'] and OPERATIONS[name].get('mutation'))
+            and not (OPERATIONS[name].get('postgresql') and connection.vendor != 'postgresql')
+        }
+
+        graphapp = dict(getattr(settings, 'GRAPHAPP', {}))
+        if not options['response_cache']:
+            graphapp['RESPONSE_CACHE_TIMEOUT'] = 0
+        with override_settings(GRAPHAPP=graphapp, ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            send = self.live_sender(options['url']) if options['url'] else self.client_sender()
+            results = {
+                name: self.run(name, operation, send, token, data, options)
+                for name, operation in operations.items()
+            }
+
+        report = {
+            'commit': git_commit(),
+            'target': options['url'] or 'client',
+            'database': connection.vendor,
+            'requests': options['requests'],
+            'concurrency': options['concurrency'],
+            'response_cache': bool(options['response_cache']) if not options['url'] else None,
+            'operations': results,
+        }
+        self.print_report(report, options['compare'])
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+
+    def run(self, name, operation, send, token, data, options):
+        authorization = f'Bearer {token}' if operation.get('auth') else None
+
+        def request(_=None):
+            body = json.dumps({'query': operation['query'], 'variables': operation['variables'](data)})
+            start = time.perf_counter()
+            result = send(body, authorization)
+            elapsed = time.perf_counter() - start
+            if result.get('errors'):
+                raise CommandError(f"{name}: {result['errors'][0]['message']}")
+            return elapsed
+
+        for _ in range(options['warmup']):
+            request()
+        # queries are only visible from inside the process
+        queries = None
+        if not options['url']:
+            with CaptureQueriesContext(connection) as ctx:
+                request()
+            queries = len(ctx.captured_queries)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(options['concurrency']) as pool:
+            timings = list(pool.map(request, range(options['requests'])))
+        return {**summary(timings, time.perf_counter() - start), 'sql_queries': queries}
+
+    def client_sender(self):
+        local = threading.local()
+
+        def send(body, authorization):
+            if not hasattr(local, 'client'):
+                local.client = Client()
+            headers = {'HTTP_AUTHORIZATION': authorization} if authorization else {}
+            return local.client.post('/api/graphql', body, content_type='application/json', **headers).json()
+        return send
+
+    def live_sender(self, url):
+        def send(body, authorization):
+            headers = {'Content-Type': 'application/json'}
+            if authorization:
+                headers['Authorization'] = authorization
+            request = urllib.request.Request(url, data=body.encode('utf-8'), headers=headers)
+            with urllib.request.urlopen(request) as response:
+                return json.load(response)
+        return send
+
+    def print_report(self, report, compare):
+        previous = {}
+        if compare:
+            with open(compare) as f:
+                previous = json.load(f)['operations']
+        self.stdout.write(f"{'operation':<20} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'sql':>5}")
+        for name, result in report['operations'].items():
+            line = (f"{name:<20} {result['requests_per_second']:>8} {result['p50_ms']:>8} "
+                    f"{result['p95_ms']:>8} {result['p99_ms']:>8} {result['sql_queries'] if result['sql_queries'] is not None else '-':>5}")
+            if name in previous:
+                before = previous[name]['requests_per_second']
+                line += f"  {(result['requests_per_second'] - before) / before * 100:+.1f}% req/s"
+            self.stdout.write(line)
+
+
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
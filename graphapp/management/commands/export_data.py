@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+from graphapp.export import EXPORTS, FORMATS, parse_checkpoint, parse_since, stream
+
+
+
+
+class Command(BaseCommand):
+    help = "Streams posts, comments or reading list entries as NDJSON or CSV in (date, id) order"
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=list(EXPORTS))
+        parser.add_argument('--format', choices=list(FORMATS), default='ndjson')
+        parser.add_argument('--since', help="only rows from this date or datetime on")
+        parser.add_argument('--author', type=int, help="only rows of this author")
+        parser.add_argument('--after', help="<date>,<id> of the last row of an earlier export, to resume it")
+        parser.add_argument('--chunk-size', type=int, default=2000, help="rows fetched per round trip")
+        parser.add_argument('--output', help="file to write, stdout by default")
+
+    def handle(self, *args, **options):
+        try:
+            since = parse_since(options['since']) if options['since'] else None
+            after = parse_checkpoint(options['after']) if options['after'] else None
+        except ValueError as e:
+            raise CommandError(e)
+
+        chunks = stream(
+            options['kind'], options['format'], since=since, author=options['author'], after=after,
+            chunk_size=options['chunk_size'],
+        )
+        if not options['output']:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
+            return
+        # the csv module terminates rows itself
+        with open(options['output'], 'w', newline='') as output:
+            for chunk in chunks:
+                output.write(chunk)
@@ -0,0 +1,49 @@
+import shutil
+import sys
+import tempfile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError
+from graphapp.importer import IMPORTS, import_rows, max_explicit_id, read_rows
+
+
+
+
+class Command(BaseCommand):
+    help = ("Loads posts, comments or subscriptions from NDJSON or CSV in bulk. "
+            "Load subscriptions before posts, new posts are fanned out to the timelines of existing subscribers.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=list(IMPORTS))
+        parser.add_argument('path', help="file to read, - for stdin")
+        parser.add_argument('--format', choices=['ndjson', 'csv'], help="guessed from the file extension by default")
+        parser.add_argument('--batch-size', type=int, default=5000, help="rows written per COPY or INSERT")
+        parser.add_argument('--defer-indexes', action='store_true',
+                            help="drop the table's indexes during the load and rebuild them after, Postgres only")
+
+    def handle(self, *args, **options):
+        kind, path = options['kind'], options['path']
+        format = options['format'] or ('csv' if path.endswith('.csv') else 'ndjson')
+
+        def progress(loaded, seconds):
+            self.stdout.write(f"{loaded} {kind}, {loaded / max(seconds, 1e-6):.0f} rows/s")
+
+        if path == '-':
+            # read twice, for the largest id first
+            file = tempfile.TemporaryFile('w+', newline='', encoding='utf-8')
+            shutil.copyfileobj(sys.stdin, file)
+            file.seek(0)
+        else:
+            file = open(path, newline='', encoding='utf-8')
+        try:
+            # ids allocated to the rows without one must not be taken by a later row
+            max_id = max_explicit_id(read_rows(file, format))
+            file.seek(0)
+            loaded = import_rows(
+                kind, read_rows(file, format), batch_size=options['batch_size'],
+                defer_indexes=options['defer_indexes'], progress=progress, max_id=max_id,
+            )
+        except (ValueError, IntegrityError) as e:
+            raise CommandError(f"Nothing imported: {e}")
+        finally:
+            file.close()
+        self.stdout.write(self.style.SUCCESS(f"Imported {loaded} {kind}"))
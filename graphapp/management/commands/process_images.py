@@ -0,0 +1,85 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from graphapp.conf import app_setting
+from graphapp.images import FAILED, content_hash, render_variants, save_variants
+from graphapp.models import Author
+
+
+
+
+class Command(BaseCommand):
+    help = "Moves author images to content-hashed names and renders their resized variants"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--delete-duplicates', action='store_true',
+                            help="delete the old files once no author uses them")
+        parser.add_argument('--force', action='store_true', help="render variants that already exist again")
+        parser.add_argument('--interval', type=float,
+                            help="keep running, rendering the images uploaded since every this many seconds")
+
+    def handle(self, *args, **options):
+        storage = Author._meta.get_field('image').storage
+        renamed = set()
+        for author in Author.objects.exclude(image='').only('image').iterator():
+            name = author.image.name
+            if not storage.exists(name):
+                self.stderr.write(f"{name} of author {author.pk} is missing")
+                continue
+            with storage.open(name) as file:
+                hashed = f'media/images/{content_hash(file)}{os.path.splitext(name)[1].lower()}'
+                if hashed != name:
+                    storage.save(hashed, file)
+            if hashed != name:
+                Author.objects.filter(pk=author.pk).update(image=hashed, image_variants={})
+                renamed.add(name)
+
+        deleted = 0
+        if options['delete_duplicates']:
+            for name in renamed - set(Author.objects.values_list('image', flat=True)):
+                storage.delete(name)
+                deleted += 1
+
+        with ProcessPoolExecutor(max_workers=app_setting('IMAGE_WORKERS') or 1) as pool:
+            rendered = self.render(pool, storage, options['force'])
+            self.stdout.write(self.style.SUCCESS(
+                f"{len(renamed)} images renamed, {rendered} rendered, {deleted} duplicates deleted"
+            ))
+            # uploads are left to this worker by the web processes, see images.process_image
+            while options['interval']:
+                time.sleep(options['interval'])
+                close_old_connections()
+                started = time.monotonic()
+                rendered = self.render(pool, storage, False)
+                if rendered:
+                    self.stdout.write(f"{rendered} rendered in {time.monotonic() - started:.2f}s")
+
+    def render(self, pool, storage, force):
+        """ Renders the variants of the images without any, or of every image.
+            An image that can't be rendered is marked FAILED and left out of
+            the next passes. """
+        pending = Author.objects.exclude(image='')
+        if not force:
+            pending = pending.filter(image_variants={})
+        names = sorted(set(pending.values_list('image', flat=True)))
+        sizes = app_setting('IMAGE_VARIANTS')
+        futures = [(name, pool.submit(render_variants, storage.path(name), sizes)) for name in names]
+        rendered = 0
+        for name, future in futures:
+            try:
+                dimensions = future.result()
+            except BrokenProcessPool:
+                # a crashed pool fails every image, none of them is to blame
+                raise
+            except Exception as error:
+                # a missing, corrupt or unsupported file doesn't stop the worker
+                self.stderr.write(f"{name} couldn't be rendered: {error!r}")
+                save_variants(name, FAILED)
+                continue
+            save_variants(name, dimensions)
+            self.stdout.write(f"{name}: {dimensions}")
+            rendered += 1
+        return rendered
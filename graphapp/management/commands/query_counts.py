@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from graphapp.querycount import check, load_baseline, save_baseline
+
+
+
+
+class Command(BaseCommand):
+    help = "Checks that no benchmark operation's SQL query count grows with the data or beyond its baseline"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--update', action='store_true', help="record the current counts as the baseline")
+        parser.add_argument('--operations', help="comma separated names, all of them by default")
+
+    def handle(self, *args, **options):
+        operations = options['operations'].split(',') if options['operations'] else None
+        queries, growing, over_baseline = check(operations=operations)
+        baseline = load_baseline().get(connection.vendor, {})
+
+        self.stdout.write(f"{'operation':<20} {'queries':>8} {'baseline':>8}")
+        for name, sql in queries.items():
+            expected = baseline.get(name, {}).get('queries', '-')
+            self.stdout.write(f"{name:<20} {len(sql):>8} {expected:>8}")
+
+        # a count that grows with the data is never a baseline
+        problems = growing if options['update'] else growing + over_baseline
+        if problems:
+            raise CommandError('\n\n'.join(problems))
+        if options['update']:
+            save_baseline(queries)
+            self.stdout.write(self.style.SUCCESS(f"Baseline of {connection.vendor} updated"))
@@ -0,0 +1,26 @@
+import time
+from django.core.management.base import BaseCommand
+from graphapp.trending import refresh_scores
+
+
+
+
+class Command(BaseCommand):
+    help = "Recomputes the trending scores of the posts with activity since the last run, and of their authors"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help="score every post, e.g. after import_blog loaded older activity")
+        parser.add_argument('--batch-size', type=int, default=1000, help="posts scored per transaction")
+        parser.add_argument('--interval', type=float, help="keep running, refreshing every this many seconds")
+
+    def handle(self, *args, **options):
+        full = options['full']
+        while True:
+            started = time.monotonic()
+            count = refresh_scores(full=full, batch_size=options['batch_size'])
+            self.stdout.write(f"{count} posts scored in {time.monotonic() - started:.2f}s")
+            if not options['interval']:
+                return
+            full = False
+            time.sleep(max(0, options['interval'] - (time.monotonic() - started)))
@@ -0,0 +1,35 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from graphapp.benchmark import seed_data
+
+
+
+
+class Command(BaseCommand):
+    help = "Seeds a reproducible blog for benchmarks: users, authors, posts, comments and reading lists"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--authors', type=int, default=50)
+        parser.add_argument('--users', type=int, default=500)
+        parser.add_argument('--posts', type=int, default=5000)
+        parser.add_argument('--comments', type=int, default=20000)
+        parser.add_argument('--subscriptions', type=int, default=5, help="authors each user subscribes to, at most")
+        parser.add_argument('--lists', type=int, default=2, help="reading lists per user")
+        parser.add_argument('--list-size', type=int, default=10)
+        parser.add_argument('--skew', type=float, default=1.0,
+                            help="popularity skew of authors and posts, 0 is uniform and 1 is Zipf")
+        parser.add_argument('--days', type=int, default=365, help="posts are spread over this many days")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        if User.objects.filter(username='bench0').exists():
+            raise CommandError("The database is already seeded, flush it first")
+        with transaction.atomic():
+            seed_data(
+                authors=options['authors'], users=options['users'], posts=options['posts'],
+                comments=options['comments'], subscriptions=options['subscriptions'], lists=options['lists'],
+                list_size=options['list_size'], skew=options['skew'], days=options['days'], seed=options['seed'],
+                log=self.stdout.write,
+            )
+        self.stdout.write(self.style.SUCCESS("Seeded, benchmark as bench0"))
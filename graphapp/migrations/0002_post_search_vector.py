@@ -0,0 +1,58 @@
+# Generated by Django 4.2.9 on 2026-10-18 08:44
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+# Django 4.2 can't save models that have a GENERATED column, so the stored
+# tsvector is maintained by a trigger that overrides whatever Django writes.
+CREATE_SEARCH_VECTOR = """
+CREATE FUNCTION graphapp_post_search_vector() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('english', coalesce(NEW.title, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(NEW.content, '')), 'B');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER graphapp_post_search_vector_update
+    BEFORE INSERT OR UPDATE OF title, content, search_vector ON graphapp_post
+    FOR EACH ROW EXECUTE FUNCTION graphapp_post_search_vector();
+
+UPDATE graphapp_post SET search_vector = NULL;
+
+CREATE INDEX graphapp_post_search_vector_gin ON graphapp_post USING GIN (search_vector);
+"""
+
+DROP_SEARCH_VECTOR = """
+DROP INDEX IF EXISTS graphapp_post_search_vector_gin;
+DROP TRIGGER IF EXISTS graphapp_post_search_vector_update ON graphapp_post;
+DROP FUNCTION IF EXISTS graphapp_post_search_vector();
+"""
+
+
+def create_search_vector(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(CREATE_SEARCH_VECTOR)
+
+
+def drop_search_vector(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(DROP_SEARCH_VECTOR)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('graphapp', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_vector, drop_search_vector),
+    ]
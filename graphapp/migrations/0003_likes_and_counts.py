@@ -0,0 +1,67 @@
+# Generated by Django 4.2.9 on 2026-10-18 08:47
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_rows(through, column):
+    rows = through.objects.filter(**{column: OuterRef('pk')}).order_by().values(column)
+    return Coalesce(Subquery(rows.annotate(n=Count('*')).values('n')), 0)
+
+
+def backfill_counts(apps, schema_editor):
+    Post = apps.get_model('graphapp', 'Post')
+    Author = apps.get_model('graphapp', 'Author')
+    Post.objects.update(comment_count=count_rows(Post.comments.through, 'post_id'))
+    Author.objects.update(subscriber_count=count_rows(Author.subscribers.through, 'author_id'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('graphapp', '0002_post_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='author',
+            name='subscriber_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='comment_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.CreateModel(
+            name='PostLike',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='graphapp.post')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CommentLike',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('comment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='graphapp.comment')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='postlike',
+            constraint=models.UniqueConstraint(fields=('user', 'post'), name='unique_post_like'),
+        ),
+        migrations.AddConstraint(
+            model_name='commentlike',
+            constraint=models.UniqueConstraint(fields=('user', 'comment'), name='unique_comment_like'),
+        ),
+        migrations.RunPython(backfill_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,97 @@
+# Generated by Django 4.2.9 on 2026-10-18 08:57
+
+from django.db import migrations, models
+from django.db.models import Count
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def rename_duplicate_lists(apps, schema_editor):
+    ReadingList = apps.get_model('graphapp', 'ReadingList')
+    duplicates = ReadingList.objects.values('user_id', 'name').annotate(n=Count('id')).filter(n__gt=1)
+    for duplicate in duplicates:
+        lists = ReadingList.objects.filter(user_id=duplicate['user_id'], name=duplicate['name']).order_by('id')[1:]
+        for reading_list in lists:
+            reading_list.name = f"{reading_list.name} {reading_list.id}"
+            reading_list.save(update_fields=['name'])
+
+
+def number_entries(apps, schema_editor):
+    ReadingListEntry = apps.get_model('graphapp', 'ReadingListEntry')
+    entries = ReadingListEntry.objects.order_by('reading_list_id', 'id')
+    changed, list_id, position = [], None, 0
+    for entry in entries.iterator():
+        position = position + 1 if entry.reading_list_id == list_id else 0
+        list_id = entry.reading_list_id
+        entry.position = position
+        changed.append(entry)
+    ReadingListEntry.objects.bulk_update(changed, ['position'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('graphapp', '0003_likes_and_counts'),
+    ]
+
+    operations = [
+        migrations.RunPython(rename_duplicate_lists, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='readinglist',
+            constraint=models.UniqueConstraint(fields=('user', 'name'), name='unique_reading_list_name'),
+        ),
+        # adopt the auto-created join table as the through model, then reshape it
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='ReadingListEntry',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reading_list_entries', to='graphapp.post')),
+                        ('reading_list', models.ForeignKey(db_column='readinglist_id', on_delete=django.db.models.deletion.CASCADE, related_name='entries', to='graphapp.readinglist')),
+                    ],
+                    options={
+                        'db_table': 'graphapp_readinglist_posts',
+                        'unique_together': {('reading_list', 'post')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='readinglist',
+                    name='posts',
+                    field=models.ManyToManyField(through='graphapp.ReadingListEntry', to='graphapp.post'),
+                ),
+            ],
+        ),
+        migrations.AlterModelTable(
+            name='readinglistentry',
+            table=None,
+        ),
+        migrations.AlterField(
+            model_name='readinglistentry',
+            name='reading_list',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='entries', to='graphapp.readinglist'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='readinglistentry',
+            unique_together=set(),
+        ),
+        migrations.AddField(
+            model_name='readinglistentry',
+            name='added',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='readinglistentry',
+            name='position',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(number_entries, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='readinglistentry',
+            index=models.Index(fields=['reading_list', 'position', 'id'], name='reading_list_position_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='readinglistentry',
+            constraint=models.UniqueConstraint(fields=('reading_list', 'post'), name='unique_reading_list_post'),
+        ),
+    ]
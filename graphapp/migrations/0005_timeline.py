@@ -0,0 +1,55 @@
+# Generated by Django 4.2.9 on 2026-10-18 09:01
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from graphapp.conf import app_setting
+
+
+def backfill_timelines(apps, schema_editor):
+    """ Fills each subscriber's timeline with the latest posts of the
+        authors below the fan-out threshold """
+    Author = apps.get_model('graphapp', 'Author')
+    Post = apps.get_model('graphapp', 'Post')
+    TimelineEntry = apps.get_model('graphapp', 'TimelineEntry')
+    authors = Author.objects.filter(subscriber_count__lte=app_setting('FEED_FANOUT_MAX_SUBSCRIBERS'))
+    for author in authors.iterator():
+        subscribers = list(Author.subscribers.through.objects.filter(author_id=author.id).values_list('user_id', flat=True))
+        if not subscribers:
+            continue
+        posts = Post.objects.filter(author_id=author.id).order_by('-date', '-id').values_list('id', 'date')
+        posts = posts[:app_setting('FEED_BACKFILL_POSTS')]
+        TimelineEntry.objects.bulk_create([
+            TimelineEntry(user_id=user_id, post_id=post_id, author_id=author.id, date=date)
+            for post_id, date in posts
+            for user_id in subscribers
+        ], batch_size=1000, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('graphapp', '0004_reading_list_entries'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimelineEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateTimeField()),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='graphapp.author')),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_entries', to='graphapp.post')),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='timeline', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'date', 'post'], name='timeline_user_date_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='timelineentry',
+            constraint=models.UniqueConstraint(fields=('user', 'post'), name='unique_timeline_post'),
+        ),
+        migrations.RunPython(backfill_timelines, migrations.RunPython.noop),
+    ]
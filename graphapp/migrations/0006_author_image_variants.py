@@ -0,0 +1,24 @@
+# Generated by Django 4.2.9 on 2026-10-18 09:05
+
+from django.db import migrations, models
+import graphapp.images
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('graphapp', '0005_timeline'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='author',
+            name='image_variants',
+            field=models.JSONField(default=dict, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='author',
+            name='image',
+            field=models.ImageField(storage=graphapp.images.ContentAddressedStorage(), upload_to=graphapp.images.hashed_upload_to),
+        ),
+    ]
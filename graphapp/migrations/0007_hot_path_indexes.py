@@ -0,0 +1,37 @@
+# Generated by Django 4.2.9 on 2026-10-18 09:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('graphapp', '0006_author_image_variants'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='author',
+            index=models.Index(fields=['name'], name='author_name_prefix_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='author',
+            index=models.Index(fields=['joined', 'id'], name='author_joined_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['date', 'id'], name='comment_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['date', 'id'], name='post_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['author', 'date', 'id'], name='post_author_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='readinglist',
+            index=models.Index(fields=['user', 'created', 'id'], name='reading_list_user_created_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.9 on 2026-10-18 09:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('graphapp', '0007_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='readinglistentry',
+            index=models.Index(fields=['added', 'id'], name='reading_list_entry_added_idx'),
+        ),
+    ]
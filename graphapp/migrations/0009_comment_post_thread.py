@@ -0,0 +1,64 @@
+# Generated by Django 4.2.9 on 2026-10-18 09:52
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+
+
+def attach_comments(apps, schema_editor):
+    # a comment linked to several posts stays on the first one it was added to
+    Post = apps.get_model('graphapp', 'Post')
+    Comment = apps.get_model('graphapp', 'Comment')
+    Link = Post._meta.get_field('comments').remote_field.through
+    first = Link.objects.filter(comment_id=OuterRef('pk')).order_by('id').values('post_id')[:1]
+    Comment.objects.update(post_id=Subquery(first))
+    counts = Comment.objects.filter(post_id=OuterRef('pk')).order_by().values('post_id').annotate(n=Count('*')).values('n')
+    Post.objects.update(comment_count=Coalesce(Subquery(counts), 0))
+
+
+def detach_comments(apps, schema_editor):
+    Post = apps.get_model('graphapp', 'Post')
+    Comment = apps.get_model('graphapp', 'Comment')
+    Link = Post._meta.get_field('comments').remote_field.through
+    links = Comment.objects.exclude(post_id=None).values_list('id', 'post_id')
+    Link.objects.bulk_create([Link(comment_id=id, post_id=post_id) for id, post_id in links.iterator()], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('graphapp', '0008_export_index'),
+    ]
+
+    operations = [
+        # without a reverse accessor until Post.comments is gone
+        migrations.AddField(
+            model_name='comment',
+            name='post',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='graphapp.post'),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='parent',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='replies', to='graphapp.comment'),
+        ),
+        migrations.RunPython(attach_comments, detach_comments),
+        migrations.RemoveField(
+            model_name='post',
+            name='comments',
+        ),
+        migrations.AlterField(
+            model_name='comment',
+            name='post',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='comments', to='graphapp.post'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'date', 'id'], name='comment_post_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['parent', 'date', 'id'], name='comment_parent_date_idx'),
+        ),
+    ]
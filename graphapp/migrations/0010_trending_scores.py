@@ -0,0 +1,70 @@
+# Generated by Django 4.2.9 on 2026-10-18 10:04
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('graphapp', '0009_comment_post_thread'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuthorScore',
+            fields=[
+                ('author', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='popularity', serialize=False, to='graphapp.author')),
+                ('score', models.FloatField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TrendingScore',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('window', models.CharField(max_length=8)),
+                ('score', models.FloatField()),
+                ('last_activity', models.DateTimeField()),
+                ('updated', models.DateTimeField()),
+                ('stale', models.BooleanField(default=False)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='postlike',
+            index=models.Index(fields=['created'], name='post_like_created_idx'),
+        ),
+        migrations.AddField(
+            model_name='trendingscore',
+            name='author',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='graphapp.author'),
+        ),
+        migrations.AddField(
+            model_name='trendingscore',
+            name='post',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='trending_scores', to='graphapp.post'),
+        ),
+        migrations.AddIndex(
+            model_name='authorscore',
+            index=models.Index(fields=['score', 'author'], name='author_score_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='trendingscore',
+            index=models.Index(fields=['window', 'score', 'post'], name='trending_window_score_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='trendingscore',
+            index=models.Index(fields=['window', 'author', 'score'], name='trending_author_score_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='trendingscore',
+            index=models.Index(fields=['updated'], name='trending_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='trendingscore',
+            index=models.Index(condition=models.Q(('stale', True)), fields=['post'], name='trending_stale_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='trendingscore',
+            constraint=models.UniqueConstraint(fields=('window', 'post'), name='unique_trending_window_post'),
+        ),
+    ]
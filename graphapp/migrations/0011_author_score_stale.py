@@ -0,0 +1,22 @@
+# Generated by Django 4.2.9 on 2026-10-18 10:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('graphapp', '0010_trending_scores'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='authorscore',
+            name='stale',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name='authorscore',
+            index=models.Index(condition=models.Q(('stale', True)), fields=['author'], name='author_score_stale_idx'),
+        ),
+    ]
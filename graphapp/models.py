@@ -1,8 +1,12 @@
-from django.db import models
+import re
+from django.db import IntegrityError, models, transaction
+from django.utils import timezone
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator
-from django.contrib.postgres.search import SearchVector ,SearchQuery
-from django.db.models import Count
+from django.contrib.postgres.search import SearchVector ,SearchQuery, SearchVectorField, SearchRank, SearchHeadline
+from django.db.models import Count, F
+from django.db.models.functions import Cast
+from .images import ContentAddressedStorage, hashed_upload_to
 
 
 
@@ -12,27 +16,104 @@ class ReadingList(models.Model):
     user = models.ForeignKey(User,on_delete=models.CASCADE)
     name = models.CharField(max_length=100,default="Read List")
     created = models.DateTimeField(auto_now_add=True)
-    posts = models.ManyToManyField('Post')
+    posts = models.ManyToManyField('Post', through='ReadingListEntry')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'name'], name='unique_reading_list_name'),
+        ]
+        indexes = [
+            # myReadingLists pages
+            models.Index(fields=['user', 'created', 'id'], name='reading_list_user_created_idx'),
+        ]
 
     def save(self, *args, **kwargs):
-        if not self.pk:
-            counter = 1
-            while ReadingList.objects.filter(user=self.user, name=self.name).exists():
-                self.name = f"{self.name} {counter}"
-                counter += 1
-        super().save(*args, **kwargs)
+        if self.pk:
+            return super().save(*args, **kwargs)
+        # the constraint settles races between two requests picking the same name
+        base = self.name
+        for attempt in range(3):
+            self.name = ReadingList.free_name(self.user_id, base)
+            try:
+                with transaction.atomic():
+                    return super().save(*args, **kwargs)
+            except IntegrityError:
+                if attempt == 2:
+                    raise
+
+    @staticmethod
+    def free_name(user_id, name):
+        """ name, or name with the next free numeric suffix, in one query.
+            The name is cut so the suffix fits in the column. """
+        max_length = ReadingList._meta.get_field('name').max_length
+
+        def suffixed(number):
+            return f"{name[:max_length - len(str(number)) - 1]} {number}"
+
+        # suffixes of up to 10 digits only cut the name after this prefix
+        taken = ReadingList.objects.filter(user_id=user_id, name__startswith=name[:max_length - 11]).values_list('name', flat=True)
+        numbers = set()
+        for other in taken:
+            match = re.fullmatch(r'.* (\d+)', other)
+            if other == name:
+                numbers.add(0)
+            elif match and other == suffixed(int(match.group(1))):
+                numbers.add(int(match.group(1)))
+        if 0 not in numbers:
+            return name
+        return suffixed(max(numbers) + 1)
+
+    def next_position(self):
+        """ The position after the last entry; the list row must be locked,
+            see get_reading_list(lock=True), for two adds not to share it """
+        last = self.entries.aggregate(last=models.Max('position'))['last']
+        return 0 if last is None else last + 1
 
     def __str__(self):
         return self.name
+
+
+
+class ReadingListEntry(models.Model):
+    """ A post in a reading list, kept in the user's order """
+    reading_list = models.ForeignKey(ReadingList,on_delete=models.CASCADE,related_name='entries')
+    post = models.ForeignKey('Post',on_delete=models.CASCADE,related_name='reading_list_entries')
+    added = models.DateTimeField(default=timezone.now)
+    position = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['reading_list', 'post'], name='unique_reading_list_post'),
+        ]
+        indexes = [
+            models.Index(fields=['reading_list', 'position', 'id'], name='reading_list_position_idx'),
+            # streaming exports
+            models.Index(fields=['added', 'id'], name='reading_list_entry_added_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.reading_list_id}--{self.post_id}'
     
 
 
 class Author(models.Model):
     """Author model"""
     name = models.CharField(max_length=100)
-    image = models.ImageField(upload_to='media/images')
+    # uploads are stored once per distinct content, see images.py
+    image = models.ImageField(upload_to=hashed_upload_to, storage=ContentAddressedStorage())
+    # {size: [width, height]} of the rendered variants, empty until they are ready, images.FAILED if they can't be
+    image_variants = models.JSONField(default=dict, editable=False)
     joined = models.DateTimeField(auto_now_add=True)
     subscribers = models.ManyToManyField(User)
+    # denormalized, kept in sync by signals.py
+    subscriber_count = models.IntegerField(default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            # authorsByName is a LIKE 'prefix%' search, which needs the pattern opclass outside the C locale
+            models.Index(fields=['name'], name='author_name_prefix_idx', opclasses=['varchar_pattern_ops']),
+            models.Index(fields=['joined', 'id'], name='author_joined_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -45,23 +126,165 @@ class Post(models.Model):
     title = models.CharField(max_length=40)
     content = models.TextField()
     likes = models.IntegerField(validators = [MinValueValidator(0)])
-    comments = models.ManyToManyField('Comment')
+    # denormalized, kept in sync by signals.py
+    comment_count = models.IntegerField(default=0, editable=False)
     date = models.DateTimeField(auto_now_add=True)
     time_to_read = models.IntegerField()
+    # weighted title (A) + content (B), kept up to date by a database trigger
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # keyset pages of allPosts, and of each author's posts
+            models.Index(fields=['date', 'id'], name='post_date_idx'),
+            models.Index(fields=['author', 'date', 'id'], name='post_author_date_idx'),
+        ]
 
     def __str__(self):
         return f'{self.author.name}--{self.id}'
 
+    @staticmethod
+    def reading_time(content):
+        """ Minutes to read content at 200 words per minute """
+        return max(1, round(len(content.split()) / 200))
+
+    @classmethod
+    def search(cls, text):
+        """ Posts matching a web-style search, with a rank and a highlighted snippet """
+        query = SearchQuery(text, search_type='websearch', config='english')
+        return cls.objects.filter(search_vector=query).annotate(
+            # ts_rank returns a real; as a double the rank round-trips through cursors exactly
+            rank=Cast(SearchRank(F('search_vector'), query), models.FloatField()),
+            snippet=SearchHeadline('content', query, config='english', start_sel='<b>', stop_sel='</b>'),
+        )
+
 
 
 class Comment(models.Model):
     """Comments model"""
     author = models.ForeignKey(User,on_delete=models.CASCADE)
+    # null for comments that were never attached to a post
+    post = models.ForeignKey(Post,on_delete=models.CASCADE,related_name='comments',null=True,blank=True,db_index=False)
+    # the comment this one answers, on the same post
+    parent = models.ForeignKey('self',on_delete=models.CASCADE,related_name='replies',null=True,blank=True,db_index=False)
     text = models.TextField()
     likes = models.IntegerField(validators = [MinValueValidator(0)])
     date = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['date', 'id'], name='comment_date_idx'),
+            # the comments of a batch of posts and the replies of a batch of comments
+            models.Index(fields=['post', 'date', 'id'], name='comment_post_date_idx'),
+            models.Index(fields=['parent', 'date', 'id'], name='comment_parent_date_idx'),
+        ]
+
     def __str__(self):
         return f'{self.author.username}--{self.id}'
 
 
+
+class PostLike(models.Model):
+    """ One row per user that liked a post, so likes are idempotent """
+    user = models.ForeignKey(User,on_delete=models.CASCADE)
+    post = models.ForeignKey(Post,on_delete=models.CASCADE)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'post'], name='unique_post_like'),
+        ]
+        indexes = [
+            # likes since the last trending refresh
+            models.Index(fields=['created'], name='post_like_created_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.user.username}--{self.post_id}'
+
+
+
+class CommentLike(models.Model):
+    """ One row per user that liked a comment """
+    user = models.ForeignKey(User,on_delete=models.CASCADE)
+    comment = models.ForeignKey(Comment,on_delete=models.CASCADE)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'comment'], name='unique_comment_like'),
+        ]
+
+    def __str__(self):
+        return f'{self.user.username}--{self.comment_id}'
+
+
+
+
+class TimelineEntry(models.Model):
+    """ One row per post in a subscriber's feed, written when the post is
+        created (see feed.py). date is copied from the post so a feed page
+        is a single range scan of (user, date, post). """
+    user = models.ForeignKey(User,on_delete=models.CASCADE,related_name='timeline',db_index=False)
+    post = models.ForeignKey(Post,on_delete=models.CASCADE,related_name='timeline_entries')
+    author = models.ForeignKey(Author,on_delete=models.CASCADE,related_name='+')
+    date = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'post'], name='unique_timeline_post'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'date', 'post'], name='timeline_user_date_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.user_id}--{self.post_id}'
+
+
+
+class TrendingScore(models.Model):
+    """ Decayed activity of a post over one window, written by trending.py.
+        score is a log2 taken at a fixed epoch, so the scores of posts that
+        saw no activity stay comparable without being rewritten. """
+    post = models.ForeignKey(Post,on_delete=models.CASCADE,related_name='trending_scores')
+    author = models.ForeignKey(Author,on_delete=models.CASCADE,related_name='+',db_index=False)
+    window = models.CharField(max_length=8)
+    score = models.FloatField()
+    last_activity = models.DateTimeField()
+    updated = models.DateTimeField()
+    # set when a like, comment or reading list entry of the post is deleted
+    stale = models.BooleanField(default=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['window', 'post'], name='unique_trending_window_post'),
+        ]
+        indexes = [
+            # trendingPosts is a top-N scan of one window
+            models.Index(fields=['window', 'score', 'post'], name='trending_window_score_idx'),
+            models.Index(fields=['window', 'author', 'score'], name='trending_author_score_idx'),
+            models.Index(fields=['updated'], name='trending_updated_idx'),
+            models.Index(fields=['post'], condition=models.Q(stale=True), name='trending_stale_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.window}--{self.post_id}'
+
+
+
+class AuthorScore(models.Model):
+    """ The trending scores of an author's posts added up, for popularAuthors """
+    author = models.OneToOneField(Author,on_delete=models.CASCADE,primary_key=True,related_name='popularity')
+    score = models.FloatField()
+    # set when one of the author's posts is deleted along with its trending scores
+    stale = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['score', 'author'], name='author_score_idx'),
+            models.Index(fields=['author'], condition=models.Q(stale=True), name='author_score_stale_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.author_id}--{self.score}'
@@ -0,0 +1,142 @@
+from functools import wraps
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch, QuerySet
+from graphene.relay import Connection
+from graphene.utils.str_converters import to_snake_case
+from graphql import FieldNode, FragmentSpreadNode, InlineFragmentNode, get_named_type
+
+
+PAGINATION_ARGS = {'first', 'last', 'before', 'after', 'offset'}
+
+
+
+
+def selected_fields(field_nodes, info):
+    """ Groups the fields selected under field_nodes by name, expanding fragments """
+    selected = {}
+
+    def collect(selections):
+        for selection in selections:
+            if isinstance(selection, FieldNode):
+                selected.setdefault(selection.name.value, []).append(selection)
+            elif isinstance(selection, FragmentSpreadNode):
+                collect(info.fragments[selection.name.value].selection_set.selections)
+            elif isinstance(selection, InlineFragmentNode):
+                collect(selection.selection_set.selections)
+
+    for field_node in field_nodes:
+        if field_node.selection_set:
+            collect(field_node.selection_set.selections)
+    return selected
+
+
+
+def node_selection(graphql_type, field_nodes, info):
+    """ Unwraps connections (edges { node }) down to the object type and its selections """
+    graphql_type = get_named_type(graphql_type)
+    graphene_type = getattr(graphql_type, 'graphene_type', None)
+    if graphene_type is not None and issubclass(graphene_type, Connection):
+        edges = selected_fields(field_nodes, info).get('edges', [])
+        nodes = selected_fields(edges, info).get('node', [])
+        return node_selection(get_named_type(graphql_type.fields['edges'].type).fields['node'].type, nodes, info)
+    return graphql_type, field_nodes
+
+
+
+def get_model_field(model, name):
+    try:
+        return model._meta.get_field(name)
+    except FieldDoesNotExist:
+        for rel in model._meta.related_objects:
+            if rel.get_accessor_name() == name:
+                return rel
+    return None
+
+
+
+class QueryPlan:
+    """ select_related paths, Prefetch objects and only() columns for one queryset """
+
+    def __init__(self):
+        self.only = set()
+        self.select_related = set()
+        self.prefetch_related = []
+        self.unprojected = set()
+
+    def apply(self, queryset):
+        if self.select_related:
+            queryset = queryset.select_related(*sorted(self.select_related))
+        if self.prefetch_related:
+            queryset = queryset.prefetch_related(*self.prefetch_related)
+        if '' not in self.unprojected:
+            only = [f for f in self.only if not any(f.startswith(p) for p in self.unprojected)]
+            queryset = queryset.only(*sorted(only))
+        return queryset
+
+
+
+def build_plan(model, graphql_type, field_nodes, info, plan=None, prefix=''):
+    plan = plan or QueryPlan()
+    plan.only.add(prefix + model._meta.pk.name)
+
+    for name, nodes in selected_fields(field_nodes, info).items():
+        if name == '__typename':
+            continue
+        computed = getattr(getattr(graphql_type, 'graphene_type', None), 'computed_fields', {})
+        if to_snake_case(name) in computed:
+            plan.only.update(prefix + column for column in computed[to_snake_case(name)])
+            continue
+        field = get_model_field(model, to_snake_case(name))
+        if field is None:
+            # computed field: we can't tell which columns it reads
+            plan.unprojected.add(prefix)
+            continue
+
+        if not field.is_relation:
+            plan.only.add(prefix + field.name)
+            continue
+
+        related_type, related_nodes = node_selection(graphql_type.fields[name].type, nodes, info)
+        if field.concrete and not field.many_to_many:
+            # forward foreign key: join it into the same query
+            path = prefix + field.name
+            plan.only.add(path)
+            plan.select_related.add(path)
+            build_plan(field.related_model, related_type, related_nodes, info, plan, path + '__')
+            continue
+
+        if any(arg.name.value not in PAGINATION_ARGS for node in nodes for arg in node.arguments):
+            # filtered relations are batched by the request loaders instead
+            continue
+        nested = build_plan(field.related_model, related_type, related_nodes, info)
+        if field.one_to_many:
+            nested.only.add(field.field.name)
+        lookup = prefix + (field.get_accessor_name() if field.auto_created else field.name)
+        queryset = nested.apply(field.related_model._default_manager.all())
+        plan.prefetch_related.append(Prefetch(lookup, queryset=queryset))
+
+    return plan
+
+
+
+def optimize(queryset, info):
+    """ Applies select_related, prefetch_related and only() to queryset
+        based on the fields requested in info """
+    graphql_type, field_nodes = node_selection(info.return_type, info.field_nodes, info)
+    plan = build_plan(queryset.model, graphql_type, field_nodes, info)
+    # a related manager attaches its instance to each row, which reads the
+    # foreign key; deferring it would cost a query per row
+    plan.only.update(field.name for field in queryset._known_related_objects)
+    return plan.apply(queryset)
+
+
+
+def optimized(resolver):
+    """ Decorator for resolvers that return a queryset """
+    @wraps(resolver)
+    def wrapper(root, info, **kwargs):
+        result = resolver(root, info, **kwargs)
+        if isinstance(result, QuerySet):
+            return optimize(result, info)
+        return result
+    return wrapper
@@ -0,0 +1,249 @@
+import json
+from functools import partial
+import graphene
+from asgiref.sync import sync_to_async
+from django.db import connection as db_connection
+from django.db.models import F, Func, Model, QuerySet, Value
+from graphene import relay
+from graphene.types.utils import get_type
+from graphene_django import DjangoConnectionField
+from graphene_django.filter import DjangoFilterConnectionField
+from graphql import GraphQLError
+from graphql_relay.utils import base64, unbase64
+from .loaders import get_loaders
+
+
+
+
+class CountableConnection(relay.Connection):
+    """ Connection with an opt-in totalCount, computed only when requested """
+
+    class Meta:
+        abstract = True
+
+    total_count = graphene.Int(estimate=graphene.Boolean(default_value=False))
+
+    def resolve_total_count(root, info, estimate=False):
+        iterable = root.iterable
+        if not isinstance(iterable, QuerySet):
+            return len(iterable)
+        if get_loaders(info).is_async:
+            return sync_to_async(estimate_count)(iterable) if estimate else iterable.acount()
+        if estimate:
+            return estimate_count(iterable)
+        return iterable.count()
+
+
+
+def estimate_count(queryset):
+    """ Planner row estimate on PostgreSQL instead of a full COUNT(*) """
+    if db_connection.vendor != 'postgresql':
+        return queryset.count()
+    plan = json.loads(queryset.order_by().explain(format='json'))
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+
+class Row(Func):
+    """ SQL row value, so (a, b) < (x, y) can use a composite index """
+    template = '(%(expressions)s)'
+
+
+
+def encode_cursor(values):
+    return base64(json.dumps([str(value) for value in values]))
+
+
+def decode_cursor(cursor, fields):
+    try:
+        values = json.loads(unbase64(cursor))
+        return [field.to_python(value) for field, value in zip(fields, values, strict=True)]
+    except Exception:
+        raise Exception(f"Invalid cursor {cursor}")
+
+
+
+class KeysetMixin:
+    """ Paginates a connection by a (key, id) keyset instead of COUNT(*)
+        and OFFSET. Results are ordered newest first unless descending is off. """
+
+    def __init__(self, type_, keys=('date', 'id'), connection=None, descending=True, *args, **kwargs):
+        self.keys = keys
+        self.descending = descending
+        self._connection = connection
+        super().__init__(type_, *args, **kwargs)
+        # keyset pages have no OFFSET
+        base_args = getattr(self, '_base_args', None)
+        (self.args if base_args is None else base_args).pop('offset', None)
+
+    @property
+    def type(self):
+        # types without a relay connection of their own pass one explicitly
+        if self._connection is not None:
+            return get_type(self._connection)
+        return super().type
+
+    def wrap_resolve(self, parent_resolver):
+        return partial(
+            self.keyset_resolver,
+            parent_resolver,
+            self.connection_type,
+            self.get_manager(),
+            self.get_queryset_resolver(),
+        )
+
+    def check_limits(self, info, args):
+        first = args.get('first')
+        last = args.get('last')
+        for name in ('first', 'last'):
+            if (args.get(name) or 0) < 0:
+                raise GraphQLError(f"`{name}` on the `{info.field_name}` connection can't be negative, got {args[name]}")
+        if self.enforce_first_or_last:
+            assert first is not None or last is not None, f"You must provide a `first` or `last` value to paginate the `{info.field_name}` connection."
+        if self.max_limit:
+            for name in ('first', 'last'):
+                assert (args.get(name) or 0) <= self.max_limit, (
+                    f"Requesting {args[name]} records on the `{info.field_name}` connection exceeds the `{name}` limit of {self.max_limit} records."
+                )
+
+    def keyset_resolver(self, resolver, connection, default_manager, queryset_resolver, root, info, **args):
+        self.check_limits(info, args)
+        iterable = resolver(root, info, **args)
+        if iterable is None:
+            iterable = default_manager
+        queryset = queryset_resolver(connection, iterable, info, args)
+        if get_loaders(info).is_async:
+            return self.resolve_keyset_async(connection, args, queryset)
+        return self.resolve_keyset(connection, args, queryset)
+
+    def resolve_keyset(self, connection, args, queryset):
+        page, limit, backwards = self.keyset_page(args, queryset)
+        rows = list(page if limit is None else page[:limit + 1])
+        return self.keyset_connection(connection, queryset, rows, limit, backwards, self.get_keys(args))
+
+    async def resolve_keyset_async(self, connection, args, queryset):
+        page, limit, backwards = self.keyset_page(args, queryset)
+        rows = [row async for row in (page if limit is None else page[:limit + 1])]
+        return self.keyset_connection(connection, queryset, rows, limit, backwards, self.get_keys(args))
+
+    def get_keys(self, args):
+        """ The keys a page is ordered by """
+        return self.keys
+
+    def keyset_page(self, args, queryset):
+        """ Returns the ordered queryset after the cursor, the page size and
+            whether the page is read backwards """
+        keys = self.get_keys(args)
+        # keys are model fields or annotations such as a search rank
+        annotations = queryset.query.annotations
+        fields = [
+            annotations[key].output_field if key in annotations else queryset.model._meta.get_field(key)
+            for key in keys
+        ]
+        first, last = args.get('first'), args.get('last')
+        after, before = args.get('after'), args.get('before')
+
+        # paginating backwards walks the keyset in the opposite order and flips the page
+        backwards = last is not None and first is None
+        limit = last if backwards else first
+        if limit is None:
+            limit = self.max_limit
+
+        page = queryset
+        deferred, defer = page.query.deferred_loading
+        if deferred and not defer:
+            page = page.only(*deferred, *[key for key in keys if key not in annotations])
+        key = Row(*[F(name) for name in keys], output_field=fields[0])
+        after_lookup, before_lookup = ('lt', 'gt') if self.descending else ('gt', 'lt')
+        if after:
+            bound = Row(*[Value(v, output_field=f) for f, v in zip(fields, decode_cursor(after, fields))], output_field=fields[0])
+            page = page.alias(keyset=key).filter(**{f'keyset__{after_lookup}': bound})
+        if before:
+            bound = Row(*[Value(v, output_field=f) for f, v in zip(fields, decode_cursor(before, fields))], output_field=fields[0])
+            page = page.alias(keyset_before=key).filter(**{f'keyset_before__{before_lookup}': bound})
+
+        if backwards == self.descending:
+            page = page.order_by(*keys)
+        else:
+            page = page.order_by(*[f'-{name}' for name in keys])
+        return page, limit, backwards
+
+    def keyset_connection(self, connection, queryset, rows, limit, backwards, keys=None):
+        """ Builds the connection from rows fetched with LIMIT n + 1 """
+        keys = keys or self.keys
+        has_more = limit is not None and len(rows) > limit
+        if has_more:
+            rows = rows[:limit]
+        if backwards:
+            rows.reverse()
+
+        edges = [
+            connection.Edge(node=row, cursor=encode_cursor([getattr(row, name) for name in keys]))
+            for row in rows
+        ]
+        page_info = relay.PageInfo(
+            start_cursor=edges[0].cursor if edges else None,
+            end_cursor=edges[-1].cursor if edges else None,
+            has_previous_page=has_more if backwards else False,
+            has_next_page=False if backwards else has_more,
+        )
+        result = connection(edges=edges, page_info=page_info)
+        result.iterable = queryset
+        return result
+
+
+
+class KeysetConnectionField(KeysetMixin, DjangoConnectionField):
+    pass
+
+
+
+class KeysetFilterConnectionField(KeysetMixin, DjangoFilterConnectionField):
+    pass
+
+
+
+class BatchedKeysetConnectionField(KeysetConnectionField):
+    """ Keyset connection over a one-to-many relation of the parent object.
+        The pages of all the sibling parents are read in one query, numbered
+        per parent with ROW_NUMBER() by Django's sliced Prefetch, and loaded
+        through the request loaders. The resolver returns the queryset the
+        pages are taken from, without the parent filter. orderings maps the
+        values of an order_by argument to the keys it sorts by. """
+
+    def __init__(self, type_, relation, orderings=None, *args, **kwargs):
+        self.relation = relation
+        self.orderings = orderings or {}
+        super().__init__(type_, *args, **kwargs)
+
+    def get_keys(self, args):
+        order = args.get('order_by')
+        return self.keys if order is None else self.orderings[order.value]
+
+    def keyset_resolver(self, resolver, connection, default_manager, queryset_resolver, root, info, **args):
+        if not isinstance(root, Model):
+            return super().keyset_resolver(resolver, connection, default_manager, queryset_resolver, root, info, **args)
+        self.check_limits(info, args)
+        iterable = resolver(root, info, **args)
+        queryset = queryset_resolver(connection, default_manager if iterable is None else iterable, info, args)
+        column = getattr(type(root), self.relation).field.name
+
+        page, limit, backwards = self.keyset_page(args, queryset)
+        deferred, defer = page.query.deferred_loading
+        if deferred and not defer:
+            # the prefetch matches rows to their parent by it
+            page = page.only(*deferred, column)
+        if limit is not None:
+            page = page[:limit + 1]
+        # siblings share the batch of the same field node and arguments
+        key = (id(info.field_nodes[0]), json.dumps(args, sort_keys=True, default=str))
+        rows = get_loaders(info).load(root, self.relation, page, key)
+
+        counted = queryset.filter(**{column: root.pk})
+        keys = self.get_keys(args)
+        if isinstance(rows, list):
+            return self.keyset_connection(connection, counted, list(rows), limit, backwards, keys)
+
+        async def await_rows():
+            return self.keyset_connection(connection, counted, list(await rows), limit, backwards, keys)
+        return await_rows()
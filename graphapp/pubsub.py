@@ -0,0 +1,166 @@
+import asyncio
+import json
+import logging
+import select
+import threading
+import time
+from collections import defaultdict
+from django.db import connection, connections, transaction
+from django.utils.module_loading import import_string
+from .conf import app_setting
+
+
+logger = logging.getLogger(__name__)
+
+_pubsub = None
+
+
+
+
+class Event:
+    """ One published message. Every subscriber that receives it gets the
+        same instance, so the objects it names are loaded once and each
+        distinct selection of them is executed once. """
+
+    def __init__(self, channels, payload):
+        self.channels = channels
+        self.payload = payload
+        self.instances = {}
+        # (document, variables, user) -> future of the serialized result
+        self.results = {}
+
+    def load(self, queryset):
+        """ The object of queryset.model whose pk is the payload's id, or None """
+        model = queryset.model
+        if model not in self.instances:
+            self.instances[model] = queryset.filter(pk=self.payload['id']).first()
+        return self.instances[model]
+
+
+
+def deliver(queues, event):
+    for queue in queues:
+        try:
+            queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # a subscriber that stopped reading loses events instead of memory
+            pass
+
+
+
+class InMemoryPubSub:
+    """ Delivers events to the subscribers of this process. publish() may be
+        called from any thread; subscribers are async iterators on an event
+        loop, which is woken once per event however many of them listen. """
+
+    def __init__(self):
+        # channel -> {(loop, queue)}
+        self.subscribers = defaultdict(set)
+        self.lock = threading.Lock()
+
+    def publish(self, channels, payload):
+        """ Sends payload to the subscribers of any of channels once the
+            current transaction commits """
+        channels = list(channels)
+        transaction.on_commit(lambda: self.dispatch(channels, payload))
+
+    def dispatch(self, channels, payload):
+        with self.lock:
+            entries = set().union(*(self.subscribers.get(channel, ()) for channel in channels))
+        if not entries:
+            return
+        event = Event(channels, payload)
+        by_loop = defaultdict(list)
+        for loop, queue in entries:
+            by_loop[loop].append(queue)
+        for loop, queues in by_loop.items():
+            try:
+                loop.call_soon_threadsafe(deliver, queues, event)
+            except RuntimeError:
+                # the loop was closed under its subscribers
+                pass
+
+    async def subscribe(self, channels):
+        """ Yields the events published on any of channels """
+        entry = (asyncio.get_running_loop(), asyncio.Queue(app_setting('SUBSCRIPTION_QUEUE_SIZE')))
+        with self.lock:
+            for channel in channels:
+                self.subscribers[channel].add(entry)
+        try:
+            while True:
+                yield await entry[1].get()
+        finally:
+            with self.lock:
+                for channel in channels:
+                    self.subscribers[channel].discard(entry)
+                    if not self.subscribers[channel]:
+                        del self.subscribers[channel]
+
+
+
+class PostgresPubSub(InMemoryPubSub):
+    """ Publishes with NOTIFY so the subscribers of every process see the
+        events. NOTIFY is delivered on commit, and a thread per process
+        LISTENs on one channel and dispatches to its local subscribers. """
+
+    channel = 'graphapp_events'
+
+    def __init__(self):
+        super().__init__()
+        self.listener = None
+
+    def publish(self, channels, payload):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [
+                self.channel, json.dumps({'channels': list(channels), 'payload': payload}),
+            ])
+
+    def subscribe(self, channels):
+        with self.lock:
+            if self.listener is None:
+                self.listener = threading.Thread(target=self.listen, name='graphapp-pubsub', daemon=True)
+                self.listener.start()
+        return super().subscribe(channels)
+
+    def listen(self):
+        while True:
+            db = connections.create_connection('default')
+            try:
+                db.set_autocommit(True)
+                with db.cursor() as cursor:
+                    cursor.execute(f'LISTEN {self.channel}')
+                raw = db.connection
+                while True:
+                    if select.select([raw], [], [], 5) == ([], [], []):
+                        continue
+                    raw.poll()
+                    while raw.notifies:
+                        message = json.loads(raw.notifies.pop(0).payload)
+                        self.dispatch(message['channels'], message['payload'])
+            except Exception:
+                logger.exception("Lost the LISTEN connection, reconnecting")
+                time.sleep(1)
+            finally:
+                db.close()
+
+
+
+def get_pubsub():
+    global _pubsub
+    if _pubsub is None:
+        _pubsub = import_string(app_setting('PUBSUB_BACKEND'))()
+    return _pubsub
+
+
+
+# channels of the Subscription fields in schema.py
+
+def publish_posts(posts):
+    for post in posts:
+        get_pubsub().publish([f'post_added:{post.author_id}', 'post_added'], {'id': post.id})
+
+
+
+def publish_comments(post_id, comment_ids):
+    for comment_id in comment_ids:
+        get_pubsub().publish([f'comment_added:{post_id}'], {'id': comment_id})
@@ -0,0 +1,112 @@
+import difflib
+import json
+import re
+from django.contrib.auth.models import AnonymousUser, User
+from django.db import DEFAULT_DB_ALIAS, connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from graphql import get_operation_ast
+from .benchmark import OPERATIONS, fixtures, seed_data
+from .conf import app_setting
+from .schema import schema
+from .views import CachedGraphQLView
+
+
+
+
+def normalize(sql):
+    """ SQL without its literals, so runs on different rows compare equal """
+    sql = re.sub(r"'(?:[^']|'')*'", "?", sql)
+    # savepoints are named after the thread
+    sql = re.sub(r'"s\d+_x\d+"', '"s?"', sql)
+    sql = re.sub(r'\b\d+(?:\.\d+)?\b', '?', sql)
+    return re.sub(r'\(\?(?:, \?)*\)', '(...)', sql)
+
+
+
+def measure(scale=1, operations=None, seed=0):
+    """ Runs each operation once against a blog seeded at `scale` times the
+        base size and returns {name: [normalized SQL]}. The data is seeded
+        in a transaction that is rolled back afterwards. """
+    view = CachedGraphQLView(schema=schema)
+    factory = RequestFactory()
+    names = operations or [
+        name for name, operation in OPERATIONS.items()
+        if not (operation.get('postgresql') and connection.vendor != 'postgresql')
+    ]
+    queries = {}
+    with transaction.atomic():
+        seed_data(authors=3 * scale, users=5 * scale, posts=20 * scale, comments=60 * scale, subscriptions=2,
+                  lists=2, list_size=3 * scale, seed=seed, prefix='querycount')
+        user = User.objects.get(username='querycount0')
+        data = fixtures(user, seed)
+        for name in names:
+            operation = OPERATIONS[name]
+            request = factory.post('/api/graphql')
+            request.user = user if operation.get('auth') else AnonymousUser()
+            # the seeded rows only exist in this transaction on the primary
+            request.graphql_database = DEFAULT_DB_ALIAS
+            document, errors = view.get_document(operation['query'])
+            with CaptureQueriesContext(connection) as ctx:
+                result = view.execute_document(
+                    request, document, get_operation_ast(document), operation['variables'](data), None
+                )
+            errors = errors or result.errors
+            if errors:
+                raise ValueError(f"{name}: {errors[0]}")
+            queries[name] = [normalize(query['sql']) for query in ctx.captured_queries]
+        transaction.set_rollback(True)
+    return queries
+
+
+
+def load_baseline(path=None):
+    try:
+        with open(path or app_setting('QUERY_BASELINE')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+
+def save_baseline(queries, path=None):
+    """ Replaces this vendor's counts in the baseline file """
+    baseline = load_baseline(path)
+    baseline[connection.vendor] = {
+        name: {'queries': len(sql), 'sql': sql} for name, sql in sorted(queries.items())
+    }
+    with open(path or app_setting('QUERY_BASELINE'), 'w') as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+
+def diff(before, after, before_name, after_name):
+    return '\n'.join(difflib.unified_diff(before, after, before_name, after_name, lineterm='', n=0))
+
+
+
+def check(scales=(1, 3), operations=None, path=None):
+    """ Measures the operations at two dataset sizes and returns (queries
+        at the smaller size, growing, over_baseline): descriptions of the
+        operations whose query count grows with the data and of those that
+        run more queries than their baseline """
+    small = measure(scales[0], operations)
+    large = measure(scales[1], operations)
+    baseline = load_baseline(path).get(connection.vendor, {})
+    growing, over_baseline = [], []
+    for name, sql in small.items():
+        if len(large[name]) > len(sql):
+            growing.append(
+                f"{name} runs {len(sql)} queries at scale {scales[0]} and {len(large[name])} at scale {scales[1]}\n"
+                + diff(sql, large[name], f'scale {scales[0]}', f'scale {scales[1]}')
+            )
+        expected = baseline.get(name)
+        if expected is None:
+            over_baseline.append(f"{name} has no baseline, record it with query_counts --update")
+        elif len(sql) > expected['queries']:
+            over_baseline.append(
+                f"{name} runs {len(sql)} queries, its baseline is {expected['queries']}\n"
+                + diff(expected['sql'], sql, 'baseline', 'now')
+            )
+    return small, growing, over_baseline
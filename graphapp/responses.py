@@ -0,0 +1,139 @@
+import hashlib
+import json
+import uuid
+from django.core.cache import caches
+from django.db import transaction
+from graphql import GraphQLError, TypeInfo, TypeInfoVisitor, Visitor, get_named_type, print_ast, visit
+from graphql.execution.values import get_argument_values
+from graphql_jwt.utils import get_http_authorization
+from .conf import app_setting
+from .documents import DocumentCache
+
+
+
+
+def type_model(graphql_type):
+    graphene_type = getattr(get_named_type(graphql_type), 'graphene_type', None)
+    model = getattr(getattr(graphene_type, '_meta', None), 'model', None)
+    return model.__name__ if model is not None else None
+
+
+
+class TagCollector(Visitor):
+    """ Tags a document with the models it reads. Root fields that look an
+        object up by id (post(id:), author(id:)) are tagged with that object
+        only, so they survive writes to other objects of the same model. """
+
+    def __init__(self, schema, type_info):
+        super().__init__()
+        self.query_type = schema.query_type
+        self.type_info = type_info
+        self.tags = set()
+        self.lookups = []
+
+    def enter_field(self, node, *_args):
+        field_def = self.type_info.get_field_def()
+        if field_def is None:
+            return
+        model = type_model(field_def.type)
+        if model is None:
+            return
+        if self.type_info.get_parent_type() is self.query_type and 'id' in field_def.args:
+            self.lookups.append((model, field_def, node))
+        else:
+            self.tags.add(model)
+
+
+
+class ResponseCache:
+    """ Whole responses of anonymous queries, stored in a django cache.
+
+        Every entry remembers the version of each tag it was built from and
+        is ignored once any of them changes, so invalidating a tag is a
+        single cache write however many responses depend on it. """
+
+    def __init__(self, cache_alias='default', timeout=60, maxsize=1000):
+        self.cache_alias = cache_alias
+        self.timeout = timeout
+        # normalized hash and tags of each document, keyed by query hash
+        self.plans = DocumentCache(maxsize)
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def cacheable(self, request, operation_ast):
+        """ Only anonymous queries are shared between clients """
+        if not self.timeout or operation_ast is None or operation_ast.operation.value != 'query':
+            return False
+        if get_http_authorization(request):
+            return False
+        user = getattr(request, 'user', None)
+        return not (user is not None and user.is_authenticated)
+
+    def plan(self, schema, key, document):
+        plan = self.plans.get(key)
+        if plan is None:
+            type_info = TypeInfo(schema)
+            collector = TagCollector(schema, type_info)
+            visit(document, TypeInfoVisitor(type_info, collector))
+            normalized = hashlib.sha256(print_ast(document).encode('utf-8')).hexdigest()
+            plan = (normalized, frozenset(collector.tags), collector.lookups)
+            self.plans.set(key, plan)
+        return plan
+
+    def entry_key(self, schema, key, document, operation_name, variables):
+        """ Returns (cache key, tags) of one execution of a document """
+        normalized, tags, lookups = self.plan(schema, key, document)
+        tags = set(tags)
+        for model, field_def, node in lookups:
+            try:
+                object_id = get_argument_values(field_def, node, variables).get('id')
+            except GraphQLError:
+                object_id = None
+            tags.add(model if object_id is None else f'{model}:{object_id}')
+        variables = json.dumps(variables or {}, sort_keys=True, default=str)
+        digest = hashlib.sha256(f'{normalized}:{operation_name}:{variables}'.encode('utf-8')).hexdigest()
+        return f'gqlresponse:{digest}', sorted(tags)
+
+    def tag_versions(self, tags, create=False):
+        keys = {f'gqltag:{tag}': tag for tag in tags}
+        versions = self.cache.get_many(keys)
+        if create:
+            for key in keys.keys() - versions.keys():
+                self.cache.add(key, uuid.uuid4().hex, None)
+                versions[key] = self.cache.get(key)
+        return {keys[key]: version for key, version in versions.items()}
+
+    def get(self, key, tags):
+        """ Returns (data, versions): the cached data of key, or None, and the
+            versions of tags as of now. A response executed after this is
+            stored under these versions, so an invalidation that commits while
+            it runs still counts. """
+        versions = self.tag_versions(tags, create=True)
+        entry = self.cache.get(key)
+        if entry is None or entry[0] != versions:
+            return None, versions
+        return entry[1], versions
+
+    def set(self, key, versions, data):
+        self.cache.set(key, (versions, data), self.timeout)
+
+    def invalidate(self, *tags):
+        self.cache.set_many({f'gqltag:{tag}': uuid.uuid4().hex for tag in tags}, None)
+
+
+
+
+def get_response_cache():
+    return ResponseCache(
+        cache_alias=app_setting('RESPONSE_CACHE'),
+        timeout=app_setting('RESPONSE_CACHE_TIMEOUT'),
+        maxsize=app_setting('DOCUMENT_CACHE_SIZE'),
+    )
+
+
+def invalidate(*tags):
+    """ Drops the cached responses that read any of the tags once the
+        current transaction commits """
+    transaction.on_commit(lambda: get_response_cache().invalidate(*tags))
@@ -0,0 +1,106 @@
+import logging
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from django.utils.deprecation import MiddlewareMixin
+from graphql import OperationType
+from .conf import app_setting
+
+
+logger = logging.getLogger(__name__)
+
+# the alias reads go to in the current context, None outside GraphQL operations
+_reads = ContextVar('graphapp_reads', default=None)
+
+# replica alias -> time.monotonic() before which it isn't tried again
+_down = {}
+
+# set on the responses to mutations, reads of the next requests stay on the primary
+PIN_COOKIE = 'graphapp_primary'
+
+
+
+
+class ReplicaRouter:
+    """ Sends reads to the alias chosen for the running operation and every
+        write to the primary. The first write also moves the reads that
+        follow it to the primary, so they see what was written. """
+
+    def db_for_read(self, model, **hints):
+        return _reads.get() or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        if _reads.get() not in (None, DEFAULT_DB_ALIAS):
+            _reads.set(DEFAULT_DB_ALIAS)
+        # not None, which would fall back to the database the instance was read from
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replicas hold the primary's rows
+        aliases = {DEFAULT_DB_ALIAS, *app_setting('READ_REPLICAS')}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, **hints):
+        # the schema reaches the replicas through replication
+        if db in app_setting('READ_REPLICAS'):
+            return False
+        return None
+
+
+
+def available(alias):
+    """ Whether alias answers, checked on its connection and remembered for
+        REPLICA_RETRY_SECONDS when it doesn't """
+    if _down.get(alias, 0) > time.monotonic():
+        return False
+    db = connections[alias]
+    try:
+        # pings a persistent connection once per request when CONN_HEALTH_CHECKS is on
+        db.close_if_health_check_failed()
+        db.ensure_connection()
+    except DatabaseError:
+        logger.warning("Replica %s is unavailable, reading from the primary", alias, exc_info=True)
+        _down[alias] = time.monotonic() + app_setting('REPLICA_RETRY_SECONDS')
+        return False
+    _down.pop(alias, None)
+    return True
+
+
+
+def read_database(request, operation_ast):
+    """ The alias an operation of request reads from. Queries go to a replica,
+        unless this request or one of the client's last few wrote; a mutation
+        pins the rest of the request, and its client, to the primary. """
+    if operation_ast is not None and operation_ast.operation == OperationType.MUTATION:
+        request.graphql_wrote = True
+    if getattr(request, 'graphql_wrote', False) or PIN_COOKIE in request.COOKIES:
+        return DEFAULT_DB_ALIAS
+    replicas = [alias for alias in app_setting('READ_REPLICAS') if available(alias)]
+    return random.choice(replicas) if replicas else DEFAULT_DB_ALIAS
+
+
+
+@contextmanager
+def reading_from(alias):
+    """ Routes the reads of the block to alias """
+    token = _reads.set(alias)
+    try:
+        yield
+    finally:
+        _reads.reset(token)
+
+
+
+class ReadYourWritesMiddleware(MiddlewareMixin):
+    """ Keeps a client that just wrote on the primary until the replicas
+        have caught up with its write """
+
+    def process_response(self, request, response):
+        seconds = app_setting('READ_YOUR_WRITES_SECONDS')
+        if getattr(request, 'graphql_wrote', False) and app_setting('READ_REPLICAS') and seconds:
+            response.set_cookie(PIN_COOKIE, '1', max_age=seconds, httponly=True, samesite='Lax')
+        return response
@@ -2,12 +2,24 @@ import graphene
 from graphene_django import DjangoObjectType
 from .models import *
 from .filters import *
-from graphene_django.filter import DjangoFilterConnectionField 
 from graphql_jwt.decorators import login_required
 from graphql_jwt.shortcuts import create_refresh_token, get_token
 import graphql_jwt
 from django.contrib.auth import get_user_model , authenticate
 from graphene import relay
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from .feed import FeedConnectionField, backfill, fan_out, prune
+from .fields import BatchedFilterConnectionField, FilterConnectionField
+from .images import variant_name
+from .loaders import fetch, get_loaders
+from .optimizer import optimize, optimized
+from .pagination import BatchedKeysetConnectionField, CountableConnection, KeysetConnectionField, KeysetFilterConnectionField
+from .pubsub import get_pubsub, publish_comments, publish_posts
+from .responses import invalidate
+from .signals import refresh_comment_counts
+from .trending import popular_authors, trending_posts
 
 
 
@@ -21,34 +33,196 @@ class UserType(DjangoObjectType):
         exclude = ['password']
 
 
+class CommentOrder(graphene.Enum):
+    DATE = 'date'
+    LIKES = 'likes'
+
+
+COMMENT_ORDERINGS = {'date': ('date', 'id'), 'likes': ('likes', 'id')}
+
+
+def comment_connection(relation, description):
+    """ A page of comments per parent, newest or most liked first """
+    return BatchedKeysetConnectionField(
+        lambda: CommentType, relation=relation, orderings=COMMENT_ORDERINGS, connection=lambda: CommentTypeConnection,
+        order_by=CommentOrder(default_value=CommentOrder.DATE), required=True, description=description,
+    )
+
+
 class PostType(DjangoObjectType):
+    comments = comment_connection('comments', "Comments on the post that don't reply to another comment")
+
     class Meta:
         model = Post
+        exclude = ['search_vector', 'reading_list_entries']
         interfaces = (relay.Node,)
+        connection_class = CountableConnection
         filter_fields = {
             'content': ['startswith']
         }
 
+    snippet = graphene.String(description="Highlighted match, only set on searchPosts results")
+    # columns read by fields that are not model fields (see optimizer.py),
+    # and comments, which are paginated per post and must not be prefetched
+    computed_fields = {'snippet': [], 'comments': []}
+
+    def resolve_snippet(root, info):
+        return getattr(root, 'snippet', None)
+
+    def resolve_author(root, info):
+        return get_loaders(info).load(root, 'author')
+
+    @optimized
+    def resolve_comments(root, info, **kwargs):
+        return Comment.objects.filter(parent=None)
+
+
+class ImageSize(graphene.Enum):
+    ORIGINAL = 'original'
+    THUMB = 'thumb'
+    MEDIUM = 'medium'
+
+
+class ImageFormat(graphene.Enum):
+    WEBP = 'webp'
+    JPEG = 'jpeg'
+
+
+class ImageType(graphene.ObjectType):
+    url = graphene.String(required=True)
+    width = graphene.Int(description="Null until the image has been processed")
+    height = graphene.Int()
+
+
 class AuthorType(DjangoObjectType):
+    post_set = BatchedFilterConnectionField(PostType, relation='post_set', required=True)
+    image_url = graphene.Field(
+        ImageType, size=ImageSize(default_value=ImageSize.THUMB), format=ImageFormat(default_value=ImageFormat.WEBP),
+        description="A resized copy of the image, the original until the copies are ready",
+    )
+
     class Meta:
         model = Author
+        exclude = ['image_variants']
         interfaces = (relay.Node,)
+        connection_class = CountableConnection
         filterset_class = AuthorFilter
 
-    
+    computed_fields = {'image_url': ['image', 'image_variants']}
+
+    def resolve_image_url(root, info, size, format):
+        if not root.image:
+            return None
+        dimensions = root.image_variants.get(size.value)
+        if size == ImageSize.ORIGINAL or dimensions is None:
+            width, height = root.image_variants.get('original', [None, None])
+            return ImageType(url=root.image.url, width=width, height=height)
+        width, height = dimensions
+        url = root.image.storage.url(variant_name(root.image.name, size.value, format.value))
+        return ImageType(url=url, width=width, height=height)
+
+    def resolve_subscribers(root, info):
+        return get_loaders(info).load(root, 'subscribers')
+
+
 class CommentType(DjangoObjectType):
+    replies = comment_connection('replies', "Comments answering this one")
+
     class Meta:
         model = Comment
 
+    computed_fields = {'replies': []}
+
+    def resolve_author(root, info):
+        return get_loaders(info).load(root, 'author')
+
+    def resolve_post(root, info):
+        return get_loaders(info).load(root, 'post')
+
+    def resolve_parent(root, info):
+        return get_loaders(info).load(root, 'parent')
+
+    @optimized
+    def resolve_replies(root, info, **kwargs):
+        return Comment.objects.all()
+
+
+class ReadingListEntryType(DjangoObjectType):
+    class Meta:
+        model = ReadingListEntry
+        fields = ['post', 'added', 'position']
+
+    def resolve_post(root, info):
+        return get_loaders(info).load(root, 'post')
+
+
+class ReadingListEntryTypeConnection(CountableConnection):
+    class Meta:
+        node = ReadingListEntryType
+
 
 class ReadingListType(DjangoObjectType):
+    posts = BatchedFilterConnectionField(PostType, relation='posts', required=True)
+    entries = KeysetConnectionField(
+        ReadingListEntryType, keys=('position', 'id'), descending=False, connection=ReadingListEntryTypeConnection,
+        description="The list's posts in the user's order",
+    )
+
     class Meta:
         model = ReadingList
 
+    # paginated per list, so the optimizer must not prefetch it
+    computed_fields = {'entries': []}
+
+    def resolve_entries(root, info, **kwargs):
+        return optimize(root.entries.all(), info)
+
+
+# connections for the types that are exposed as plain lists on their relations
+
+class UserTypeConnection(CountableConnection):
+    class Meta:
+        node = UserType
+
+
+class CommentTypeConnection(CountableConnection):
+    class Meta:
+        node = CommentType
+
+
+class ReadingListTypeConnection(CountableConnection):
+    class Meta:
+        node = ReadingListType
+
 
 
 #######################------------------ Mutations -----------------------####################
 
+# bulk mutations report the items they skipped instead of failing the whole batch
+
+class ItemError(graphene.ObjectType):
+    index = graphene.Int(required=True, description="Position of the item in the input list")
+    message = graphene.String(required=True)
+
+
+def item_errors(index, error):
+    if isinstance(error, ValidationError):
+        return [ItemError(index=index, message=f'{field}: {message}')
+                for field, messages in error.message_dict.items() for message in messages]
+    return [ItemError(index=index, message=str(error))]
+
+
+def parse_ids(ids):
+    """ Maps each position to an int id, or None when it isn't one """
+    parsed = []
+    for value in ids:
+        try:
+            parsed.append(int(value))
+        except (TypeError, ValueError):
+            parsed.append(None)
+    return parsed
+
+
 #### Authentication & creating accounts ####
 
 class LoginUser(graphene.Mutation):
@@ -89,26 +263,172 @@ class CreateUser(graphene.Mutation):
         user.save()
         token = get_token(user)
         refresh_token = create_refresh_token(user)
+        invalidate('User')
         return CreateUser(user=user, token=token, refresh_token=refresh_token)
 
 
 
 
+def get_reading_list(info, list_id, lock=False):
+    """ A list of the current user; lock holds its row until the transaction
+        ends, so concurrent changes to its positions run one after the other """
+    lists = ReadingList.objects.select_for_update() if lock else ReadingList.objects
+    try:
+        return lists.get(id=list_id, user=info.context.user)
+    except (ReadingList.DoesNotExist, ValueError):
+        raise Exception("Reading list doesn't exist")
+
+
+
+class CreateReadingList(graphene.Mutation):
+    reading_list = graphene.Field(ReadingListType)
+
+    class Arguments:
+        name = graphene.String()
+
+    @login_required
+    def mutate(self,info,name=None):
+        reading_list = ReadingList(user=info.context.user)
+        if name:
+            reading_list.name = name
+        reading_list.save()
+        invalidate('ReadingList')
+        return CreateReadingList(reading_list=reading_list)
+
+
+
+class RenameReadingList(graphene.Mutation):
+    reading_list = graphene.Field(ReadingListType)
+
+    class Arguments:
+        list_id = graphene.ID(required=True)
+        name = graphene.String(required=True)
+
+    @login_required
+    def mutate(self,info,list_id,name):
+        reading_list = get_reading_list(info, list_id)
+        reading_list.name = name
+        try:
+            with transaction.atomic():
+                reading_list.save(update_fields=['name'])
+        except IntegrityError:
+            raise Exception(f"You already have a reading list named {name}")
+        invalidate('ReadingList')
+        return RenameReadingList(reading_list=reading_list)
+
+
+
+class DeleteReadingList(graphene.Mutation):
+    message = graphene.String()
+
+    class Arguments:
+        list_id = graphene.ID(required=True)
+
+    @login_required
+    def mutate(self,info,list_id):
+        reading_list = get_reading_list(info, list_id)
+        reading_list.delete()
+        invalidate('ReadingList')
+        return DeleteReadingList(message=f"Reading list {reading_list.name} deleted successfully")
+
+
+
+class ReorderReadingList(graphene.Mutation):
+    reading_list = graphene.Field(ReadingListType)
+
+    class Arguments:
+        list_id = graphene.ID(required=True)
+        post_ids = graphene.List(graphene.NonNull(graphene.ID), required=True,
+                                 description="Posts to move to the top in this order, the rest keep their order after them")
+
+    @login_required
+    @transaction.atomic
+    def mutate(self,info,list_id,post_ids):
+        reading_list = get_reading_list(info, list_id, lock=True)
+        entries = list(reading_list.entries.order_by('position', 'id'))
+        by_post = {entry.post_id: entry for entry in entries}
+        ids = parse_ids(post_ids)
+        missing = [post_ids[index] for index, post_id in enumerate(ids) if post_id not in by_post]
+        if missing:
+            raise Exception(f"Posts {', '.join(missing)} are not in the reading list")
+        moved = list(dict.fromkeys(ids))
+        order = [by_post[post_id] for post_id in moved] + [entry for entry in entries if entry.post_id not in set(moved)]
+        changed = []
+        for position, entry in enumerate(order):
+            if entry.position != position:
+                entry.position = position
+                changed.append(entry)
+        ReadingListEntry.objects.bulk_update(changed, ['position'])
+        invalidate('ReadingList')
+        return ReorderReadingList(reading_list=reading_list)
+
+
+
 class AddToReadingList(graphene.Mutation):
     reading_list = graphene.Field(ReadingListType)
 
     class Arguments:
+        list_id = graphene.ID(required=True)
         post_id = graphene.ID(required=True)
 
-    def mutate(self,info,post_id):
+    @login_required
+    @transaction.atomic
+    def mutate(self,info,list_id,post_id):
+        reading_list = get_reading_list(info, list_id, lock=True)
         post = Post.objects.get(id=post_id)
-        user = info.context.user
-        reading_list = ReadingList.objects.get(user=user)
-        reading_list.posts.add(post)
+        ReadingListEntry.objects.get_or_create(
+            reading_list=reading_list, post=post, defaults={'position': reading_list.next_position()}
+        )
+        invalidate('ReadingList')
         return AddToReadingList(reading_list=reading_list)
 
 
 
+class RemoveFromReadingList(graphene.Mutation):
+    reading_list = graphene.Field(ReadingListType)
+
+    class Arguments:
+        list_id = graphene.ID(required=True)
+        post_id = graphene.ID(required=True)
+
+    @login_required
+    def mutate(self,info,list_id,post_id):
+        reading_list = get_reading_list(info, list_id)
+        reading_list.entries.filter(post_id=post_id).delete()
+        invalidate('ReadingList')
+        return RemoveFromReadingList(reading_list=reading_list)
+
+
+
+class AddPostsToReadingList(graphene.Mutation):
+    reading_list = graphene.Field(ReadingListType)
+    added = graphene.Int(description="Posts that were not in the list yet")
+    errors = graphene.List(graphene.NonNull(ItemError), required=True)
+
+    class Arguments:
+        list_id = graphene.ID(required=True)
+        post_ids = graphene.List(graphene.NonNull(graphene.ID), required=True)
+
+    @login_required
+    @transaction.atomic
+    def mutate(self,info,list_id,post_ids):
+        reading_list = get_reading_list(info, list_id, lock=True)
+        ids = parse_ids(post_ids)
+        existing = set(Post.objects.filter(pk__in=[i for i in ids if i is not None]).values_list('pk', flat=True))
+        listed = set(reading_list.entries.filter(post_id__in=existing).values_list('post_id', flat=True))
+        position = reading_list.next_position()
+        errors, rows = [], {}
+        for index, post_id in enumerate(ids):
+            if post_id not in existing:
+                errors.append(ItemError(index=index, message=f"Post {post_ids[index]} doesn't exist"))
+            elif post_id not in listed and post_id not in rows:
+                rows[post_id] = ReadingListEntry(reading_list=reading_list, post_id=post_id, position=position + len(rows))
+        ReadingListEntry.objects.bulk_create(rows.values(), ignore_conflicts=True)
+        invalidate('ReadingList')
+        return AddPostsToReadingList(reading_list=reading_list, added=len(rows), errors=errors)
+
+
+
 
 ######## Author ########
 
@@ -121,6 +441,7 @@ class CreateAuthor(graphene.Mutation):
     def mutate(self, info, name):
         author = Author.objects.create(name=name)
         author.save()
+        invalidate('Author')
         return CreateAuthor(author=author)
 
 
@@ -136,6 +457,8 @@ class DeleteAuthor(graphene.Mutation):
             author = Author.objects.get(id=id)
             name = author.name
             author.delete()
+            # its posts and their comments went with it
+            invalidate('Author', f'Author:{id}', 'Post', 'Comment')
             return DeleteAuthor(message=f"Author {name} deleted successfully")
         
         except Author.DoesNotExist:
@@ -155,6 +478,7 @@ class UpdateAuthor(graphene.Mutation):
             author = Author.objects.get(id=id)
             author.name = new_name
             author.save()
+            invalidate('Author', f'Author:{id}')
             return UpdateAuthor(author=author)
         
         except Author.DoesNotExist:
@@ -169,10 +493,13 @@ class SubscribeToAuthor(graphene.Mutation):
     class Arguments:
         author_id = graphene.ID(required=True)
 
+    @login_required
     def mutate(self,info,author_id):
         user = info.context.user
         author = Author.objects.get(id=author_id)
         author.subscribers.add(user)
+        backfill(user, author)
+        invalidate('Author', f'Author:{author.id}', 'User')
         subscribed_authors = user.author_set.all()
         return SubscribeToAuthor(user=user,subscribed_authors=subscribed_authors)
 
@@ -184,10 +511,13 @@ class UnSubscribe(graphene.Mutation):
     class Arguments:
         author_id = graphene.ID(required=True)
 
+    @login_required
     def mutate(root,info,author_id):
         user = info.context.user
         author = Author.objects.get(id=author_id)
         author.subscribers.remove(user)
+        prune(user, author)
+        invalidate('Author', f'Author:{author.id}', 'User')
         return UnSubscribe(msg=f"unsubscibed from the author {author.name}")
 
 ############# Posts #############
@@ -203,12 +533,63 @@ class CreatePost(graphene.Mutation):
 
     def mutate(self, info, title , content, likes,author_id):
         author = Author.objects.get(pk=author_id)
-        post = Post.objects.create(title=title,content=content,author=author,likes=likes)
-        post.save()
+        post = Post.objects.create(title=title,content=content,author=author,likes=likes,time_to_read=Post.reading_time(content))
+        fan_out([post])
+        publish_posts([post])
+        invalidate('Post', f'Author:{author.id}')
         return CreatePost(post=post)
 
 
 
+class PostInput(graphene.InputObjectType):
+    title = graphene.String(required=True)
+    content = graphene.String(required=True)
+    likes = graphene.Int(default_value=0)
+    time_to_read = graphene.Int(description="Estimated from the content when omitted")
+    author_id = graphene.ID(required=True)
+
+
+
+class CreatePosts(graphene.Mutation):
+    """ Creates many posts with one query for their authors and one INSERT """
+    posts = graphene.List(PostType, required=True, description="The created posts, null where the input item failed")
+    errors = graphene.List(graphene.NonNull(ItemError), required=True)
+
+    class Arguments:
+        input = graphene.List(graphene.NonNull(PostInput), required=True)
+
+    @transaction.atomic
+    def mutate(self,info,input):
+        author_ids = parse_ids(item.author_id for item in input)
+        authors = Author.objects.in_bulk([i for i in author_ids if i is not None])
+        errors, valid = [], []
+        for index, item in enumerate(input):
+            author = authors.get(author_ids[index])
+            if author is None:
+                errors.append(ItemError(index=index, message=f"Author {item.author_id} doesn't exist"))
+                continue
+            post = Post(
+                author=author, title=item.title, content=item.content, likes=item.likes,
+                time_to_read=item.time_to_read if item.time_to_read is not None else Post.reading_time(item.content),
+            )
+            try:
+                post.clean_fields(exclude=['author'])
+            except ValidationError as e:
+                errors.extend(item_errors(index, e))
+                continue
+            valid.append((index, post))
+
+        Post.objects.bulk_create([post for _, post in valid])
+        fan_out(post for _, post in valid)
+        publish_posts(post for _, post in valid)
+        posts = [None] * len(input)
+        for index, post in valid:
+            posts[index] = post
+        invalidate('Post', *{f'Author:{post.author_id}' for _, post in valid})
+        return CreatePosts(posts=posts, errors=errors)
+
+
+
 class DeletePost(graphene.Mutation):
     class Arguments:
         id = graphene.ID(required=True)
@@ -219,28 +600,98 @@ class DeletePost(graphene.Mutation):
         try:
             post = Post.objects.get(id=id)
             post.delete()
+            # its comments went with it
+            invalidate('Post', f'Post:{id}', f'Author:{post.author_id}', 'Comment')
             return DeletePost(message="Post deleted successfully")
         
-        except Comment.DoesNotExist:
+        except Post.DoesNotExist:
             raise Exception("Post doesn't exist")
 
 
 ############# Comments ############
 
 class CreateComment(graphene.Mutation):
+    """ Comments as the current user, like one CommentInput of createComments """
     class Arguments:
-        author_id = graphene.ID(required=True)
-        text = graphene.String()
+        post_id = graphene.ID(required=True)
+        text = graphene.String(required=True)
+        parent_id = graphene.ID(description="The comment this one replies to, on the same post")
 
     comment = graphene.Field(CommentType)
 
-    def mutate(self,info,text,author_id):
-        author = Author.objects.get(id=author_id)
-        comment = Comment.objects.create(text=text,author=author)
+    @login_required
+    def mutate(self,info,post_id,text,parent_id=None):
+        try:
+            post = Post.objects.get(id=post_id)
+        except (Post.DoesNotExist, ValueError):
+            raise Exception(f"Post {post_id} doesn't exist")
+        parent = None
+        if parent_id is not None:
+            parent = Comment.objects.filter(id=parent_id, post=post).first()
+            if parent is None:
+                raise Exception(f"Comment {parent_id} isn't on post {post_id}")
+        comment = Comment(author=info.context.user, post=post, parent=parent, text=text, likes=0)
+        comment.clean_fields(exclude=['author', 'post', 'parent'])
+        # post_save refreshes the post's comment count and publishes the comment
         comment.save()
+        invalidate('Comment', 'Post', f'Post:{post.id}')
         return CreateComment(comment=comment)
 
 
+class CommentInput(graphene.InputObjectType):
+    post_id = graphene.ID(required=True)
+    text = graphene.String(required=True)
+    parent_id = graphene.ID(description="The comment this one replies to, on the same post")
+
+
+
+class CreateComments(graphene.Mutation):
+    """ Comments as the current user on many posts, with one query for the
+        posts, one for the replied comments and one INSERT """
+    comments = graphene.List(CommentType, required=True, description="The created comments, null where the input item failed")
+    errors = graphene.List(graphene.NonNull(ItemError), required=True)
+
+    class Arguments:
+        input = graphene.List(graphene.NonNull(CommentInput), required=True)
+
+    @login_required
+    @transaction.atomic
+    def mutate(self,info,input):
+        post_ids = parse_ids(item.post_id for item in input)
+        existing = set(Post.objects.filter(pk__in=[i for i in post_ids if i is not None]).values_list('pk', flat=True))
+        parent_ids = parse_ids(item.parent_id for item in input)
+        # parent id -> its post
+        parents = dict(Comment.objects.filter(pk__in=[i for i in parent_ids if i is not None]).values_list('pk', 'post_id'))
+        errors, valid = [], []
+        for index, item in enumerate(input):
+            if post_ids[index] not in existing:
+                errors.append(ItemError(index=index, message=f"Post {item.post_id} doesn't exist"))
+                continue
+            if item.parent_id is not None and parents.get(parent_ids[index]) != post_ids[index]:
+                errors.append(ItemError(index=index, message=f"Comment {item.parent_id} isn't on post {item.post_id}"))
+                continue
+            comment = Comment(author=info.context.user, post_id=post_ids[index], parent_id=parent_ids[index], text=item.text, likes=0)
+            try:
+                comment.clean_fields(exclude=['author', 'post', 'parent'])
+            except ValidationError as e:
+                errors.extend(item_errors(index, e))
+                continue
+            valid.append((index, comment))
+
+        Comment.objects.bulk_create([comment for _, comment in valid])
+        # bulk inserts skip post_save
+        for _, comment in valid:
+            publish_comments(comment.post_id, [comment.id])
+        refresh_comment_counts({comment.post_id for _, comment in valid})
+        comments = [None] * len(input)
+        for index, comment in valid:
+            comments[index] = comment
+        # post(id:) responses are only tagged with their own post
+        invalidate('Comment', 'Post', *{f'Post:{comment.post_id}' for _, comment in valid})
+        return CreateComments(comments=comments, errors=errors)
+
+
+
 class DeleteComment(graphene.Mutation):
     class Arguments:
         id = graphene.ID(required=True)
@@ -251,12 +702,95 @@ class DeleteComment(graphene.Mutation):
         try:
             comment = Comment.objects.get(id=id)
             comment.delete()
+            # also changes the comment list and count of its post
+            invalidate('Comment', 'Post', *([f'Post:{comment.post_id}'] if comment.post_id is not None else []))
             return DeleteComment(message="Comment deleted successfully")
         
-        except Post.DoesNotExist:
+        except Comment.DoesNotExist:
             raise Exception("Comment doesn't exist")
 
 
+############# Likes #############
+
+# the counters are only ever changed with F() updates in the same transaction
+# as the like row, so concurrent likes can't overwrite each other
+
+class LikePost(graphene.Mutation):
+    post = graphene.Field(PostType)
+
+    class Arguments:
+        post_id = graphene.ID(required=True)
+
+    @login_required
+    def mutate(self,info,post_id):
+        with transaction.atomic():
+            post = Post.objects.select_for_update().get(id=post_id)
+            _, created = PostLike.objects.get_or_create(user=info.context.user, post=post)
+            if created:
+                Post.objects.filter(id=post.id).update(likes=F('likes') + 1)
+        post.refresh_from_db()
+        invalidate('Post', f'Post:{post.id}')
+        return LikePost(post=post)
+
+
+
+class UnlikePost(graphene.Mutation):
+    post = graphene.Field(PostType)
+
+    class Arguments:
+        post_id = graphene.ID(required=True)
+
+    @login_required
+    def mutate(self,info,post_id):
+        with transaction.atomic():
+            post = Post.objects.select_for_update().get(id=post_id)
+            deleted, _ = PostLike.objects.filter(user=info.context.user, post=post).delete()
+            if deleted:
+                Post.objects.filter(id=post.id).update(likes=F('likes') - 1)
+        post.refresh_from_db()
+        invalidate('Post', f'Post:{post.id}')
+        return UnlikePost(post=post)
+
+
+
+class LikeComment(graphene.Mutation):
+    comment = graphene.Field(CommentType)
+
+    class Arguments:
+        comment_id = graphene.ID(required=True)
+
+    @login_required
+    def mutate(self,info,comment_id):
+        with transaction.atomic():
+            comment = Comment.objects.select_for_update().get(id=comment_id)
+            _, created = CommentLike.objects.get_or_create(user=info.context.user, comment=comment)
+            if created:
+                Comment.objects.filter(id=comment.id).update(likes=F('likes') + 1)
+        comment.refresh_from_db()
+        invalidate('Comment')
+        return LikeComment(comment=comment)
+
+
+
+class UnlikeComment(graphene.Mutation):
+    comment = graphene.Field(CommentType)
+
+    class Arguments:
+        comment_id = graphene.ID(required=True)
+
+    @login_required
+    def mutate(self,info,comment_id):
+        with transaction.atomic():
+            comment = Comment.objects.select_for_update().get(id=comment_id)
+            deleted, _ = CommentLike.objects.filter(user=info.context.user, comment=comment).delete()
+            if deleted:
+                Comment.objects.filter(id=comment.id).update(likes=F('likes') - 1)
+        comment.refresh_from_db()
+        invalidate('Comment')
+        return UnlikeComment(comment=comment)
+
+
+
 
 
 
@@ -282,36 +816,69 @@ class Mutation(graphene.ObjectType):
     delete_author = DeleteAuthor.Field()
 
     create_post = CreatePost.Field()
+    create_posts = CreatePosts.Field()
     delete_post = DeletePost.Field()
     
     create_comment = CreateComment.Field()
+    create_comments = CreateComments.Field()
     delete_comment = DeleteComment.Field()
 
+    like_post = LikePost.Field()
+    unlike_post = UnlikePost.Field()
+    like_comment = LikeComment.Field()
+    unlike_comment = UnlikeComment.Field()
+
+    create_reading_list = CreateReadingList.Field()
+    rename_reading_list = RenameReadingList.Field()
+    delete_reading_list = DeleteReadingList.Field()
+    reorder_reading_list = ReorderReadingList.Field()
     add_to_reading_list = AddToReadingList.Field()
+    add_posts_to_reading_list = AddPostsToReadingList.Field()
+    remove_from_reading_list = RemoveFromReadingList.Field()
+
+
 
 
 
+class TrendingWindow(graphene.Enum):
+    DAY = 'day'
+    WEEK = 'week'
+    MONTH = 'month'
+
 
 
 class Query(graphene.ObjectType):
     """Basic queries for reading data and controlling its appearence"""
 
-    all_posts = DjangoFilterConnectionField(PostType)
+    all_posts = KeysetFilterConnectionField(PostType)
     post = graphene.Field(PostType,id=graphene.Int())
-
-    all_authors = graphene.List(AuthorType)
+    search_posts = KeysetConnectionField(PostType, keys=('rank', 'id'), query=graphene.String(required=True))
+    my_feed = FeedConnectionField(PostType, description="Posts of the authors you subscribe to, newest first")
+    trending_posts = graphene.List(
+        PostType, window=TrendingWindow(default_value=TrendingWindow.DAY), first=graphene.Int(default_value=10),
+        description="Posts most liked, commented and added to reading lists lately, as of the last refresh_trending",
+    )
+
+    authors = KeysetFilterConnectionField(AuthorType, keys=('joined', 'id'))
+    all_authors = graphene.List(AuthorType, deprecation_reason="Use the paginated `authors` connection")
     author = graphene.Field(AuthorType,id=graphene.Int())
+    popular_authors = graphene.List(
+        AuthorType, first=graphene.Int(default_value=10), description="Authors whose posts are trending the most",
+    )
 
-    all_comments = graphene.List(CommentType)
+    comments = KeysetConnectionField(CommentType, connection=CommentTypeConnection)
+    all_comments = graphene.List(CommentType, deprecation_reason="Use the paginated `comments` connection")
     comment = graphene.List(CommentType)
 
-    all_my_reading_lists = graphene.List(ReadingListType)
+    my_reading_lists = KeysetConnectionField(ReadingListType, keys=('created', 'id'), connection=ReadingListTypeConnection)
+    all_my_reading_lists = graphene.List(ReadingListType, deprecation_reason="Use the paginated `myReadingLists` connection")
     my_reading_list = graphene.Field(ReadingListType,list_id=graphene.ID(required=True))
 
     whoami = graphene.Field(UserType)
-    users = graphene.List(UserType)
+    all_users = KeysetConnectionField(UserType, keys=('date_joined', 'id'), connection=UserTypeConnection)
+    users = graphene.List(UserType, deprecation_reason="Use the paginated `allUsers` connection")
 
-    authors_by_name = DjangoFilterConnectionField(AuthorType) ### filter authors by name
+    authors_by_name = FilterConnectionField(AuthorType) ### filter authors by name
 
 
     @login_required
@@ -321,35 +888,127 @@ class Query(graphene.ObjectType):
 
 
     @login_required
+    @optimized
     def resolve_users(self, info):
         return get_user_model().objects.all()
 
 
+    @login_required
+    @optimized
+    def resolve_all_users(self, info, **kwargs):
+        return get_user_model().objects.all()
+
+
+    @optimized
+    def resolve_all_posts(root, info, **kwargs):
+        return Post.objects.all()
+
+
+    @login_required
+    @optimized
+    def resolve_my_feed(root, info, **kwargs):
+        return Post.objects.all()
+
+
+    @optimized
+    def resolve_search_posts(root, info, query, **kwargs):
+        return Post.search(query)
+
+
+    @optimized
+    def resolve_authors_by_name(root, info, **kwargs):
+        return Author.objects.all()
+
+
+    @optimized
+    def resolve_authors(root, info, **kwargs):
+        return Author.objects.all()
+
+
+    @optimized
     def resolve_all_authors(root, info):
         return Author.objects.all()
 
 
+    def resolve_author(root, info, id):
+        return fetch(info, optimize(Author.objects.all(), info), pk=id)
+
+
+    @optimized
+    def resolve_comments(root, info, **kwargs):
+        return Comment.objects.all()
+
+
+    @optimized
     def resolve_all_comments(root, info):
         return Comment.objects.all()
 
 
     def resolve_post(root, info, id):
-        try:
-            return Post.objects.get(pk=id)
-        except Post.DoesNotExist:
-            return None
+        return fetch(info, optimize(Post.objects.all(), info), pk=id)
+
+
+    def resolve_trending_posts(root, info, window, first):
+        if first < 0:
+            raise Exception("first can't be negative")
+        return optimize(trending_posts(window.value), info)[:first]
+
+
+    def resolve_popular_authors(root, info, first):
+        if first < 0:
+            raise Exception("first can't be negative")
+        return optimize(popular_authors(), info)[:first]
         
 
+    @login_required
+    @optimized
+    def resolve_my_reading_lists(root, info, **kwargs):
+        return ReadingList.objects.filter(user=info.context.user)
+
+
+    @login_required
+    @optimized
     def resolve_all_my_reading_lists(root,info):
         user = info.context.user
         reading_lists = ReadingList.objects.filter(user=user)
         return reading_lists
 
 
+    @login_required
     def resolve_my_reading_list(root,info,list_id):
-        reading_list = ReadingList.objects.get(id=list_id)
-        return reading_list
+        return fetch(info, optimize(ReadingList.objects.filter(user=info.context.user), info), id=list_id)
+
+
+class Subscription(graphene.ObjectType):
+    """ Pushed over the WebSocket at /api/graphql instead of polling """
+
+    post_added = graphene.Field(
+        PostType, author_ids=graphene.List(graphene.NonNull(graphene.ID)),
+        description="New posts of these authors; of the followed authors when omitted, or of everyone when anonymous",
+    )
+    comment_added = graphene.Field(CommentType, post_id=graphene.ID(required=True), description="New comments on a post")
+
+    async def subscribe_post_added(root, info, author_ids=None):
+        user = info.context.user
+        if author_ids is None and user.is_authenticated:
+            author_ids = await sync_to_async(list)(user.author_set.values_list('id', flat=True))
+        if author_ids is None:
+            channels = ['post_added']
+        else:
+            channels = [f'post_added:{author_id}' for author_id in parse_ids(author_ids) if author_id is not None]
+        return get_pubsub().subscribe(channels)
+
+    def subscribe_comment_added(root, info, post_id):
+        return get_pubsub().subscribe([f'comment_added:{post_id}'])
+
+    # the root is the event, loaded once for all of its subscribers
+    def resolve_post_added(root, info, **kwargs):
+        return root.load(Post.objects.select_related('author'))
+
+    def resolve_comment_added(root, info, **kwargs):
+        return root.load(Comment.objects.select_related('author'))
+
 
 
 #### the final step by 
-schema = graphene.Schema(query=Query, mutation=Mutation)
+schema = graphene.Schema(query=Query, mutation=Mutation, subscription=Subscription)
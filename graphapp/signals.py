@@ -0,0 +1,125 @@
+from django.contrib.auth.models import User
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from graphql_jwt.refresh_token.signals import refresh_token_revoked
+from .auth import get_token_cache
+from .images import process_image
+from .pubsub import publish_comments
+from .models import *
+
+
+
+
+def count_rows(model, column):
+    """ Correlated COUNT(*) of the rows of model pointing at the outer row """
+    rows = model.objects.filter(**{column: OuterRef('pk')}).order_by().values(column)
+    return Coalesce(Subquery(rows.annotate(n=Count('*')).values('n')), 0)
+
+
+def refresh_comment_counts(post_ids):
+    if post_ids:
+        Post.objects.filter(pk__in=post_ids).update(comment_count=count_rows(Comment, 'post_id'))
+
+
+def refresh_subscriber_counts(author_ids):
+    if author_ids:
+        Author.objects.filter(pk__in=author_ids).update(subscriber_count=count_rows(Author.subscribers.through, 'author_id'))
+
+
+
+@receiver(m2m_changed, sender=Author.subscribers.through)
+def author_subscribers_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear', 'pre_clear'):
+        return
+    if not reverse:
+        refresh_subscriber_counts([instance.pk])
+    elif action == 'pre_clear':
+        instance._cleared_author_ids = list(instance.author_set.values_list('pk', flat=True))
+    elif action == 'post_clear':
+        refresh_subscriber_counts(getattr(instance, '_cleared_author_ids', []))
+    else:
+        refresh_subscriber_counts(pk_set)
+
+
+
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance, created, **kwargs):
+    if created and instance.post_id is not None:
+        refresh_comment_counts([instance.post_id])
+        # commentAdded subscribers
+        publish_comments(instance.post_id, [instance.pk])
+
+
+# replies are deleted with their comment, and comments with their post, one signal each
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    if instance.post_id is not None:
+        refresh_comment_counts([instance.post_id])
+        mark_scores_stale(instance.post_id)
+
+
+
+# deleted activity leaves no date behind for refresh_trending to find
+
+def mark_scores_stale(post_id):
+    TrendingScore.objects.filter(post_id=post_id, stale=False).update(stale=True)
+
+
+@receiver(post_delete, sender=PostLike)
+@receiver(post_delete, sender=ReadingListEntry)
+def activity_deleted(sender, instance, **kwargs):
+    mark_scores_stale(instance.post_id)
+
+
+# a deleted post takes its scores with it, its author's sum is redone without them
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    AuthorScore.objects.filter(author_id=instance.author_id, stale=False).update(stale=True)
+
+
+
+# deleting a user cascades through the join table without m2m_changed
+
+@receiver(pre_delete, sender=User)
+def remember_user_authors(sender, instance, **kwargs):
+    instance._author_ids = list(instance.author_set.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    refresh_subscriber_counts(getattr(instance, '_author_ids', []))
+    get_token_cache().invalidate_user(instance.pk)
+
+
+
+# cached tokens carry a copy of their user, see auth.py
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, update_fields=None, **kwargs):
+    # logins only touch last_login
+    if update_fields is None or {'password', 'is_active', 'username'} & set(update_fields):
+        get_token_cache().invalidate_user(instance.pk)
+
+
+@receiver(refresh_token_revoked)
+def token_revoked(sender, refresh_token, **kwargs):
+    get_token_cache().invalidate_user(refresh_token.user_id)
+
+
+
+@receiver(pre_save, sender=Author)
+def remember_image_upload(sender, instance, **kwargs):
+    # the file is written by the field once this returns
+    instance._image_uploaded = bool(instance.image) and not instance.image._committed
+    if instance._image_uploaded:
+        instance.image_variants = {}
+
+
+@receiver(post_save, sender=Author)
+def author_saved(sender, instance, **kwargs):
+    if getattr(instance, '_image_uploaded', False):
+        name = instance.image.name
+        transaction.on_commit(lambda: process_image(name))
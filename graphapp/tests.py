@@ -1,3 +1,1253 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import random
+import tempfile
+from datetime import timedelta
+from asgiref.sync import sync_to_async
+from unittest import mock, skipUnless
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import OperationalError, connection, connections, router, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from graphql_jwt.shortcuts import get_token
+from graphql_jwt.utils import get_payload
+from graphql_relay import to_global_id
+from PIL import Image
+from .auth import get_token_cache
+from .benchmark import OPERATIONS, fixtures, seed_data
+from .documents import DocumentCache, query_hash
+from .export import stream
+from .pagination import encode_cursor
+from .pubsub import get_pubsub
+from .querycount import check
+from .responses import get_response_cache
+from .routing import PIN_COOKIE, _down, reading_from
+from .trending import decayed, log_score, refresh_scores
+from .schema import schema
+from .websocket import GraphQLWebSocketApp, WebSocketConnection
+from .images import FAILED, variant_name
+from .views import CachedGraphQLView
+from .models import *
 
-# Create your tests here.
+
+
+
+class GraphQLTestCase(TestCase):
+    """ Seeds a few authors with posts, comments and subscribers """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [User.objects.create(username=f'user{i}') for i in range(3)]
+        for a in range(3):
+            author = Author.objects.create(name=f'author{a}', image='images/author.jpg')
+            author.subscribers.set(cls.users)
+            for p in range(3):
+                post = Post.objects.create(author=author, title=f'post{p}', content=f'content {p}', likes=p, time_to_read=1)
+                for user in cls.users:
+                    Comment.objects.create(author=user, post=post, text='nice', likes=0)
+
+    def setUp(self):
+        # cached responses would outlive the rolled back test data
+        cache.clear()
+
+    def query(self, query, variables=None):
+        response = self.client.post('/api/graphql', json.dumps({'query': query, 'variables': variables or {}}),
+                                    content_type='application/json')
+        content = response.json()
+        self.assertNotIn('errors', content)
+        return content['data']
+
+
+
+class QueryOptimizerTests(GraphQLTestCase):
+
+    def test_nested_relations_use_constant_queries(self):
+        query = '''{ allPosts(first: 10) { edges { node { title
+                      author { name subscribers { username } postSet(first: 5) { edges { node { title } } } }
+                      comments(first: 2) { edges { node { text author { username } } } } } } } }'''
+        # posts joined with authors + subscribers + post_set + the comment pages of all posts joined with users
+        with self.assertNumQueries(4):
+            data = self.query(query)
+        self.assertEqual(len(data['allPosts']['edges']), 9)
+
+    def test_unrequested_columns_are_not_selected(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.query('{ allComments { text author { username } } }')
+        self.assertEqual(len(ctx.captured_queries), 1)
+        sql = ctx.captured_queries[0]['sql']
+        self.assertIn('"auth_user"."username"', sql)
+        self.assertNotIn('"auth_user"."password"', sql)
+        self.assertNotIn('"graphapp_comment"."likes"', sql)
+
+    def test_post_content_is_deferred(self):
+        post = Post.objects.first()
+        with CaptureQueriesContext(connection) as ctx:
+            data = self.query('query ($id: Int) { post(id: $id) { ...Title } } fragment Title on PostType { title }',
+                              {'id': post.pk})
+        self.assertEqual(data['post']['title'], post.title)
+        self.assertNotIn('"graphapp_post"."content"', ctx.captured_queries[0]['sql'])
+
+
+
+class KeysetPaginationTests(GraphQLTestCase):
+    page_query = '''query ($after: String) {
+                 allPosts(first: 4, after: $after, content_Startswith: "content") {
+                   edges { node { id } } pageInfo { hasNextPage endCursor } } }'''
+
+    def test_pages_cover_every_post_once_without_count(self):
+        ids, after = [], None
+        with CaptureQueriesContext(connection) as ctx:
+            while True:
+                page = self.query(self.page_query, {'after': after})['allPosts']
+                ids += [edge['node']['id'] for edge in page['edges']]
+                if not page['pageInfo']['hasNextPage']:
+                    break
+                after = page['pageInfo']['endCursor']
+        self.assertEqual(len(ids), Post.objects.count())
+        self.assertEqual(len(set(ids)), len(ids))
+        self.assertEqual(len(ctx.captured_queries), 3)
+        self.assertFalse(any('COUNT(' in q['sql'] for q in ctx.captured_queries))
+
+    def test_total_count_is_opt_in(self):
+        data = self.query('{ allPosts(first: 1) { totalCount } }')
+        self.assertEqual(data['allPosts']['totalCount'], Post.objects.count())
+
+    def test_first_zero_is_an_empty_page(self):
+        for args in ('first: 0', 'last: 0'):
+            with self.subTest(args):
+                page = self.query(f'{{ allPosts({args}) {{ edges {{ node {{ id }} }} pageInfo {{ startCursor endCursor }} }} }}')['allPosts']
+                self.assertEqual(page, {'edges': [], 'pageInfo': {'startCursor': None, 'endCursor': None}})
+        comments = self.query('{ allPosts(first: 2) { edges { node { comments(first: 0) { edges { node { id } } } } } } }')
+        self.assertEqual([edge['node']['comments']['edges'] for edge in comments['allPosts']['edges']], [[], []])
+
+    def test_negative_first_or_last_is_an_error(self):
+        for args in ('first: -1', 'last: -3'):
+            with self.subTest(args):
+                response = self.client.post('/api/graphql', json.dumps({'query': f'{{ allPosts({args}) {{ edges {{ node {{ id }} }} }} }}'}),
+                                            content_type='application/json').json()
+                name, value = args.split(': ')
+                self.assertEqual(response['errors'][0]['message'], f"`{name}` on the `allPosts` connection can't be negative, got {value}")
+
+
+
+class BoundedListTests(GraphQLTestCase):
+
+    def test_comments_connection_pages(self):
+        data = self.query('{ comments(first: 5) { edges { node { text } } pageInfo { hasNextPage } } }')
+        self.assertEqual(len(data['comments']['edges']), 5)
+        self.assertTrue(data['comments']['pageInfo']['hasNextPage'])
+
+    @override_settings(GRAPHAPP={'LIST_MAX_ITEMS': 4})
+    def test_deprecated_list_is_truncated(self):
+        data = self.query('{ allComments { text } }')
+        self.assertEqual(len(data['allComments']), 4)
+
+    @override_settings(GRAPHAPP={'LIST_MAX_ITEMS': 4, 'LIST_OVERFLOW': 'reject'})
+    def test_deprecated_list_is_rejected(self):
+        response = self.client.post('/api/graphql', json.dumps({'query': '{ allComments { text } }'}),
+                                    content_type='application/json')
+        self.assertIn('more than 4 items', response.json()['errors'][0]['message'])
+
+
+
+class PersistedQueryTests(GraphQLTestCase):
+    comments = '{ allComments { text } }'
+
+    def post(self, body):
+        return self.client.post('/api/graphql', json.dumps(body), content_type='application/json').json()
+
+    def test_hash_only_request_after_registration(self):
+        extensions = {'persistedQuery': {'version': 1, 'sha256Hash': query_hash(self.comments)}}
+        missing = self.post({'extensions': extensions})
+        self.assertEqual(missing['errors'][0]['extensions']['code'], 'PERSISTED_QUERY_NOT_FOUND')
+        self.post({'query': self.comments, 'extensions': extensions})
+        self.assertEqual(len(self.post({'extensions': extensions})['data']['allComments']), 27)
+
+    def test_mismatched_hash_is_rejected(self):
+        extensions = {'persistedQuery': {'version': 1, 'sha256Hash': '0' * 64}}
+        response = self.post({'query': self.comments, 'extensions': extensions})
+        self.assertEqual(response['errors'][0]['extensions']['code'], 'INVALID_PERSISTED_QUERY_HASH')
+
+    def test_document_cache_evicts_least_recently_used(self):
+        cache = DocumentCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(list(cache.entries), ['a', 'c'])
+
+
+
+class QueryCostTests(GraphQLTestCase):
+    nested = '''query ($first: Int) { allPosts(first: $first) { edges { node {
+                  author { postSet(first: 100) { edges { node { title } } } } } } } }'''
+
+    def post(self, query, variables=None):
+        return self.client.post('/api/graphql', json.dumps({'query': query, 'variables': variables or {}}),
+                                content_type='application/json').json()
+
+    def test_cost_is_reported_in_extensions(self):
+        response = self.post('{ allComments { text } }')
+        self.assertIn('data', response)
+        self.assertEqual(response['extensions']['cost']['depth'], 2)
+
+    def test_list_multipliers_come_from_variables(self):
+        cheap = self.post(self.nested, {'first': 1})
+        self.assertNotIn('errors', cheap)
+        expensive = self.post(self.nested, {'first': 100})
+        self.assertEqual(expensive['errors'][0]['extensions']['code'], 'QUERY_TOO_COMPLEX')
+        self.assertGreater(expensive['extensions']['cost']['requestedQueryCost'],
+                           cheap['extensions']['cost']['requestedQueryCost'])
+
+    @override_settings(GRAPHAPP={'QUERY_MAX_DEPTH': 3})
+    def test_deep_operations_are_rejected(self):
+        response = self.post('{ allComments { author { readinglistSet { name } } } }')
+        self.assertEqual(response['errors'][0]['extensions']['code'], 'QUERY_TOO_DEEP')
+        self.assertNotIn('data', response)
+
+
+
+@skipUnless(connection.vendor == 'postgresql', 'full-text search needs PostgreSQL')
+class SearchPostsTests(GraphQLTestCase):
+    search = '''query ($after: String) { searchPosts(query: "graphql", first: 1, after: $after) {
+                  edges { node { title snippet } } pageInfo { hasNextPage endCursor } } }'''
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        author = Author.objects.first()
+        Post.objects.create(author=author, title='GraphQL tips', content='caching', likes=0, time_to_read=1)
+        Post.objects.create(author=author, title='Django', content='serving graphql from django', likes=0, time_to_read=1)
+
+    def test_title_matches_rank_first_and_content_is_highlighted(self):
+        first = self.query(self.search)['searchPosts']
+        self.assertEqual(first['edges'][0]['node']['title'], 'GraphQL tips')
+        self.assertTrue(first['pageInfo']['hasNextPage'])
+        second = self.query(self.search, {'after': first['pageInfo']['endCursor']})['searchPosts']
+        self.assertEqual(second['edges'][0]['node']['snippet'], 'serving <b>graphql</b> from django')
+        self.assertFalse(second['pageInfo']['hasNextPage'])
+
+
+
+class LikeAndCountTests(GraphQLTestCase):
+
+    def test_likes_are_idempotent(self):
+        post = Post.objects.get(author__name='author0', title='post0')
+        self.client.force_login(self.users[0])
+        like = 'mutation ($id: ID!) { likePost(postId: $id) { post { likes } } }'
+        self.query(like, {'id': post.id})
+        self.assertEqual(self.query(like, {'id': post.id})['likePost']['post']['likes'], 1)
+        unlike = 'mutation ($id: ID!) { unlikePost(postId: $id) { post { likes } } }'
+        self.query(unlike, {'id': post.id})
+        self.assertEqual(self.query(unlike, {'id': post.id})['unlikePost']['post']['likes'], 0)
+
+    def test_counts_follow_the_join_tables(self):
+        post = Post.objects.first()
+        author = post.author
+        self.assertEqual((post.comment_count, author.subscriber_count), (3, 3))
+        post.comments.first().delete()
+        author.subscribers.remove(self.users[0])
+        self.users[1].delete()
+        post.refresh_from_db()
+        author.refresh_from_db()
+        # user1 also took their comment on the post with them
+        self.assertEqual((post.comment_count, author.subscriber_count), (1, 1))
+
+
+
+class ResponseCacheTests(GraphQLTestCase):
+    author = 'query ($id: Int) { author(id: $id) { name } }'
+
+    def post(self, query, variables=None, **extra):
+        return self.client.post('/api/graphql', json.dumps({'query': query, 'variables': variables or {}}),
+                                content_type='application/json', **extra).json()
+
+    def test_anonymous_queries_are_served_from_the_cache(self):
+        self.assertEqual(self.post('{ allAuthors { name } }')['extensions']['responseCache'], 'MISS')
+        with self.assertNumQueries(0):
+            response = self.post('{   allAuthors { name } }')
+        self.assertEqual(response['extensions']['responseCache'], 'HIT')
+        self.assertEqual(len(response['data']['allAuthors']), 3)
+
+    def test_mutations_invalidate_their_tags(self):
+        author, other = Author.objects.all()[:2]
+        self.post(self.author, {'id': author.id})
+        self.post(self.author, {'id': other.id})
+        update = 'mutation ($id: ID!) { updateAuthor(id: $id, newName: "renamed") { author { name } } }'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post(update, {'id': author.id})
+        response = self.post(self.author, {'id': author.id})
+        self.assertEqual(response['extensions']['responseCache'], 'MISS')
+        self.assertEqual(response['data']['author']['name'], 'renamed')
+        self.assertEqual(self.post(self.author, {'id': other.id})['extensions']['responseCache'], 'HIT')
+
+    def test_comments_invalidate_their_post(self):
+        post = Post.objects.first()
+        count = '{ post(id: %d) { commentCount } }' % post.id
+        self.assertEqual(self.post(count)['data']['post']['commentCount'], 3)
+
+        self.client.force_login(self.users[0])
+        create = 'mutation ($input: [CommentInput!]!) { createComments(input: $input) { comments { id } } }'
+        with self.captureOnCommitCallbacks(execute=True):
+            comment_id = self.post(create, {'input': [{'postId': post.id, 'text': 'one more'}]})['data']['createComments']['comments'][0]['id']
+        self.client.logout()
+        response = self.post(count)
+        self.assertEqual(response['extensions']['responseCache'], 'MISS')
+        self.assertEqual(response['data']['post']['commentCount'], 4)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post('mutation ($id: ID!) { deleteComment(id: $id) { message } }', {'id': comment_id})
+        self.assertEqual(self.post(count)['data']['post']['commentCount'], 3)
+
+    def test_deleted_posts_and_authors_invalidate_their_comments(self):
+        comments = '{ comments(first: 50) { edges { node { id } } } }'
+        self.assertEqual(len(self.post(comments)['data']['comments']['edges']), 27)
+        post = Post.objects.first()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post('mutation ($id: ID!) { deletePost(id: $id) { message } }', {'id': post.id})
+        response = self.post(comments)
+        self.assertEqual(response['extensions']['responseCache'], 'MISS')
+        self.assertEqual(len(response['data']['comments']['edges']), 24)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post('mutation ($id: ID!) { deleteAuthor(id: $id) { message } }', {'id': post.author_id})
+        self.assertEqual(len(self.post(comments)['data']['comments']['edges']), 18)
+
+        # a missing id is reported as such, not as a DoesNotExist of another model
+        for mutation, message in [('deletePost', "Post doesn't exist"), ('deleteComment', "Comment doesn't exist")]:
+            response = self.post(f'mutation {{ {mutation}(id: 0) {{ message }} }}')
+            self.assertEqual(response['errors'][0]['message'], message)
+
+    def test_invalidation_during_execution_outdates_the_response(self):
+        author = Author.objects.first()
+        execute_document = CachedGraphQLView.execute_document
+
+        def racing(view, *args):
+            result = execute_document(view, *args)
+            # a mutation commits while the query runs
+            get_response_cache().invalidate(f'Author:{author.id}')
+            return result
+
+        with mock.patch.object(CachedGraphQLView, 'execute_document', racing):
+            self.post(self.author, {'id': author.id})
+        self.assertEqual(self.post(self.author, {'id': author.id})['extensions']['responseCache'], 'MISS')
+
+    def test_authenticated_requests_bypass_the_cache(self):
+        self.post('{ allAuthors { name } }')
+        response = self.post('{ allAuthors { name } }', HTTP_AUTHORIZATION='Bearer token')
+        self.assertNotIn('responseCache', response.get('extensions', {}))
+
+
+
+class AsyncViewTests(GraphQLTestCase):
+    nested = '''{ allPosts(first: 10) { totalCount edges { node { title commentCount
+                    author { name subscribers { username } postSet(first: 2) { edges { node { title } } } }
+                    comments(first: 2) { edges { node { text author { username } } } } } } }
+                  allAuthors { name postSet(first: 1, content_Startswith: "content") { edges { node { title } } } }
+                  author(id: 0) { name } }'''
+
+    async def test_async_view_matches_the_sync_view(self):
+        body = json.dumps({'query': self.nested})
+        response = await self.async_client.post('/api/graphql/async', body, content_type='application/json')
+        content = response.json()
+        self.assertNotIn('errors', content)
+        await cache.aclear()
+        expected = await sync_to_async(self.query)(self.nested)
+        self.assertEqual(content['data'], expected)
+
+
+
+class BulkMutationTests(GraphQLTestCase):
+
+    def test_create_posts_reports_bad_items_and_keeps_the_rest(self):
+        author = Author.objects.first()
+        mutation = '''mutation ($input: [PostInput!]!) { createPosts(input: $input) {
+                        posts { title timeToRead } errors { index message } } }'''
+        items = [
+            {'authorId': author.id, 'title': 'one', 'content': 'word ' * 450},
+            {'authorId': 0, 'title': 'two', 'content': 'x'},
+            {'authorId': author.id, 'title': 'x' * 41, 'content': 'x'},
+            {'authorId': author.id, 'title': 'four', 'content': 'x', 'timeToRead': 7},
+        ]
+        # the authors, one INSERT, the subscribers and their timeline rows, and the savepoint around them
+        with self.assertNumQueries(6):
+            result = self.query(mutation, {'input': items})['createPosts']
+        self.assertEqual(result['posts'], [{'title': 'one', 'timeToRead': 2}, None, None, {'title': 'four', 'timeToRead': 7}])
+        self.assertEqual([error['index'] for error in result['errors']], [1, 2])
+
+    def test_create_comments_and_list_membership(self):
+        self.client.force_login(self.users[0])
+        posts = list(Post.objects.order_by('id')[:2])
+        mutation = '''mutation ($input: [CommentInput!]!) { createComments(input: $input) { errors { index } } }'''
+        items = [{'postId': posts[0].id, 'text': 'a'}, {'postId': posts[0].id, 'text': 'b'}, {'postId': 'nope', 'text': 'c'}]
+        self.assertEqual(self.query(mutation, {'input': items})['createComments']['errors'], [{'index': 2}])
+        posts[0].refresh_from_db()
+        self.assertEqual(posts[0].comment_count, 5)
+
+        reading_list = ReadingList.objects.create(user=self.users[0])
+        reading_list.posts.add(posts[0])
+        mutation = '''mutation ($list: ID!, $posts: [ID!]!) { addPostsToReadingList(listId: $list, postIds: $posts) {
+                        added errors { index } } }'''
+        result = self.query(mutation, {'list': reading_list.id, 'posts': [posts[0].id, posts[1].id, posts[1].id, 0]})
+        self.assertEqual(result['addPostsToReadingList'], {'added': 1, 'errors': [{'index': 3}]})
+        self.assertEqual(reading_list.posts.count(), 2)
+
+
+
+class ReadingListTests(GraphQLTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.users[0])
+
+    def test_duplicate_names_get_the_next_suffix(self):
+        user = self.users[0]
+        names = [ReadingList.objects.create(user=user, name='Later').name for _ in range(3)]
+        self.assertEqual(names, ['Later', 'Later 1', 'Later 2'])
+        ReadingList.objects.filter(name='Later 1').delete()
+        # one SELECT for the taken names, then the INSERT in its savepoint
+        with self.assertNumQueries(4):
+            self.assertEqual(ReadingList.objects.create(user=user, name='Later').name, 'Later 3')
+
+    def test_free_names_fit_the_column(self):
+        user = self.users[0]
+        # a suffixed name alone leaves the base name free
+        ReadingList.objects.create(user=user, name='Later 1')
+        self.assertEqual(ReadingList.objects.create(user=user, name='Later').name, 'Later')
+        self.assertEqual(ReadingList.objects.create(user=user, name='Later').name, 'Later 2')
+
+        long = 'x' * 100
+        names = [ReadingList.objects.create(user=user, name=long).name for _ in range(3)]
+        self.assertEqual(names, [long, 'x' * 98 + ' 1', 'x' * 98 + ' 2'])
+
+    @skipUnless(connection.vendor == 'postgresql', "SQLite has no row locks")
+    def test_adding_locks_the_list_row(self):
+        reading_list = ReadingList.objects.create(user=self.users[0])
+        post = Post.objects.first()
+        with CaptureQueriesContext(connection) as ctx:
+            self.query('mutation ($list: ID!, $post: ID!) { addToReadingList(listId: $list, postId: $post) { readingList { id } } }',
+                       {'list': reading_list.id, 'post': post.id})
+        locked = [q['sql'] for q in ctx.captured_queries if 'FOR UPDATE' in q['sql']]
+        self.assertEqual(len(locked), 1)
+        self.assertIn('"graphapp_readinglist"', locked[0])
+
+    def test_entries_follow_the_user_order(self):
+        reading_list = ReadingList.objects.create(user=self.users[0])
+        posts = list(Post.objects.order_by('id')[:4])
+        add = 'mutation ($list: ID!, $post: ID!) { addToReadingList(listId: $list, postId: $post) { readingList { id } } }'
+        for post in posts:
+            self.query(add, {'list': reading_list.id, 'post': post.id})
+        reorder = 'mutation ($list: ID!, $posts: [ID!]!) { reorderReadingList(listId: $list, postIds: $posts) { readingList { id } } }'
+        self.query(reorder, {'list': reading_list.id, 'posts': [posts[2].id, posts[0].id]})
+
+        page = '''query ($list: ID!, $after: String) { myReadingList(listId: $list) {
+                    entries(first: 3, after: $after) { edges { node { post { id } } } pageInfo { hasNextPage endCursor } } } }'''
+        first = self.query(page, {'list': reading_list.id})['myReadingList']['entries']
+        second = self.query(page, {'list': reading_list.id, 'after': first['pageInfo']['endCursor']})['myReadingList']['entries']
+        ids = [edge['node']['post']['id'] for edge in first['edges'] + second['edges']]
+        self.assertEqual(ids, [to_global_id('PostType', posts[i].id) for i in (2, 0, 1, 3)])
+        self.assertTrue(first['pageInfo']['hasNextPage'])
+        self.assertFalse(second['pageInfo']['hasNextPage'])
+
+    def test_reading_lists_need_a_login(self):
+        self.client.logout()
+        for query in ('{ myReadingLists(first: 5) { edges { node { name } } } }', '{ allMyReadingLists { name } }'):
+            with self.subTest(query):
+                response = self.client.post('/api/graphql', json.dumps({'query': query}), content_type='application/json').json()
+                self.assertEqual(response['errors'][0]['message'], 'You do not have permission to perform this action')
+
+
+
+@override_settings(GRAPHAPP={'FEED_FANOUT_MAX_SUBSCRIBERS': 2})
+class FeedTests(GraphQLTestCase):
+    """ The seeded authors have three subscribers, so they are read-merged """
+
+    feed = '''query ($after: String) { myFeed(first: 4, after: $after) {
+                totalCount edges { node { id } } pageInfo { hasNextPage endCursor } } }'''
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.users[0])
+        self.quiet = Author.objects.create(name='quiet', image='images/author.jpg')
+        Post.objects.create(author=self.quiet, title='old', content='old', likes=0, time_to_read=1)
+
+    def read_feed(self):
+        ids, after = [], None
+        while True:
+            page = self.query(self.feed, {'after': after})['myFeed']
+            ids += [edge['node']['id'] for edge in page['edges']]
+            if not page['pageInfo']['hasNextPage']:
+                return ids, page['totalCount']
+            after = page['pageInfo']['endCursor']
+
+    def test_timeline_is_merged_with_popular_authors(self):
+        self.query('mutation ($id: ID!) { subscribeToAuthor(authorId: $id) { user { id } } }', {'id': self.quiet.id})
+        self.query('''mutation ($id: ID!) { createPost(authorId: $id, title: "new", content: "new", likes: 0) {
+                        post { id } } }''', {'id': self.quiet.id})
+        self.assertEqual(TimelineEntry.objects.filter(user=self.users[0]).count(), 2)
+
+        expected = [to_global_id('PostType', pk) for pk in Post.objects.order_by('-date', '-id').values_list('id', flat=True)]
+        self.assertEqual(self.read_feed(), (expected, 11))
+
+        self.query('mutation ($id: ID!) { unsubscribe(authorId: $id) { msg } }', {'id': self.quiet.id})
+        self.assertFalse(TimelineEntry.objects.filter(user=self.users[0]).exists())
+        self.assertEqual(len(self.read_feed()[0]), 9)
+
+    def test_subscribing_needs_a_login(self):
+        self.client.logout()
+        for mutation in ('subscribeToAuthor(authorId: $id) { user { id } }', 'unsubscribe(authorId: $id) { msg }'):
+            with self.subTest(mutation):
+                response = self.client.post('/api/graphql', json.dumps({
+                    'query': f'mutation ($id: ID!) {{ {mutation} }}', 'variables': {'id': self.quiet.id},
+                }), content_type='application/json').json()
+                self.assertEqual(response['errors'][0]['message'], 'You do not have permission to perform this action')
+
+    @override_settings(GRAPHAPP={})
+    def test_feed_page_is_one_timeline_query(self):
+        self.query('mutation ($id: ID!) { subscribeToAuthor(authorId: $id) { user { id } } }', {'id': self.quiet.id})
+        # past the session: the popular authors followed, then the page itself
+        with CaptureQueriesContext(connection) as ctx:
+            self.query('{ myFeed(first: 2) { edges { node { title } } } }')
+        queries = [q['sql'] for q in ctx.captured_queries if 'django_session' not in q['sql'] and 'FROM "auth_user"' not in q['sql']]
+        self.assertEqual(len(queries), 2)
+        self.assertIn('"graphapp_timelineentry"."user_id" =', queries[1])
+
+
+
+class AuthorImageTests(GraphQLTestCase):
+
+    def setUp(self):
+        super().setUp()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings = override_settings(MEDIA_ROOT=media.name, GRAPHAPP={'IMAGE_WORKERS': 0})
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def upload(self, name):
+        buffer = io.BytesIO()
+        Image.new('RGB', (1000, 500), 'navy').save(buffer, 'JPEG')
+        with self.captureOnCommitCallbacks(execute=True):
+            return Author.objects.create(name=name, image=SimpleUploadedFile(f'{name}.jpg', buffer.getvalue()))
+
+    def test_identical_uploads_share_one_file_and_its_variants(self):
+        first, second = self.upload('first'), self.upload('second')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertEqual(len(os.listdir(os.path.dirname(first.image.path))), 2)
+
+        query = '''query ($id: Int) { author(id: $id) {
+                    thumb: imageUrl { url width height } original: imageUrl(size: ORIGINAL) { url width height } } }'''
+        author = self.query(query, {'id': second.id})['author']
+        self.assertEqual(author['thumb']['url'], first.image.storage.url(variant_name(first.image.name, 'thumb', 'webp')))
+        self.assertEqual((author['thumb']['width'], author['thumb']['height']), (128, 64))
+        self.assertEqual((author['original']['width'], author['original']['height']), (1000, 500))
+        self.assertTrue(first.image.storage.exists(variant_name(first.image.name, 'medium', 'jpeg')))
+
+    def test_uploads_are_rendered_by_process_images(self):
+        with override_settings(GRAPHAPP={'IMAGE_WORKERS': 1}):
+            author = self.upload('pending')
+            author.refresh_from_db()
+            # the web process leaves the image to the worker
+            self.assertEqual(author.image_variants, {})
+            call_command('process_images', stdout=io.StringIO(), stderr=io.StringIO())
+        author.refresh_from_db()
+        self.assertEqual(author.image_variants['thumb'], [128, 64])
+
+    def test_unrenderable_uploads_are_marked_once(self):
+        with override_settings(GRAPHAPP={'IMAGE_WORKERS': 1}):
+            with self.captureOnCommitCallbacks(execute=True):
+                author = Author.objects.create(name='broken', image=SimpleUploadedFile('broken.jpg', b'not an image'))
+            err = io.StringIO()
+            call_command('process_images', stdout=io.StringIO(), stderr=err)
+            self.assertIn(f"{author.image.name} couldn't be rendered", err.getvalue())
+            author.refresh_from_db()
+            self.assertEqual(author.image_variants, FAILED)
+            # the next pass leaves it alone
+            out = io.StringIO()
+            call_command('process_images', stdout=out, stderr=io.StringIO())
+            self.assertIn(', 0 rendered,', out.getvalue())
+        # served as the original, without dimensions
+        image = self.query('query ($id: Int) { author(id: $id) { imageUrl { url width } } }', {'id': author.id})['author']['imageUrl']
+        self.assertEqual(image, {'url': author.image.url, 'width': None})
+
+    def test_alpha_is_kept_from_grey_and_palette_images(self):
+        for mode, color in [('LA', (80, 0)), ('P', 0)]:
+            with self.subTest(mode):
+                image = Image.new(mode, (200, 100), color)
+                if mode == 'P':
+                    image.info['transparency'] = 0
+                buffer = io.BytesIO()
+                image.save(buffer, 'PNG')
+                with self.captureOnCommitCallbacks(execute=True):
+                    author = Author.objects.create(name=mode, image=SimpleUploadedFile(f'{mode}.png', buffer.getvalue()))
+                with Image.open(author.image.storage.path(variant_name(author.image.name, 'thumb', 'webp'))) as thumb:
+                    self.assertEqual(thumb.mode, 'RGBA')
+                    self.assertEqual(thumb.getpixel((0, 0))[3], 0)
+
+
+
+class TokenCacheTests(GraphQLTestCase):
+
+    def setUp(self):
+        super().setUp()
+        get_token_cache().clear()
+        self.addCleanup(get_token_cache().clear)
+
+    def whoami(self, token):
+        response = self.client.post('/api/graphql', json.dumps({'query': '{ whoami { username } me: whoami { id } }'}),
+                                    content_type='application/json', HTTP_AUTHORIZATION=f'Bearer {token}')
+        return response.json()
+
+    def test_repeat_tokens_skip_verification_and_the_user_query(self):
+        user = self.users[0]
+        token = get_token(user)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.whoami(token)['data']['whoami'], {'username': user.username})
+        with self.assertNumQueries(0):
+            self.assertEqual(self.whoami(token)['data']['whoami'], {'username': user.username})
+
+        # a password change drops the cached user
+        user.set_password('changed')
+        user.save()
+        with self.assertNumQueries(1):
+            self.whoami(token)
+
+    def test_bad_tokens_are_verified_once_per_request(self):
+        with mock.patch('graphapp.auth.get_payload', wraps=get_payload) as verify:
+            errors = self.whoami('not-a-token')['errors']
+        self.assertEqual(verify.call_count, 1)
+        self.assertEqual([error['path'] for error in errors], [['whoami'], ['me']])
+        self.assertFalse(get_token_cache().entries)
+
+
+
+@skipUnless(connection.vendor == 'postgresql', 'query plans are checked on PostgreSQL')
+class QueryPlanTests(GraphQLTestCase):
+    """ Runs the SQL of each root query through EXPLAIN on a seeded dataset
+        and fails when a large table is read with a sequential scan or the
+        rows are sorted instead of read in index order """
+
+    large_tables = {'graphapp_post', 'graphapp_comment', 'graphapp_timelineentry',
+                    'graphapp_readinglistentry', 'graphapp_author_subscribers', 'graphapp_trendingscore'}
+
+    queries = {
+        'allPosts': '{ allPosts(first: 20) { edges { node { title author { name } comments(first: 3) { edges { node { text } } } } } } }',
+        'allPosts after': '{ allPosts(first: 20, after: "%(post_cursor)s") { edges { node { title } } } }',
+        'authors': '{ authors(first: 10) { edges { node { name postSet(first: 5) { edges { node { title } } } } } } }',
+        'authorsByName': '{ authorsByName(name: "writer 1", first: 10) { edges { node { name } } } }',
+        'comments': '{ comments(first: 20) { edges { node { text author { username } } } } }',
+        'post': '{ post(id: %(post_id)s) { title author { name } comments(first: 10, orderBy: LIKES) { edges { node { text } } } } }',
+        'author': '{ author(id: %(author_id)s) { name postSet(first: 10) { edges { node { title } } } } }',
+        'myReadingLists': '{ myReadingLists(first: 10) { edges { node { name entries(first: 5) { edges { node { post { title } } } } } } } }',
+        'myFeed': '{ myFeed(first: 20) { edges { node { title author { name } } } } }',
+        'trendingPosts': '{ trendingPosts(window: WEEK, first: 20) { title author { name } } }',
+        'popularAuthors': '{ popularAuthors(first: 10) { name } }',
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        rng = random.Random(0)
+        users = User.objects.bulk_create([User(username=f'reader{i}') for i in range(300)])
+        authors = Author.objects.bulk_create([Author(name=f'writer {i}', image='images/author.jpg') for i in range(40)])
+        Author.subscribers.through.objects.bulk_create([
+            Author.subscribers.through(author=author, user=user) for user in users for author in rng.sample(authors, 5)
+        ])
+        posts = Post.objects.bulk_create([
+            Post(author=rng.choice(authors), title=f'post {i}', content='lorem ipsum ' * 20, likes=0, time_to_read=1)
+            for i in range(20000)
+        ])
+        Comment.objects.bulk_create([Comment(author=rng.choice(users), post=rng.choice(posts), text='nice', likes=0) for _ in range(20000)])
+        lists = ReadingList.objects.bulk_create([ReadingList(user=user, name=f'list {n}') for user in users for n in range(3)])
+        ReadingListEntry.objects.bulk_create([
+            ReadingListEntry(reading_list=reading_list, post=post, position=position)
+            for reading_list in lists for position, post in enumerate(rng.sample(posts, 20))
+        ])
+        # one reader's timeline is enough for the plans
+        cls.reader = users[0]
+        followed = Author.objects.filter(subscribers=cls.reader)
+        TimelineEntry.objects.bulk_create([
+            TimelineEntry(user=cls.reader, post=post, author_id=post.author_id, date=post.date)
+            for post in Post.objects.filter(author__in=followed).only('author', 'date')
+        ])
+        now = timezone.now()
+        TrendingScore.objects.bulk_create([
+            TrendingScore(post=post, author_id=post.author_id, window=window, score=rng.random(), last_activity=now, updated=now)
+            for post in posts for window in ('day', 'week')
+        ])
+        AuthorScore.objects.bulk_create([AuthorScore(author=author, score=rng.random()) for author in authors])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def problems(self, plan):
+        """ Returns (problems, large tables read) of a plan node and its children """
+        found, tables = [], set()
+        for child in plan.get('Plans', []):
+            child_found, child_tables = self.problems(child)
+            found += child_found
+            tables |= child_tables
+        if plan.get('Relation Name') in self.large_tables:
+            tables.add(plan['Relation Name'])
+            if plan['Node Type'] == 'Seq Scan':
+                found.append(f"Seq Scan on {plan['Relation Name']}")
+        if plan['Node Type'] == 'WindowAgg' and 'Run Condition' in plan:
+            # the first rows of each parent in a batch (a sliced prefetch): only
+            # the batched parents' rows are sorted, and at most a page of each is left
+            found = [problem for problem in found if not problem.startswith('Sort of')]
+            tables = set()
+        # small tables are cheaper to sort than to read through an index
+        if plan['Node Type'] in ('Sort', 'Incremental Sort') and tables:
+            found.append(f"{plan['Node Type']} of {', '.join(sorted(tables))} by {', '.join(plan['Sort Key'])}")
+        return found, tables
+
+    def test_root_queries_use_indexes(self):
+        self.client.force_login(self.reader)
+        variables = {
+            'post_cursor': encode_cursor(Post.objects.order_by('-date', '-id').values_list('date', 'id')[500]),
+            'post_id': Post.objects.order_by('id')[5000].id,
+            'author_id': Author.objects.order_by('id').last().id,
+        }
+        for name, query in self.queries.items():
+            with CaptureQueriesContext(connection) as ctx:
+                self.query(query % variables)
+            for captured in ctx.captured_queries:
+                sql = captured['sql']
+                if not sql.startswith('SELECT') or 'graphapp_' not in sql:
+                    continue
+                with self.subTest(name, sql=sql), connection.cursor() as cursor:
+                    cursor.execute('EXPLAIN (FORMAT JSON) ' + sql)
+                    self.assertEqual(self.problems(cursor.fetchone()[0][0]['Plan'])[0], [])
+
+
+
+class BenchmarkTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_data(authors=5, users=10, posts=40, comments=100, lists=1, list_size=3)
+
+    def test_seed_is_skewed_and_counts_are_filled(self):
+        counts = list(Author.objects.order_by('id').values_list('subscriber_count', flat=True))
+        self.assertEqual(sum(counts), Author.subscribers.through.objects.count())
+        self.assertGreater(counts[0], counts[-1])
+        self.assertEqual(sum(Post.objects.values_list('comment_count', flat=True)), 100)
+
+    def test_every_operation_runs(self):
+        user = User.objects.get(username='bench0')
+        data = fixtures(user)
+        token = get_token(user)
+        for name, operation in OPERATIONS.items():
+            if operation.get('postgresql') and connection.vendor != 'postgresql':
+                continue
+            headers = {'HTTP_AUTHORIZATION': f'Bearer {token}'} if operation.get('auth') else {}
+            body = json.dumps({'query': operation['query'], 'variables': operation['variables'](data)})
+            with self.subTest(name):
+                response = self.client.post('/api/graphql', body, content_type='application/json', **headers)
+                self.assertNotIn('errors', response.json())
+
+
+
+class InstrumentationTests(GraphQLTestCase):
+    posts = 'query Posts { allPosts(first: 3) { edges { node { title author { name } } } } }'
+
+    def traced(self, query):
+        response = self.client.post('/api/graphql', json.dumps({'query': query, 'extensions': {'tracing': True}}),
+                                    content_type='application/json')
+        return response.json()
+
+    @override_settings(GRAPHAPP={'TRACING': True})
+    def test_trace_charges_sql_to_resolvers(self):
+        content = self.traced(self.posts)
+        tracing = content['extensions']['tracing']
+        resolvers = {tuple(r['path']): r for r in tracing['execution']['resolvers']}
+        self.assertGreater(resolvers['allPosts',]['sqlQueries'], 0)
+        self.assertEqual(resolvers['allPosts', 'edges', 0, 'node', 'title']['sqlQueries'], 0)
+        self.assertEqual(tracing['sql']['queries'], sum(r['sqlQueries'] for r in resolvers.values()))
+        self.assertGreaterEqual(tracing['duration'], max(r['duration'] for r in resolvers.values()))
+        # the trace bypasses the response cache
+        self.assertNotIn('responseCache', content['extensions'])
+
+    @override_settings(GRAPHAPP={'TRACING': True})
+    async def test_async_view_traces(self):
+        body = json.dumps({'query': self.posts, 'extensions': {'tracing': True}})
+        response = await self.async_client.post('/api/graphql/async', body, content_type='application/json')
+        tracing = response.json()['extensions']['tracing']
+        self.assertGreater(tracing['sql']['queries'], 0)
+        self.assertTrue(all(r['duration'] > 0 for r in tracing['execution']['resolvers']))
+
+    @override_settings(GRAPHAPP={})
+    def test_tracing_is_off_by_default(self):
+        self.assertNotIn('tracing', self.traced(self.posts).get('extensions', {}))
+
+    @mock.patch('graphapp.instrumentation._metrics', None)
+    def test_metrics_endpoint(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+        with override_settings(GRAPHAPP={'METRICS': True}):
+            self.query(self.posts)
+            cache.clear()
+            self.query(self.posts)
+            response = self.client.get('/metrics')
+        text = response.content.decode()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('graphql_request_duration_seconds_count{operation="Posts"} 2', text)
+        self.assertIn('graphql_resolver_duration_seconds_bucket{operation="Posts",field="Query.allPosts",le="+Inf"} 2',
+                      text)
+        self.assertRegex(text, r'graphql_resolver_sql_queries_total\{operation="Posts",field="Query.allPosts"\} [1-9]')
+
+
+
+class QueryCountTests(TestCase):
+
+    def test_query_counts_are_flat_and_within_baseline(self):
+        queries, growing, over_baseline = check()
+        self.assertTrue(queries)
+        self.assertFalse(growing + over_baseline, '\n\n'.join(growing + over_baseline))
+
+    @override_settings(GRAPHAPP={'QUERY_COUNT_DEBUG': True, 'QUERY_BUDGET': 1})
+    def test_debug_mode_logs_operations_over_budget(self):
+        author = Author.objects.create(name='author', image='images/author.jpg')
+        Post.objects.create(author=author, title='post', content='content', likes=0, time_to_read=1)
+        body = json.dumps({'query': 'query Nested { allPosts(first: 5) { edges { node { title comments(first: 5) { edges { node { text } } } } } } }'})
+        with self.assertLogs('graphapp.instrumentation', 'WARNING') as logs:
+            self.client.post('/api/graphql', body, content_type='application/json')
+        self.assertIn('Nested ran 2 SQL queries, its budget is 1: Query.allPosts 1, PostType.comments 1', logs.output[0])
+
+
+
+class SubscriptionTests(GraphQLTestCase):
+    """ Drives the WebSocket app with the ASGI messages a server would send """
+
+    def setUp(self):
+        super().setUp()
+        self.connections = []
+        # it would close the connection holding the test's transaction
+        patcher = mock.patch('graphapp.websocket.close_old_connections')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def connect(self, token=None):
+        app = GraphQLWebSocketApp(schema, path='/api/graphql')
+        incoming, outgoing = asyncio.Queue(), asyncio.Queue()
+        scope = {'type': 'websocket', 'path': '/api/graphql', 'subprotocols': ['graphql-transport-ws']}
+        task = asyncio.ensure_future(app(scope, incoming.get, outgoing.put))
+        self.connections.append((incoming, task))
+        await incoming.put({'type': 'websocket.connect'})
+        self.assertEqual((await outgoing.get())['type'], 'websocket.accept')
+        payload = {'Authorization': f'Bearer {token}'} if token else {}
+        await incoming.put({'type': 'websocket.receive', 'text': json.dumps({'type': 'connection_init', 'payload': payload})})
+        self.assertEqual(await self.receive(outgoing), {'type': 'connection_ack'})
+        return incoming, outgoing
+
+    async def disconnect(self):
+        for incoming, task in self.connections:
+            await incoming.put({'type': 'websocket.disconnect'})
+            await asyncio.wait_for(task, 1)
+
+    async def receive(self, outgoing):
+        message = await asyncio.wait_for(outgoing.get(), 2)
+        return json.loads(message['text'])
+
+    def subscriber_count(self):
+        pubsub = get_pubsub()
+        with pubsub.lock:
+            return sum(len(entries) for entries in pubsub.subscribers.values())
+
+    async def subscribe(self, incoming, id, query, channels=True):
+        """ Starts an operation; a subscription to any channel is awaited
+            until it reaches the pub/sub """
+        subscribers = self.subscriber_count()
+        await incoming.put({'type': 'websocket.receive', 'text': json.dumps({
+            'type': 'subscribe', 'id': id, 'payload': {'query': query},
+        })})
+        if channels and query.startswith('subscription'):
+            # the subscriber registers past a thread hop, publishing before it would be lost
+            async def registered():
+                while self.subscriber_count() == subscribers:
+                    await asyncio.sleep(0.001)
+            await asyncio.wait_for(registered(), 2)
+
+    def create_post(self, author):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.query(f'mutation {{ createPost(authorId: {author.id}, title: "new", content: "fresh", likes: 0) {{ post {{ id }} }} }}')
+
+    async def test_post_added_reaches_the_followers_of_its_author(self):
+        user, others = self.users[0], self.users[1]
+        author, other_author = await sync_to_async(list)(Author.objects.order_by('id')[:2])
+        await sync_to_async(author.subscribers.set)([others])
+        await sync_to_async(user.author_set.clear)()
+        query = 'subscription { postAdded { title author { name } } }'
+        follower = await self.connect(await sync_to_async(get_token)(others))
+        stranger = await self.connect(await sync_to_async(get_token)(user))
+        anonymous = [await self.connect(), await self.connect()]
+        for incoming, _ in [follower, *anonymous]:
+            await self.subscribe(incoming, '1', query)
+        # following nobody, the stranger listens on no channel
+        await self.subscribe(stranger[0], '1', query, channels=False)
+
+        execute = WebSocketConnection.execute
+        with mock.patch.object(WebSocketConnection, 'execute', autospec=True, side_effect=execute) as executions:
+            await sync_to_async(self.create_post)(author)
+            expected = {'type': 'next', 'id': '1', 'payload': {'data': {'postAdded': {'title': 'new', 'author': {'name': author.name}}}}}
+            self.assertEqual(await self.receive(follower[1]), expected)
+            for _, outgoing in anonymous:
+                self.assertEqual(await self.receive(outgoing), expected)
+        # the anonymous subscribers shared one execution
+        self.assertEqual(executions.call_count, 2)
+        self.assertTrue(stranger[1].empty())
+
+        await self.subscribe(stranger[0], '2', f'subscription {{ postAdded(authorIds: [{other_author.id}]) {{ title }} }}')
+        await sync_to_async(self.create_post)(other_author)
+        self.assertEqual(await self.receive(stranger[1]), {'type': 'next', 'id': '2', 'payload': {'data': {'postAdded': {'title': 'new'}}}})
+        await self.disconnect()
+
+    @override_settings(GRAPHAPP={'READ_REPLICAS': ['replica']})
+    @mock.patch('graphapp.views.graphene_settings.ATOMIC_MUTATIONS', True)
+    async def test_mutations_run_atomically_on_the_primary(self):
+        incoming, outgoing = await self.connect(await sync_to_async(get_token)(self.users[0]))
+        author = await Author.objects.afirst()
+        # the replica isn't among the test's databases, touching it fails the operation
+        with mock.patch('graphapp.views.transaction.atomic', wraps=transaction.atomic) as atomic, \
+                mock.patch('graphapp.websocket.reading_from', wraps=reading_from) as routed:
+            await self.subscribe(incoming, 'm', f'mutation {{ createPost(authorId: {author.id}, title: "new", content: "fresh", likes: 0) {{ post {{ title }} }} }}')
+            self.assertEqual(await self.receive(outgoing), {'type': 'next', 'id': 'm', 'payload': {'data': {'createPost': {'post': {'title': 'new'}}}}})
+            self.assertEqual(await self.receive(outgoing), {'type': 'complete', 'id': 'm'})
+            # and the reads that follow on the socket stay on the primary
+            await self.subscribe(incoming, 'q', f'{{ author(id: {author.id}) {{ name }} }}')
+            self.assertEqual(await self.receive(outgoing), {'type': 'next', 'id': 'q', 'payload': {'data': {'author': {'name': author.name}}}})
+        self.assertIn(mock.call(), atomic.call_args_list)
+        self.assertEqual([call.args for call in routed.call_args_list], [('default',), ('default',)])
+        await self.disconnect()
+
+    async def test_comment_added_and_protocol_errors(self):
+        incoming, outgoing = await self.connect()
+        post = await Post.objects.afirst()
+        await self.subscribe(incoming, 'c', f'subscription {{ commentAdded(postId: {post.id}) {{ text }} }}')
+
+        def comment():
+            with self.captureOnCommitCallbacks(execute=True):
+                Comment.objects.create(author=self.users[0], post=post, text='live', likes=0)
+        await sync_to_async(comment)()
+        self.assertEqual(await self.receive(outgoing), {'type': 'next', 'id': 'c', 'payload': {'data': {'commentAdded': {'text': 'live'}}}})
+
+        await incoming.put({'type': 'websocket.receive', 'text': json.dumps({'type': 'complete', 'id': 'c'})})
+        await self.subscribe(incoming, 'q', '{ author(id: 0) { name } }')
+        self.assertEqual(await self.receive(outgoing), {'type': 'next', 'id': 'q', 'payload': {'data': {'author': None}}})
+        self.assertEqual(await self.receive(outgoing), {'type': 'complete', 'id': 'q'})
+
+        await incoming.put({'type': 'websocket.receive', 'text': json.dumps({'type': 'connection_init'})})
+        self.assertEqual(await asyncio.wait_for(outgoing.get(), 2),
+                         {'type': 'websocket.close', 'code': 4429, 'reason': "Too many initialisation requests"})
+        await self.disconnect()
+
+
+
+class ExportTests(GraphQLTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.staff = User.objects.create(username='analyst', is_staff=True)
+
+    def export(self, path, user=None):
+        token = get_token(user or self.staff)
+        response = self.client.get(f'/api/export/{path}', HTTP_AUTHORIZATION=f'Bearer {token}')
+        return response, b''.join(response.streaming_content).decode() if response.status_code == 200 else None
+
+    def test_export_resumes_from_a_checkpoint(self):
+        response, body = self.export('posts')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in body.splitlines()]
+        expected = list(Post.objects.order_by('date', 'id').values_list('id', flat=True))
+        self.assertEqual([row['id'] for row in rows], expected)
+
+        last = rows[3]
+        _, body = self.export(f"posts?after={last['date'].replace('+', '%2B')},{last['id']}")
+        self.assertEqual([json.loads(line)['id'] for line in body.splitlines()], expected[4:])
+
+        author = Author.objects.first()
+        _, body = self.export(f'posts?format=csv&author={author.id}')
+        lines = body.splitlines()
+        self.assertEqual(lines[0].split(',')[:4], ['id', 'date', 'author_id', 'author_name'])
+        self.assertEqual(len(lines), 1 + author.post_set.count())
+
+    async def test_export_streams_under_asgi(self):
+        token = await sync_to_async(get_token)(self.staff)
+        small_chunks = lambda *args, **kwargs: stream(*args, buffer_size=100, **kwargs)
+        with mock.patch('graphapp.views.stream', small_chunks):
+            response = await self.async_client.get('/api/export/posts', headers={'authorization': f'Bearer {token}'})
+            # handed to the server chunk by chunk, not read into a list first
+            self.assertTrue(response.is_async)
+            chunks = [chunk async for chunk in response.streaming_content]
+        self.assertGreater(len(chunks), 1)
+        ids = [json.loads(line)['id'] for line in b''.join(chunks).decode().splitlines()]
+        expected = await sync_to_async(list)(Post.objects.order_by('date', 'id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+
+    def test_export_checks_the_user_and_the_filters(self):
+        self.assertEqual(self.export('posts', self.users[0])[0].status_code, 403)
+        self.assertEqual(self.export('posts?since=yesterday')[0].status_code, 400)
+        self.assertEqual(self.export('users')[0].status_code, 404)
+
+    def test_export_command(self):
+        out = io.StringIO()
+        call_command('export_data', 'comments', '--since', '2000-01-01', stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), Comment.objects.count())
+
+
+
+class ImportTests(GraphQLTestCase):
+
+    def import_file(self, kind, text, suffix='.ndjson'):
+        with tempfile.NamedTemporaryFile('w', suffix=suffix, delete=False) as f:
+            f.write(text)
+        self.addCleanup(os.remove, f.name)
+        out = io.StringIO()
+        call_command('import_blog', kind, f.name, '--batch-size', '1', stdout=out)
+        return out.getvalue()
+
+    def test_import_posts_and_comments(self):
+        author = Author.objects.get(name='author0')
+        rows = [
+            {'author_id': author.id, 'title': 'long', 'content': 'word ' * 400, 'date': '2020-01-01T10:00:00'},
+            {'author_id': author.id, 'title': 'empty', 'content': '', 'likes': 3},
+        ]
+        out = self.import_file('posts', ''.join(json.dumps(row) + '\n' for row in rows))
+        self.assertIn('2 posts, ', out)
+        self.assertIn('rows/s', out)
+
+        long, empty = Post.objects.filter(title__in=['long', 'empty']).order_by('date')
+        self.assertEqual((long.time_to_read, long.likes, long.date.year), (2, 0, 2020))
+        self.assertEqual((empty.time_to_read, empty.likes, empty.content), (1, 3, ''))
+        # fanned out to the author's subscribers
+        self.assertEqual(TimelineEntry.objects.filter(post__in=[long, empty]).count(), 2 * len(self.users))
+
+        self.import_file('comments', f'author_id,text,post_id\n{self.users[0].id},"first, of two",{long.id}\n'
+                                     f'{self.users[1].id},second,{long.id}\n{self.users[1].id},loose,\n', '.csv')
+        long.refresh_from_db()
+        self.assertEqual(long.comment_count, 2)
+        self.assertEqual(list(long.comments.values_list('text', flat=True).order_by('id')), ['first, of two', 'second'])
+        self.assertTrue(Comment.objects.filter(text='loose', post__isnull=True).exists())
+
+    def test_ids_are_allocated_past_the_explicit_ones(self):
+        author = Author.objects.get(name='author0')
+        top = Post.objects.order_by('-id').values_list('id', flat=True)[0]
+        # the blank ids come first, the explicit ones after them in later batches
+        rows = [{'author_id': author.id, 'title': 'blank', 'content': ''}] * 2 + [
+            {'id': top + offset, 'author_id': author.id, 'title': 'explicit', 'content': ''} for offset in (1, 2, 3)
+        ]
+        self.import_file('posts', ''.join(json.dumps(row) + '\n' for row in rows))
+        self.assertEqual(list(Post.objects.filter(title='explicit').order_by('id').values_list('id', flat=True)), [top + 1, top + 2, top + 3])
+        self.assertTrue(all(id > top + 3 for id in Post.objects.filter(title='blank').values_list('id', flat=True)))
+        # and the rows created after the import don't collide either
+        self.assertGreater(Post.objects.create(author=author, title='new', content='', likes=0, time_to_read=1).id, top + 3)
+
+    def test_import_subscriptions_all_or_nothing(self):
+        author = Author.objects.get(name='author0')
+        user = User.objects.create(username='reader')
+        self.import_file('subscriptions', f'author_id,user_id\n{author.id},{self.users[0].id}\n{author.id},{user.id}\n', '.csv')
+        author.refresh_from_db()
+        self.assertEqual(author.subscriber_count, len(self.users) + 1)
+
+        with self.assertRaisesMessage(CommandError, 'Row 2: user_id is missing'):
+            self.import_file('subscriptions', f'{{"author_id": {author.id}, "user_id": {user.id}}}\n{{"author_id": {author.id}}}\n')
+        self.assertEqual(author.subscribers.count(), len(self.users) + 1)
+
+
+
+class CommentThreadTests(GraphQLTestCase):
+
+    def test_comment_pages_of_many_posts_in_one_query(self):
+        query = '''{ allPosts(first: 10) { edges { node { comments(first: 2) { edges { node { text } } pageInfo { hasNextPage } } } } } }'''
+        # the posts, then the first two comments of every one of them
+        with self.assertNumQueries(2):
+            data = self.query(query)
+        pages = [edge['node']['comments'] for edge in data['allPosts']['edges']]
+        self.assertEqual([(len(page['edges']), page['pageInfo']['hasNextPage']) for page in pages], [(2, True)] * 9)
+
+        post = Post.objects.order_by('id').first()
+        liked = post.comments.order_by('id').first()
+        Comment.objects.filter(pk=liked.pk).update(likes=5)
+        query = '''query ($id: Int, $after: String) { post(id: $id) { comments(first: 2, orderBy: LIKES, after: $after) {
+                     edges { cursor node { id likes } } pageInfo { hasNextPage } } } }'''
+        page = self.query(query, {'id': post.id})['post']['comments']
+        self.assertEqual([(edge['node']['id'], edge['node']['likes']) for edge in page['edges']][0], (str(liked.id), 5))
+        rest = self.query(query, {'id': post.id, 'after': page['edges'][-1]['cursor']})['post']['comments']
+        self.assertEqual((len(rest['edges']), rest['pageInfo']['hasNextPage']), (1, False))
+
+    def test_replies_thread_under_their_comment(self):
+        self.client.force_login(self.users[0])
+        post, other = Post.objects.order_by('id')[:2]
+        parent = post.comments.order_by('id').first()
+        mutation = '''mutation ($input: [CommentInput!]!) { createComments(input: $input) {
+                        comments { text parent { id } } errors { index message } } }'''
+        items = [{'postId': post.id, 'parentId': parent.id, 'text': 'reply'}, {'postId': other.id, 'parentId': parent.id, 'text': 'elsewhere'}]
+        with self.captureOnCommitCallbacks(execute=True):
+            result = self.query(mutation, {'input': items})['createComments']
+        self.assertEqual(result['comments'], [{'text': 'reply', 'parent': {'id': str(parent.id)}}, None])
+        self.assertEqual(result['errors'], [{'index': 1, 'message': f"Comment {parent.id} isn't on post {other.id}"}])
+
+        query = '''query ($id: Int) { post(id: $id) { commentCount comments(first: 10) { edges { node { id
+                     replies(first: 5) { edges { node { text } } } } } } } }'''
+        data = self.query(query, {'id': post.id})['post']
+        self.assertEqual(data['commentCount'], 4)
+        replies = {edge['node']['id']: [reply['node']['text'] for reply in edge['node']['replies']['edges']]
+                   for edge in data['comments']['edges']}
+        self.assertEqual(len(replies), 3)
+        self.assertEqual(replies[str(parent.id)], ['reply'])
+
+    def test_create_comment_as_the_current_user(self):
+        self.client.force_login(self.users[1])
+        post, other = Post.objects.order_by('id')[:2]
+        parent = post.comments.order_by('id').first()
+        mutation = '''mutation ($post: ID!, $parent: ID) { createComment(postId: $post, parentId: $parent, text: "me too") {
+                        comment { text likes author { username } post { id } parent { id } } } }'''
+        with self.captureOnCommitCallbacks(execute=True):
+            comment = self.query(mutation, {'post': post.id, 'parent': parent.id})['createComment']['comment']
+        self.assertEqual(comment, {
+            'text': 'me too', 'likes': 0, 'author': {'username': 'user1'},
+            'post': {'id': to_global_id('PostType', post.id)}, 'parent': {'id': str(parent.id)},
+        })
+        post.refresh_from_db()
+        self.assertEqual(post.comment_count, 4)
+
+        response = self.client.post('/api/graphql', json.dumps({'query': mutation, 'variables': {'post': other.id, 'parent': parent.id}}),
+                                    content_type='application/json').json()
+        self.assertEqual(response['errors'][0]['message'], f"Comment {parent.id} isn't on post {other.id}")
+
+
+
+@override_settings(GRAPHAPP={'TRENDING_REFRESH_OVERLAP': 0})
+class TrendingTests(GraphQLTestCase):
+
+    def test_scores_decay_by_a_sixteenth_per_window(self):
+        now = timezone.now()
+        score = log_score([(now, 3), (now - timedelta(days=1), 16)], 'day')
+        self.assertAlmostEqual(decayed(score, 'day', now), 4)
+        # the order of stored scores holds as they decay
+        self.assertAlmostEqual(decayed(score, 'day', now + timedelta(hours=6)), 2)
+
+    def test_trending_posts_and_popular_authors(self):
+        post = Post.objects.order_by('id').last()
+        for user in self.users:
+            PostLike.objects.create(user=user, post=post)
+        refresh_scores()
+        data = self.query('{ trendingPosts(window: DAY, first: 2) { title } popularAuthors(first: 1) { name } }')
+        self.assertEqual(len(data['trendingPosts']), 2)
+        self.assertEqual(data['trendingPosts'][0]['title'], post.title)
+        self.assertEqual(data['popularAuthors'], [{'name': post.author.name}])
+
+    def test_refresh_only_rescores_touched_posts(self):
+        self.assertEqual(refresh_scores(), Post.objects.count())
+        self.assertEqual(refresh_scores(), 0)
+
+        post, other = Post.objects.order_by('id')[:2]
+        Comment.objects.create(author=self.users[0], post=post, text='late', likes=0)
+        like = PostLike.objects.create(user=self.users[0], post=other)
+        self.assertEqual(refresh_scores(), 2)
+        liked = TrendingScore.objects.get(post=other, window='day').score
+
+        # an unlike leaves no date behind, the deletion marks the post instead
+        like.delete()
+        self.assertEqual(refresh_scores(), 1)
+        self.assertLess(TrendingScore.objects.get(post=other, window='day').score, liked)
+
+    def test_refresh_outdates_cached_rankings(self):
+        refresh_scores()
+        query = '{ trendingPosts(window: DAY, first: 1) { title } popularAuthors(first: 1) { name } }'
+        self.query(query)
+        post = Post.objects.order_by('id').first()
+        for user in self.users:
+            PostLike.objects.create(user=user, post=post)
+        with self.captureOnCommitCallbacks(execute=True):
+            refresh_scores()
+        response = self.client.post('/api/graphql', json.dumps({'query': query}), content_type='application/json').json()
+        self.assertEqual(response['extensions']['responseCache'], 'MISS')
+        self.assertEqual(response['data'], {'trendingPosts': [{'title': post.title}], 'popularAuthors': [{'name': post.author.name}]})
+
+    def test_deleted_posts_leave_their_author(self):
+        post = Post.objects.order_by('id').last()
+        for user in self.users:
+            PostLike.objects.create(user=user, post=post)
+        refresh_scores()
+        author, post_id = post.author, to_global_id('PostType', post.id)
+        score = AuthorScore.objects.get(author=author).score
+
+        post.delete()
+        self.assertEqual(refresh_scores(), 0)
+        data = self.query('{ trendingPosts(window: DAY, first: 20) { id } }')
+        self.assertNotIn(post_id, [p['id'] for p in data['trendingPosts']])
+        self.assertLess(AuthorScore.objects.get(author=author).score, score)
+        self.assertFalse(AuthorScore.objects.get(author=author).stale)
+
+        # without a post left the author drops out of popularAuthors
+        author.post_set.all().delete()
+        refresh_scores()
+        self.assertFalse(AuthorScore.objects.filter(author=author).exists())
+        data = self.query('{ popularAuthors(first: 20) { name } }')
+        self.assertNotIn(author.name, [a['name'] for a in data['popularAuthors']])
+
+
+
+@override_settings(GRAPHAPP={'READ_REPLICAS': ['replica']})
+class ReplicaRoutingTests(TransactionTestCase):
+    """ The replica alias mirrors the primary in tests; the rows are committed
+        so both see them, and the queries each one ran show where reads went """
+
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        cache.clear()
+        _down.clear()
+        self.user = User.objects.create(username='reader')
+        author = Author.objects.create(name='author', image='images/author.jpg')
+        self.post = Post.objects.create(author=author, title='post', content='content', likes=0, time_to_read=1)
+
+    def execute(self, query, url='/api/graphql'):
+        """ Returns (data, queries on the primary, queries on the replica) """
+        with CaptureQueriesContext(connections['default']) as primary, CaptureQueriesContext(connections['replica']) as replica:
+            response = self.client.post(url, json.dumps({'query': query}), content_type='application/json')
+        content = response.json()
+        self.assertNotIn('errors', content)
+        return content['data'], len(primary), len(replica)
+
+    def test_queries_read_from_the_replica(self):
+        for url in ('/api/graphql', '/api/graphql/async'):
+            with self.subTest(url):
+                cache.clear()
+                data, primary, replica = self.execute('{ allPosts(first: 5) { edges { node { title author { name } } } } }', url)
+                self.assertEqual(data['allPosts']['edges'][0]['node']['title'], 'post')
+                self.assertEqual(primary, 0)
+                self.assertGreater(replica, 0)
+
+    def test_mutations_pin_the_client_to_the_primary(self):
+        self.client.force_login(self.user)
+        data, primary, replica = self.execute('mutation { likePost(postId: %d) { post { likes } } }' % self.post.id)
+        self.assertEqual(data['likePost']['post']['likes'], 1)
+        self.assertEqual(replica, 0)
+        self.assertIn(PIN_COOKIE, self.client.cookies)
+
+        # the client's next query reads its own write from the primary
+        data, primary, replica = self.execute('{ post(id: %d) { likes } }' % self.post.id)
+        self.assertEqual(data['post']['likes'], 1)
+        self.assertEqual(replica, 0)
+
+    def test_reads_after_a_write_go_to_the_primary(self):
+        with reading_from('replica'):
+            self.assertEqual(router.db_for_read(Post), 'replica')
+            self.post.save()
+            self.assertEqual(router.db_for_read(Post), 'default')
+        self.assertEqual(router.db_for_read(Post), 'default')
+
+    def test_unavailable_replica_falls_back_to_the_primary(self):
+        with mock.patch.object(connections['replica'], 'ensure_connection', side_effect=OperationalError), \
+                CaptureQueriesContext(connections['default']) as primary:
+            response = self.client.post('/api/graphql', json.dumps({'query': '{ allPosts(first: 5) { edges { node { title } } } }'}),
+                                        content_type='application/json')
+        self.assertEqual(response.json()['data']['allPosts']['edges'][0]['node']['title'], 'post')
+        self.assertGreater(len(primary), 0)
+        self.assertIn('replica', _down)
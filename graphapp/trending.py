@@ -0,0 +1,181 @@
+import math
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from .conf import app_setting
+from .models import *
+from .responses import invalidate
+
+
+# trendingPosts windows; activity as old as its window counts 1/16
+WINDOWS = {
+    'day': timedelta(days=1),
+    'week': timedelta(days=7),
+    'month': timedelta(days=30),
+}
+
+# scores are log2 of the decayed activity as it stood at EPOCH, which keeps
+# their order as time passes: decay scales every score by the same factor
+EPOCH = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+
+
+
+
+def half_life(window):
+    return WINDOWS[window] / 4
+
+
+
+def log_score(events, window):
+    """ log2 of the weights of events, (date, weight) pairs, each doubled
+        every half-life after EPOCH. None without any weight. """
+    exponents = [
+        ((date - EPOCH) / half_life(window), weight) for date, weight in events if weight > 0
+    ]
+    if not exponents:
+        return None
+    # factored by the largest term, 2 ** exponent overflows within months
+    top = max(exponent for exponent, _ in exponents)
+    return top + math.log2(sum(weight * 2 ** (exponent - top) for exponent, weight in exponents))
+
+
+
+def decayed(score, window, now=None):
+    """ The activity a score stands for, as of now """
+    return 2 ** (score - ((now or timezone.now()) - EPOCH) / half_life(window))
+
+
+
+def add_scores(scores):
+    """ log2 of the sum of the activities of log2 scores """
+    top = max(scores)
+    return top + math.log2(sum(2 ** (score - top) for score in scores))
+
+
+
+def post_events(post_ids):
+    """ {post_id: [(date, weight)]} of the activity on posts, and their authors """
+    weights = app_setting('TRENDING_WEIGHTS')
+    events, authors, posted, timed_likes = defaultdict(list), {}, {}, defaultdict(int)
+    for id, author_id, date, likes in Post.objects.filter(pk__in=post_ids).values_list('id', 'author_id', 'date', 'likes'):
+        authors[id] = author_id
+        posted[id] = (date, likes)
+    for post_id, created in PostLike.objects.filter(post_id__in=post_ids).values_list('post_id', 'created'):
+        timed_likes[post_id] += 1
+        events[post_id].append((created, weights['like']))
+    for post_id, date in Comment.objects.filter(post_id__in=post_ids).values_list('post_id', 'date'):
+        events[post_id].append((date, weights['comment']))
+    for post_id, added in ReadingListEntry.objects.filter(post_id__in=post_ids).values_list('post_id', 'added'):
+        events[post_id].append((added, weights['reading_list']))
+    # likes that were imported or seeded have no PostLike, they count from the post's date
+    for id, (date, likes) in posted.items():
+        events[id].append((date, weights['post'] + max(likes - timed_likes[id], 0) * weights['like']))
+    return events, authors
+
+
+
+def touched_posts(since):
+    """ Ids of the posts with activity after since, or whose activity was
+        deleted, or every post when since is None """
+    if since is None:
+        return set(Post.objects.values_list('id', flat=True))
+    return (
+        set(Post.objects.filter(date__gte=since).values_list('id', flat=True))
+        | set(PostLike.objects.filter(created__gte=since).values_list('post_id', flat=True))
+        | set(Comment.objects.filter(date__gte=since).exclude(post=None).values_list('post_id', flat=True))
+        | set(ReadingListEntry.objects.filter(added__gte=since).values_list('post_id', flat=True))
+        | set(TrendingScore.objects.filter(stale=True).values_list('post_id', flat=True))
+    )
+
+
+
+def last_refresh():
+    return TrendingScore.objects.aggregate(last=Max('updated'))['last']
+
+
+
+def refresh_posts(post_ids, now):
+    """ Rewrites the scores of post_ids in every window, returns their authors """
+    events, authors = post_events(post_ids)
+    rows = []
+    for id, author_id in authors.items():
+        last_activity = max(date for date, _ in events[id])
+        for window in WINDOWS:
+            score = log_score(events[id], window)
+            # a post nobody did anything with, when new posts weigh nothing
+            if score is not None:
+                rows.append(TrendingScore(
+                    post_id=id, author_id=author_id, window=window, score=score,
+                    last_activity=last_activity, updated=now, stale=False,
+                ))
+    TrendingScore.objects.bulk_create(
+        rows, update_conflicts=True, unique_fields=['window', 'post'],
+        update_fields=['author', 'score', 'last_activity', 'updated', 'stale'],
+    )
+    return set(authors.values())
+
+
+
+def refresh_authors(author_ids):
+    """ Adds up the scores of the authors' posts in POPULAR_AUTHORS_WINDOW,
+        and drops the authors with no scored post left """
+    scores = defaultdict(list)
+    posts = TrendingScore.objects.filter(window=app_setting('POPULAR_AUTHORS_WINDOW'), author_id__in=author_ids)
+    for author_id, score in posts.values_list('author_id', 'score'):
+        scores[author_id].append(score)
+    AuthorScore.objects.bulk_create(
+        [AuthorScore(author_id=id, score=add_scores(values), stale=False) for id, values in scores.items()],
+        update_conflicts=True, unique_fields=['author'], update_fields=['score', 'stale'],
+    )
+    unscored = set(author_ids) - scores.keys()
+    if unscored:
+        AuthorScore.objects.filter(author_id__in=unscored).delete()
+
+
+
+def refresh_scores(full=False, batch_size=1000):
+    """ Recomputes the scores of the posts touched since the last refresh,
+        or of every post, and of their authors and the authors of deleted
+        posts. Returns how many posts. """
+    now = timezone.now()
+    since = None if full else last_refresh()
+    if since is not None:
+        # activity committed after the last refresh began can carry an older date
+        since -= timedelta(seconds=app_setting('TRENDING_REFRESH_OVERLAP'))
+    post_ids = sorted(touched_posts(since))
+    # authors who lost a post, or every scored author, some of whom may have no posts left
+    authors = AuthorScore.objects.all() if full else AuthorScore.objects.filter(stale=True)
+    stale_authors = set(authors.values_list('author_id', flat=True))
+    for start in range(0, len(post_ids), batch_size):
+        with transaction.atomic():
+            author_ids = refresh_posts(post_ids[start:start + batch_size], now)
+            refresh_authors(author_ids)
+            stale_authors -= author_ids
+    if stale_authors:
+        with transaction.atomic():
+            refresh_authors(stale_authors)
+    if post_ids or stale_authors:
+        # the cached trendingPosts and popularAuthors are tagged with the models they list
+        invalidate('Post', 'Author')
+    if full and connection.vendor == 'postgresql':
+        # every row was rewritten, the top-N scans are planned from fresh statistics
+        with connection.cursor() as cursor:
+            for model in (TrendingScore, AuthorScore):
+                cursor.execute(f'ANALYZE {connection.ops.quote_name(model._meta.db_table)}')
+    return len(post_ids)
+
+
+
+def trending_posts(window, now=None):
+    """ Posts active in window, the most trending first """
+    cutoff = (now or timezone.now()) - WINDOWS[window]
+    return Post.objects.filter(
+        trending_scores__window=window, trending_scores__last_activity__gte=cutoff,
+    ).order_by('-trending_scores__score', '-trending_scores__post')
+
+
+
+def popular_authors():
+    return Author.objects.filter(popularity__isnull=False).order_by('-popularity__score', '-popularity__author')
@@ -1,13 +1,18 @@
 from django.urls import path
 from .views import *
-from graphene_django.views import GraphQLView
 from .schema import schema
 from django.views.decorators.csrf import csrf_exempt
 from django.conf.urls.static import static
 from django.conf import settings
 
+# csrf_exempt only wraps sync views on django 4.2, so the flag is set directly
+async_graphql_view = AsyncGraphQLView.as_view(graphiql=True, schema=schema)
+async_graphql_view.csrf_exempt = True
+
 
 urlpatterns = [
-    path('graphql', csrf_exempt(GraphQLView.as_view(graphiql=True, schema=schema))),
+    path('graphql', csrf_exempt(CachedGraphQLView.as_view(graphiql=True, schema=schema))),
+    path('graphql/async', async_graphql_view),
+    path('export/<str:kind>', export_view),
 
 ]+ static(settings.MEDIA_URL , document_root=settings.MEDIA_ROOT)
\ No newline at end of file
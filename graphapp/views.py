@@ -1,3 +1,395 @@
-from django.shortcuts import render
+import json
+from contextlib import ExitStack
+from asgiref.sync import sync_to_async
+from django.contrib.auth import authenticate
+from django.core.handlers.asgi import ASGIRequest
+from django.db import DEFAULT_DB_ALIAS, connection, connections, transaction
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, HttpResponseNotAllowed, StreamingHttpResponse
+from django.views.decorators.http import require_GET
+from graphene_django.constants import MUTATION_ERRORS_FLAG
+from graphene_django.utils.utils import set_rollback
+from graphene_django.settings import graphene_settings
+from graphene_django.views import GraphQLView, HttpError
+from graphql import ExecutionResult, GraphQLError, OperationType, execute, get_operation_ast, parse, validate, validate_schema
+from graphql.pyutils import is_awaitable
+from graphql_jwt.exceptions import JSONWebTokenError
+from graphql_jwt.utils import get_http_authorization
+from .conf import app_setting
+from .cost import query_cost_rule
+from .documents import DocumentCache, PersistedQueries, query_hash
+from .export import EXPORTS, FORMATS, parse_checkpoint, parse_since, stream, stream_async
+from .instrumentation import InstrumentationMiddleware, Trace, check_budget, get_metrics
+from .loaders import AsyncBatchingExecutionContext, BatchingExecutionContext, RequestLoaders
+from .responses import get_response_cache
+from .routing import read_database, reading_from
 
-# Create your views here.
+
+
+
+class CachedGraphQLView(GraphQLView):
+    """ GraphQLView that parses and validates each distinct query once per
+        process, accepts automatic persisted queries and serves anonymous
+        queries from the response cache """
+
+    execution_context_class = BatchingExecutionContext
+    documents = None
+    persisted_queries = None
+    responses = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        cls = type(self)
+        if cls.documents is None:
+            cls.documents = DocumentCache(app_setting('DOCUMENT_CACHE_SIZE'))
+        if cls.persisted_queries is None:
+            cls.persisted_queries = PersistedQueries(
+                cache_alias=app_setting('PERSISTED_QUERIES_CACHE'),
+                timeout=app_setting('PERSISTED_QUERIES_TIMEOUT'),
+                allowlist=app_setting('PERSISTED_QUERIES_ALLOWLIST'),
+            )
+        if cls.responses is None:
+            cls.responses = get_response_cache()
+        # untraced requests skip the instrumentation middleware entirely
+        self.untraced_middleware = [
+            m for m in self.middleware or () if not isinstance(m, InstrumentationMiddleware)
+        ]
+
+    def get_middleware(self, request):
+        if getattr(request, 'graphql_trace', None) is None:
+            return self.untraced_middleware
+        return self.middleware
+
+    def get_extensions(self, request, data):
+        extensions = data.get('extensions') or request.GET.get('extensions')
+        if isinstance(extensions, str):
+            try:
+                extensions = json.loads(extensions)
+            except ValueError:
+                extensions = None
+        return extensions if isinstance(extensions, dict) else {}
+
+    def get_document(self, query):
+        """ Returns (document, errors) for query, from the cache when possible """
+        key = query_hash(query)
+        entry = self.documents.get(key)
+        if entry is not None:
+            return entry
+
+        schema = self.schema.graphql_schema
+        try:
+            document = parse(query)
+        except GraphQLError as e:
+            return None, [e]
+        errors = validate(schema, document, self.validation_rules, graphene_settings.MAX_VALIDATION_ERRORS)
+        entry = (document, errors)
+        self.documents.set(key, entry)
+        return entry
+
+    def prepare_request(self, request, data, query, variables, operation_name, show_graphiql=False):
+        """ Everything that happens before execution. Returns (result, None)
+            when the request is answered without executing the document,
+            (None, plan) when the plan still has to be executed. """
+        request_extensions = self.get_extensions(request, data)
+        try:
+            query = self.persisted_queries.resolve(query, request_extensions)
+        except GraphQLError as e:
+            return ExecutionResult(errors=[e]), None
+
+        if not query:
+            if show_graphiql:
+                return None, None
+            raise HttpError(HttpResponseBadRequest("Must provide query string."))
+
+        schema_validation_errors = validate_schema(self.schema.graphql_schema)
+        if schema_validation_errors:
+            return ExecutionResult(data=None, errors=schema_validation_errors), None
+
+        document, errors = self.get_document(query)
+        if document is None:
+            return ExecutionResult(errors=errors), None
+
+        operation_ast = get_operation_ast(document, operation_name)
+        if (
+            request.method.lower() == "get"
+            and operation_ast is not None
+            and operation_ast.operation != OperationType.QUERY
+        ):
+            if show_graphiql:
+                return None, None
+            raise HttpError(HttpResponseNotAllowed(
+                ["POST"], f"Can only perform a {operation_ast.operation.value} operation from a POST request."
+            ))
+
+        if errors:
+            return ExecutionResult(data=None, errors=errors), None
+
+        # cost depends on the variables, so it is checked on every request
+        costs = {}
+        errors = validate(self.schema.graphql_schema, document, [query_cost_rule(variables, costs)])
+        extensions = {'cost': costs.get(operation_ast.name.value if operation_ast and operation_ast.name else None)}
+        if errors:
+            return ExecutionResult(data=None, errors=errors, extensions=extensions), None
+
+        # a traced request is executed, a cached response has nothing to time
+        request.graphql_tracing = bool(app_setting('TRACING') and request_extensions.get('tracing'))
+        if request.graphql_tracing or app_setting('METRICS') or app_setting('QUERY_COUNT_DEBUG'):
+            request.graphql_trace = Trace(operation_ast.name.value if operation_ast and operation_ast.name else None)
+
+        cache_entry = None
+        if not request.graphql_tracing and self.responses.cacheable(request, operation_ast):
+            key, tags = self.responses.entry_key(
+                self.schema.graphql_schema, query_hash(query), document, operation_name, variables
+            )
+            data, versions = self.responses.get(key, tags)
+            if data is not None:
+                return ExecutionResult(data=data, extensions={**extensions, 'responseCache': 'HIT'}), None
+            cache_entry = (key, versions)
+            extensions['responseCache'] = 'MISS'
+
+        request.graphql_database = read_database(request, operation_ast)
+        return None, (document, operation_ast, extensions, cache_entry)
+
+    def finish_request(self, result, extensions, cache_entry):
+        if cache_entry is not None and not result.errors:
+            self.responses.set(*cache_entry, result.data)
+        result.extensions = {**(result.extensions or {}), **extensions}
+        return result
+
+    def execute_graphql_request(self, request, data, query, variables, operation_name, show_graphiql=False):
+        result, plan = self.prepare_request(request, data, query, variables, operation_name, show_graphiql)
+        if plan is None:
+            return result
+        document, operation_ast, extensions, cache_entry = plan
+        result = self.execute_document(request, document, operation_ast, variables, operation_name)
+        return self.finish_request(result, extensions, cache_entry)
+
+    def get_response(self, request, data, show_graphiql=False):
+        """ Same as GraphQLView.get_response, plus the result extensions """
+        query, variables, operation_name, id = self.get_graphql_params(request, data)
+
+        execution_result = self.execute_graphql_request(
+            request, data, query, variables, operation_name, show_graphiql
+        )
+        return self.format_response(request, execution_result, id, show_graphiql)
+
+    def format_response(self, request, execution_result, id, show_graphiql=False):
+        if getattr(request, MUTATION_ERRORS_FLAG, False) is True:
+            set_rollback()
+
+        status_code = 200
+        if not execution_result:
+            return None, status_code
+
+        response = {}
+        if execution_result.errors:
+            set_rollback()
+            response["errors"] = [self.format_error(e) for e in execution_result.errors]
+
+        if execution_result.errors and any(not getattr(e, "path", None) for e in execution_result.errors):
+            status_code = 400
+        else:
+            response["data"] = execution_result.data
+
+        if execution_result.extensions:
+            response["extensions"] = execution_result.extensions
+
+        if self.batch:
+            response["id"] = id
+            response["status"] = status_code
+
+        return self.json_encode(request, response, pretty=show_graphiql), status_code
+
+    def finish_trace(self, request, result):
+        trace = getattr(request, 'graphql_trace', None)
+        if trace is None:
+            return result
+        trace.finish()
+        if app_setting('METRICS'):
+            get_metrics().record(trace)
+        if app_setting('QUERY_COUNT_DEBUG'):
+            check_budget(trace)
+        if request.graphql_tracing:
+            result.extensions = {**(result.extensions or {}), 'tracing': trace.as_apollo()}
+        return result
+
+    def traced_aliases(self, request):
+        # reads may go to a replica, writes always go to the primary
+        return {DEFAULT_DB_ALIAS, request.graphql_database}
+
+    def execute_document(self, request, document, operation_ast, variables, operation_name):
+        trace = getattr(request, 'graphql_trace', None)
+        with reading_from(request.graphql_database):
+            if trace is None:
+                return self.execute_plain(request, document, operation_ast, variables, operation_name)
+            with ExitStack() as stack:
+                for alias in self.traced_aliases(request):
+                    stack.enter_context(connections[alias].execute_wrapper(trace.execute_wrapper))
+                result = self.execute_plain(request, document, operation_ast, variables, operation_name)
+        return self.finish_trace(request, result)
+
+    def execute_plain(self, request, document, operation_ast, variables, operation_name, root=None):
+        schema = self.schema.graphql_schema
+        try:
+            execute_options = {
+                "root_value": self.get_root_value(request) if root is None else root,
+                "context_value": self.get_context(request),
+                "variable_values": variables,
+                "operation_name": operation_name,
+                "middleware": self.get_middleware(request),
+                "execution_context_class": self.execution_context_class,
+            }
+
+            if (
+                operation_ast is not None
+                and operation_ast.operation == OperationType.MUTATION
+                and (
+                    graphene_settings.ATOMIC_MUTATIONS is True
+                    or connection.settings_dict.get("ATOMIC_MUTATIONS", False) is True
+                )
+            ):
+                with transaction.atomic():
+                    result = execute(schema, document, **execute_options)
+                    if getattr(request, MUTATION_ERRORS_FLAG, False) is True:
+                        transaction.set_rollback(True)
+                return result
+
+            return execute(schema, document, **execute_options)
+        except Exception as e:
+            return ExecutionResult(errors=[e])
+
+
+
+class AsyncGraphQLView(CachedGraphQLView):
+    """ CachedGraphQLView for ASGI. Queries execute on the event loop with
+        async loaders, so sibling fields wait on the database concurrently;
+        mutations, GraphiQL and batches take the synchronous path on the
+        database thread. """
+
+    view_is_async = True
+    execution_context_class = AsyncBatchingExecutionContext
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            if request.method.lower() not in ("get", "post"):
+                raise HttpError(HttpResponseNotAllowed(["GET", "POST"], "GraphQL only supports GET and POST requests."))
+            data = self.parse_body(request)
+            if self.batch or (self.graphiql and self.can_display_graphiql(request, data)):
+                return await sync_to_async(super().dispatch)(request, *args, **kwargs)
+
+            query, variables, operation_name, id = self.get_graphql_params(request, data)
+            execution_result = await self.execute_graphql_request_async(request, data, query, variables, operation_name)
+            result, status_code = self.format_response(request, execution_result, id)
+            return HttpResponse(status=status_code, content=result, content_type="application/json")
+
+        except HttpError as e:
+            response = e.response
+            response["Content-Type"] = "application/json"
+            response.content = self.json_encode(request, {"errors": [self.format_error(e)]})
+            return response
+
+    def authenticate_request(self, request):
+        """ Resolves request.user up front, the JWT middleware would otherwise
+            query for it from inside the resolvers """
+        if request.user.is_anonymous and get_http_authorization(request) is not None:
+            try:
+                user = authenticate(request=request)
+            except JSONWebTokenError:
+                # left to the middleware, which reports it on the fields
+                user = None
+            if user is not None:
+                request.user = user
+
+    def prepare_request_sync(self, request, *args):
+        self.authenticate_request(request)
+        return self.prepare_request(request, *args)
+
+    async def execute_graphql_request_async(self, request, data, query, variables, operation_name):
+        result, plan = await sync_to_async(self.prepare_request_sync)(request, data, query, variables, operation_name)
+        if plan is None:
+            return result
+        document, operation_ast, extensions, cache_entry = plan
+        if operation_ast is not None and operation_ast.operation == OperationType.MUTATION:
+            result = await sync_to_async(self.execute_document)(request, document, operation_ast, variables, operation_name)
+        else:
+            result = await self.execute_document_async(request, document, variables, operation_name)
+        return await sync_to_async(self.finish_request)(result, extensions, cache_entry)
+
+    async def execute_document_async(self, request, document, variables, operation_name):
+        trace = getattr(request, 'graphql_trace', None)
+        with reading_from(request.graphql_database):
+            if trace is None:
+                return await self.execute_plain_async(request, document, variables, operation_name)
+            # the queries run on the database thread, whose connections get the wrapper
+            aliases = self.traced_aliases(request)
+            wrappers = await sync_to_async(lambda: [connections[alias].execute_wrappers for alias in aliases])()
+            for alias_wrappers in wrappers:
+                alias_wrappers.append(trace.execute_wrapper)
+            try:
+                result = await self.execute_plain_async(request, document, variables, operation_name)
+            finally:
+                for alias_wrappers in wrappers:
+                    alias_wrappers.remove(trace.execute_wrapper)
+        return self.finish_trace(request, result)
+
+    async def execute_plain_async(self, request, document, variables, operation_name):
+        context = self.get_context(request)
+        context.loaders = RequestLoaders(is_async=True)
+        try:
+            result = execute(
+                self.schema.graphql_schema, document,
+                root_value=self.get_root_value(request),
+                context_value=context,
+                variable_values=variables,
+                operation_name=operation_name,
+                middleware=self.get_middleware(request),
+                execution_context_class=self.execution_context_class,
+            )
+            if is_awaitable(result):
+                result = await result
+            return result
+        except Exception as e:
+            return ExecutionResult(errors=[e])
+
+
+
+def metrics_view(request):
+    """ Prometheus scrape endpoint, only served when METRICS is on """
+    if not app_setting('METRICS'):
+        raise Http404
+    return HttpResponse(get_metrics().render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+
+@require_GET
+def export_view(request, kind):
+    """ Streams an export to staff users as NDJSON or CSV. Takes since,
+        author, and after=<date>,<id> to resume past the last row received. """
+    if kind not in EXPORTS:
+        raise Http404
+    user = request.user
+    if not user.is_authenticated and get_http_authorization(request) is not None:
+        try:
+            user = authenticate(request=request) or user
+        except JSONWebTokenError:
+            pass
+    if not user.is_staff:
+        return HttpResponseForbidden("Exports are for staff users")
+
+    format = request.GET.get('format', 'ndjson')
+    if format not in FORMATS:
+        return HttpResponseBadRequest(f"format must be one of {', '.join(FORMATS)}")
+    try:
+        filters = {
+            'since': parse_since(request.GET['since']) if request.GET.get('since') else None,
+            'author': int(request.GET['author']) if request.GET.get('author') else None,
+            'after': parse_checkpoint(request.GET['after']) if request.GET.get('after') else None,
+        }
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+
+    chunks = stream(kind, format, **filters)
+    if isinstance(request, ASGIRequest):
+        chunks = stream_async(chunks)
+    response = StreamingHttpResponse(chunks, content_type=FORMATS[format])
+    response['Content-Disposition'] = f'attachment; filename="{kind}.{format}"'
+    return response
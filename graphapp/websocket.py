@@ -0,0 +1,247 @@
+import asyncio
+import json
+import time
+from asgiref.sync import sync_to_async
+from django.contrib.auth import authenticate
+from django.contrib.auth.models import AnonymousUser
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DEFAULT_DB_ALIAS, close_old_connections
+from django.http import HttpRequest
+from graphql import ExecutionResult, GraphQLError, OperationType, get_operation_ast, validate
+from graphql.execution import create_source_event_stream
+from graphql_jwt.exceptions import JSONWebTokenError
+from .conf import app_setting
+from .cost import query_cost_rule
+from .routing import read_database, reading_from
+from .views import CachedGraphQLView
+
+
+
+
+class GraphQLWebSocketApp:
+    """ ASGI app speaking the graphql-transport-ws protocol on one path.
+        Subscriptions stream an execution per event, queries and mutations
+        answer once. Documents share the HTTP view's cache and middleware. """
+
+    protocol = 'graphql-transport-ws'
+
+    def __init__(self, schema, path):
+        self.schema = schema
+        self.path = path
+        self.view = CachedGraphQLView(schema=schema)
+
+    async def __call__(self, scope, receive, send):
+        message = await receive()
+        if message['type'] != 'websocket.connect':
+            return
+        if scope['path'] != self.path or self.protocol not in scope.get('subprotocols', ()):
+            # closing before accepting answers the handshake with a 403
+            await send({'type': 'websocket.close'})
+            return
+        await send({'type': 'websocket.accept', 'subprotocol': self.protocol})
+        await WebSocketConnection(self, send).run(receive)
+
+
+
+class CloseConnection(Exception):
+
+    def __init__(self, code, reason):
+        super().__init__(reason)
+        self.code = code
+        self.reason = reason
+
+
+
+class WebSocketConnection:
+
+    def __init__(self, app, send):
+        self.app = app
+        self.send = send
+        self.user = AnonymousUser()
+        self.initialized = False
+        self.acknowledged = False
+        # time.monotonic() of the last mutation, the reads after it stay on the primary
+        self.wrote = None
+        # operation id -> task
+        self.operations = {}
+
+    async def run(self, receive):
+        timeout = asyncio.get_running_loop().call_later(
+            app_setting('WEBSOCKET_INIT_TIMEOUT'), lambda: asyncio.ensure_future(self.init_timeout()),
+        )
+        try:
+            while True:
+                message = await receive()
+                if message['type'] == 'websocket.disconnect':
+                    break
+                try:
+                    await self.handle(message.get('text') or message.get('bytes'))
+                except CloseConnection as e:
+                    await self.close(e.code, e.reason)
+                    break
+        finally:
+            timeout.cancel()
+            for task in self.operations.values():
+                task.cancel()
+
+    async def init_timeout(self):
+        if not self.initialized:
+            await self.close(4408, "Connection initialisation timeout")
+
+    async def close(self, code, reason):
+        for task in self.operations.values():
+            task.cancel()
+        await self.send({'type': 'websocket.close', 'code': code, 'reason': reason})
+
+    async def send_message(self, type, id=None, payload=None):
+        message = {'type': type}
+        if id is not None:
+            message['id'] = id
+        if payload is not None:
+            message['payload'] = payload
+        await self.send({'type': 'websocket.send', 'text': json.dumps(message, cls=DjangoJSONEncoder)})
+
+    async def handle(self, text):
+        try:
+            message = json.loads(text)
+            type = message['type']
+        except (TypeError, ValueError, KeyError):
+            raise CloseConnection(4400, "Invalid message")
+
+        if type == 'connection_init':
+            if self.initialized:
+                raise CloseConnection(4429, "Too many initialisation requests")
+            self.initialized = True
+            await self.authenticate(message.get('payload') or {})
+            self.acknowledged = True
+            await self.send_message('connection_ack')
+        elif type == 'ping':
+            await self.send_message('pong')
+        elif type == 'pong':
+            pass
+        elif type == 'subscribe':
+            if not self.acknowledged:
+                raise CloseConnection(4401, "Unauthorized")
+            id = message.get('id')
+            if not isinstance(id, str) or not isinstance(message.get('payload'), dict):
+                raise CloseConnection(4400, "Invalid subscribe message")
+            if id in self.operations:
+                raise CloseConnection(4409, f"Subscriber for {id} already exists")
+            self.operations[id] = asyncio.ensure_future(self.run_operation(id, message['payload']))
+        elif type == 'complete':
+            task = self.operations.pop(message.get('id'), None)
+            if task is not None:
+                task.cancel()
+        else:
+            raise CloseConnection(4400, f"Unknown message type {type}")
+
+    async def authenticate(self, payload):
+        """ Authenticates with the Authorization value of the connection_init
+            payload, the same header the HTTP endpoint takes """
+        authorization = payload.get('Authorization') or payload.get('authorization')
+        if not authorization:
+            return
+        request = HttpRequest()
+        request.META['HTTP_AUTHORIZATION'] = authorization
+        try:
+            user = await sync_to_async(authenticate)(request=request)
+        except JSONWebTokenError:
+            user = None
+        if user is None:
+            raise CloseConnection(4403, "Forbidden")
+        self.user = user
+
+    def context(self):
+        """ A request per execution, so loaders never outlive one """
+        request = HttpRequest()
+        request.method = 'POST'
+        request.user = self.user
+        # a socket has no cookie to pin its client with, the connection does
+        if self.wrote is not None and time.monotonic() - self.wrote < (app_setting('READ_YOUR_WRITES_SECONDS') or 0):
+            request.graphql_wrote = True
+        return request
+
+    def execute(self, document, variables, operation_name, root=None):
+        """ Executes like the HTTP view: mutations run in a transaction under
+            ATOMIC_MUTATIONS and on the primary, queries may read a replica.
+            The events of a subscription are read from the primary, which
+            published them on commit. """
+        close_old_connections()
+        try:
+            request = self.context()
+            operation_ast = get_operation_ast(document, operation_name)
+            database = DEFAULT_DB_ALIAS if root is not None else read_database(request, operation_ast)
+            with reading_from(database):
+                result = self.app.view.execute_plain(request, document, operation_ast, variables, operation_name, root)
+            if operation_ast is not None and operation_ast.operation == OperationType.MUTATION:
+                self.wrote = time.monotonic()
+            return result
+        finally:
+            close_old_connections()
+
+    def format_result(self, result):
+        payload = {'data': result.data}
+        if result.errors:
+            payload['errors'] = [self.app.view.format_error(e) for e in result.errors]
+        return payload
+
+    async def execute_event(self, event, document, variables, operation_name):
+        """ The serialized result of one event; subscribers with the same
+            document, variables and user share a single execution """
+        key = (id(document), json.dumps(variables, sort_keys=True), operation_name, self.user.pk)
+        task = event.results.get(key)
+        if task is None:
+            def run():
+                payload = self.format_result(self.execute(document, variables, operation_name, event))
+                return json.dumps(payload, cls=DjangoJSONEncoder)
+            task = event.results[key] = asyncio.ensure_future(sync_to_async(run)())
+        # one subscriber leaving must not cancel the others' result
+        return await asyncio.shield(task)
+
+    async def run_operation(self, id, payload):
+        try:
+            result = await self.execute_operation(id, payload)
+            if result is not None:
+                if result.errors and result.data is None:
+                    await self.send_message('error', id, [self.app.view.format_error(e) for e in result.errors])
+                    return
+                await self.send_message('next', id, self.format_result(result))
+            await self.send_message('complete', id)
+        finally:
+            self.operations.pop(id, None)
+
+    async def execute_operation(self, id, payload):
+        """ Streams the events of a subscription and returns None, or returns
+            the single result of any other operation """
+        query = payload.get('query')
+        variables = payload.get('variables') or {}
+        operation_name = payload.get('operationName')
+        if not query:
+            return ExecutionResult(errors=[GraphQLError("Must provide query string.")])
+
+        document, errors = self.app.view.get_document(query)
+        if document is None or errors:
+            return ExecutionResult(errors=errors)
+        operation_ast = get_operation_ast(document, operation_name)
+        errors = validate(self.app.schema.graphql_schema, document, [query_cost_rule(variables, {})])
+        if errors:
+            return ExecutionResult(errors=errors)
+        if operation_ast is None or operation_ast.operation != OperationType.SUBSCRIPTION:
+            return await sync_to_async(self.execute)(document, variables, operation_name)
+
+        stream = await create_source_event_stream(
+            self.app.schema.graphql_schema, document,
+            context_value=self.context(),
+            variable_values=variables,
+            operation_name=operation_name,
+        )
+        if isinstance(stream, ExecutionResult):
+            return stream
+        try:
+            async for event in stream:
+                text = await self.execute_event(event, document, variables, operation_name)
+                await self.send({'type': 'websocket.send', 'text': f'{{"type": "next", "id": {json.dumps(id)}, "payload": {text}}}'})
+        finally:
+            if hasattr(stream, 'aclose'):
+                await stream.aclose()
+        return None
@@ -13,4 +13,18 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'graphpro.settings')
 
-application = get_asgi_application()
+# served here, /api/graphql/async runs queries on the event loop (graphapp.views.AsyncGraphQLView)
+django_application = get_asgi_application()
+
+# imported once django is set up
+from graphapp.schema import schema
+from graphapp.websocket import GraphQLWebSocketApp
+
+# GraphQL subscriptions, over the graphql-transport-ws protocol
+websocket_application = GraphQLWebSocketApp(schema, path='/api/graphql')
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'websocket':
+        return await websocket_application(scope, receive, send)
+    return await django_application(scope, receive, send)
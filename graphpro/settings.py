@@ -63,6 +63,7 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'graphapp.routing.ReadYourWritesMiddleware',
 ]
 CORS_ALLOW_ALL_ORIGINS = True
 
@@ -76,10 +77,27 @@ JAZZMIN_SETTINGS = {
 GRAPHENE = {
     'SCHEMA': 'myapp.schema.schema',
     "MIDDLEWARE": [
-        "graphql_jwt.middleware.JSONWebTokenMiddleware",
+        "graphapp.auth.JSONWebTokenMiddleware",
+        "graphapp.instrumentation.InstrumentationMiddleware",
     ],
 }
 
+GRAPHAPP = {
+    "LIST_MAX_ITEMS": 500,
+    "LIST_OVERFLOW": "truncate",
+    "DOCUMENT_CACHE_SIZE": 1000,
+    "PERSISTED_QUERIES_ALLOWLIST": os.getenv('PERSISTED_QUERIES_ALLOWLIST'),
+    "QUERY_MAX_COST": 10000,
+    "QUERY_MAX_DEPTH": 10,
+    "FIELD_COSTS": {
+        "Query.allPosts": 2,
+        "PostType.comments": 2,
+        "AuthorType.postSet": 2,
+    },
+    "RESPONSE_CACHE_TIMEOUT": 60,
+    "TRACING": DEBUG,
+}
+
 GRAPHQL_JWT = {
     "JWT_AUTH_HEADER_PREFIX": "Bearer",
     "JWT_VERIFY_EXPIRATION": True,
@@ -91,7 +109,7 @@ GRAPHQL_JWT = {
 }
 
 AUTHENTICATION_BACKENDS = [
-    "graphql_jwt.backends.JSONWebTokenBackend",
+    "graphapp.auth.JSONWebTokenBackend",
     "django.contrib.auth.backends.ModelBackend",
 ]
 
@@ -128,9 +146,29 @@ DATABASES = {
            'PASSWORD': env('DB_PASSWORD'),
            'HOST': env('DB_HOST'),
            'PORT': env('DB_PORT'),
+           # connections are kept open between requests, and checked before reuse
+           'CONN_MAX_AGE': env.int('DB_CONN_MAX_AGE', default=60),
+           'CONN_HEALTH_CHECKS': env.bool('DB_CONN_HEALTH_CHECKS', default=True),
+           # a pooler in transaction mode (PgBouncer) can't keep server-side cursors open
+           'DISABLE_SERVER_SIDE_CURSORS': env.bool('DB_POOLER', default=False),
        }
    }
 
+# GraphQL queries read from the replica when it is configured. Without
+# DB_REPLICA_HOST the alias is a second connection to the primary, enough
+# to try the routing locally, and reads stay on the primary.
+DATABASES['replica'] = {
+    **DATABASES['default'],
+    'HOST': env('DB_REPLICA_HOST', default=env('DB_HOST')),
+    'PORT': env('DB_REPLICA_PORT', default=env('DB_PORT')),
+    'TEST': {'MIRROR': 'default'},
+}
+
+DATABASE_ROUTERS = ['graphapp.routing.ReplicaRouter']
+
+if env('DB_REPLICA_HOST', default=''):
+    GRAPHAPP['READ_REPLICAS'] = ['replica']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
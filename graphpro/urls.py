@@ -1,7 +1,9 @@
 from django.contrib import admin
 from django.urls import path , include
+from graphapp.views import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path('api/' , include('graphapp.urls'))
+    path('api/' , include('graphapp.urls')),
+    path('metrics', metrics_view),
 ]